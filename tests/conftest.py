@@ -0,0 +1,19 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def tw():
+    """Moduł widgetu (plik z myślnikiem w nazwie - ładowany ze ścieżki)."""
+    module = sys.modules.get("timechain_widget")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("timechain_widget", os.path.join(ROOT, "timechain-widget.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["timechain_widget"] = module
+        spec.loader.exec_module(module)
+    return module
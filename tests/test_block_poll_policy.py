@@ -0,0 +1,63 @@
+# Dawna bramka: odpytanie wysokości i hasha raz na CACHE_TIME_SECONDS = 60 s
+BASELINE_GATE_SECONDS = 60
+BASELINE_REQUESTS_PER_HOUR = 2 * 3600 // BASELINE_GATE_SECONDS
+
+
+def simulate_hour(tw, block_times):
+    """Symuluje godzinę odpytywania (odpowiedzi natychmiastowe). Zwraca (żądania, odpowiedzi z treścią, opóźnienia wykrycia)."""
+    policy = tw.BlockPollPolicy()
+    height, block_hash = 800000, "h800000"
+    pending_blocks = sorted(block_times)
+    requests = body_responses = 0
+    last_height_response = None
+    latencies = []
+    now = 0.0
+    while now <= 3600:
+        while pending_blocks and pending_blocks[0] <= now:
+            block_at = pending_blocks.pop(0)
+            height, block_hash = height + 1, f"h{height + 1}"
+            latencies.append([block_at, None])
+        for key in policy.due(now):
+            policy.mark_requested(key)
+            requests += 1
+            value = str(height) if key == 'height' else block_hash
+            if key == 'hash' or value != last_height_response:
+                body_responses += 1 # Zmieniona treść - inaczej 304 bez treści
+            if key == 'height':
+                last_height_response = value
+                for entry in latencies:
+                    if entry[1] is None:
+                        entry[1] = now - entry[0]
+            policy.on_result(key, value, now)
+        now += max(policy.next_due_in(now), 0.001)
+    return requests, body_responses, [latency for _, latency in latencies]
+
+
+def test_worst_case_detection_latency_beats_baseline(tw):
+    # Bloki tuż po sobie i w różnych fazach odstępu odpytywania
+    block_times = [0.5, 3.2, 61.0, 62.9, 600.0, 1804.4, 3000.1]
+    _, _, latencies = simulate_hour(tw, block_times)
+    assert None not in latencies
+    assert max(latencies) <= tw.POLL_INTERVAL_SECONDS
+    assert max(latencies) < BASELINE_GATE_SECONDS / 4
+
+
+def test_requests_per_hour_against_baseline(tw):
+    block_times = [600.0 * i + 17.0 for i in range(6)] # Średnio 6 bloków na godzinę
+    requests, body_responses, _ = simulate_hour(tw, block_times)
+    # Żądania warunkowe: treść przesyłana tylko po nowym bloku (wysokość + hash) - znacznie poniżej bazowych 120/h
+    assert body_responses <= 2 * (len(block_times) + 1) # +1: pierwsze pobranie wysokości i hasha
+    assert body_responses < BASELINE_REQUESTS_PER_HOUR / 4
+    # Łączna liczba żądań ograniczona stałym odstępem (większość to tanie 304)
+    assert requests <= 3600 / tw.POLL_INTERVAL_SECONDS + 2 * len(block_times) + 2
+
+
+def test_errors_back_off_exponentially_up_to_cap(tw):
+    policy = tw.BlockPollPolicy(interval=5, backoff_max=60)
+    intervals = []
+    for _ in range(6):
+        policy.on_result('height', None, 0.0)
+        intervals.append(policy.height_interval(0.0))
+    assert intervals == [10, 20, 40, 60, 60, 60]
+    policy.on_result('height', "800000", 0.0)
+    assert policy.height_interval(0.0) == 5
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+# Kolorowe tła (RGB) - kanały ważone bardzo różnie, więc inna formuła jasności dałaby inne wartości
+COLOURED_BACKGROUNDS = [
+    (0, 0, 255), (255, 0, 0), (0, 255, 0), (255, 255, 0), (0, 255, 255), (255, 0, 255),
+    (255, 255, 255), (0, 0, 0), (128, 128, 128), (230, 230, 230), (255, 255, 180),
+    (180, 255, 255), (255, 200, 255), (200, 220, 160), (40, 90, 200),
+]
+
+
+def make_grabber(tw, image):
+    class StaticScreenGrabber(tw.ScreenGrabber):
+        name = "static"
+
+        def size(self):
+            return image.size
+
+        def grab_image(self, region=None):
+            if region is None:
+                return image.copy()
+            x, y, width, height = region
+            return image.crop((x, y, x + width, y + height))
+
+    return StaticScreenGrabber()
+
+
+def baseline_brightness(image, center_x, center_y):
+    """Dawny pomiar: wycinek AUTO_COLOR_SAMPLE_SIZE przekonwertowany do "L" i uśredniony."""
+    half_sample = 20 // 2
+    crop = image.crop((center_x - half_sample, center_y - half_sample, center_x + half_sample, center_y + half_sample))
+    return float(np.mean(np.array(crop.convert("L"))))
+
+
+def measure(tw, image, hysteresis=0):
+    sampler = tw.BackgroundBrightnessSampler(make_grabber(tw, image), sample_size=20, hysteresis=hysteresis)
+    sampler.screen_size = image.size
+    return sampler, sampler.measure(50, 50)
+
+
+@pytest.mark.parametrize("rgb", COLOURED_BACKGROUNDS)
+def test_brightness_matches_baseline_luma(tw, rgb):
+    image = Image.new("RGB", (100, 100), rgb)
+    _, brightness = measure(tw, image)
+    assert brightness == pytest.approx(baseline_brightness(image, 50, 50), abs=0.5)
+
+
+@pytest.mark.parametrize("rgb", COLOURED_BACKGROUNDS)
+def test_invert_decision_matches_baseline(tw, rgb):
+    image = Image.new("RGB", (100, 100), rgb)
+    sampler, brightness = measure(tw, image)
+    baseline_inverted = baseline_brightness(image, 50, 50) > tw.AUTO_COLOR_BRIGHTNESS_THRESHOLD
+    assert sampler.update(brightness) == baseline_inverted
+
+
+def test_mixed_colour_sample_matches_baseline(tw):
+    rng = np.random.default_rng(7)
+    image = Image.fromarray(rng.integers(0, 256, size=(100, 100, 3), dtype=np.uint8), "RGB")
+    _, brightness = measure(tw, image)
+    assert brightness == pytest.approx(baseline_brightness(image, 50, 50), abs=0.5)
+
+
+def test_hysteresis_holds_decision_near_threshold(tw):
+    threshold, hysteresis = tw.AUTO_COLOR_BRIGHTNESS_THRESHOLD, tw.AUTO_COLOR_HYSTERESIS
+    sampler = tw.BackgroundBrightnessSampler(make_grabber(tw, Image.new("RGB", (1, 1))))
+    assert sampler.update(threshold + hysteresis / 2) is False
+    assert sampler.update(threshold + hysteresis + 1) is True
+    assert sampler.update(threshold - hysteresis / 2) is True
+    assert sampler.update(threshold - hysteresis - 1) is False
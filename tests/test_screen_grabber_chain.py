@@ -0,0 +1,64 @@
+import pytest
+
+
+def make_grabber(tw, name, failures=0):
+    """Backend, którego pierwsze `failures` wywołań size() kończy się błędem."""
+    class FlakyScreenGrabber(tw.ScreenGrabber):
+        def __init__(self):
+            self.name = name
+            self.remaining_failures = failures
+            self.calls = 0
+            self.closed = False
+
+        def size(self):
+            self.calls += 1
+            if self.remaining_failures:
+                self.remaining_failures -= 1
+                raise OSError(f"{name}: chwilowy błąd")
+            return (100, 100)
+
+        def close(self):
+            self.closed = True
+
+    return FlakyScreenGrabber()
+
+
+def test_transient_error_is_retried_on_same_backend(tw):
+    primary, fallback = make_grabber(tw, "primary", failures=1), make_grabber(tw, "fallback")
+    chain = tw.ScreenGrabberChain([primary, fallback])
+    assert chain.size() == (100, 100)
+    assert (primary.calls, fallback.calls) == (2, 0)
+    assert chain.name == "primary" and not primary.closed
+
+
+def test_failed_call_uses_fallback_without_demoting(tw):
+    primary, fallback = make_grabber(tw, "primary", failures=2), make_grabber(tw, "fallback")
+    chain = tw.ScreenGrabberChain([primary, fallback], demote_after=3)
+    assert chain.size() == (100, 100)
+    assert fallback.calls == 1
+    assert chain.name == "primary" and not primary.closed
+    assert chain.size() == (100, 100) # Backend wrócił do działania - licznik błędów zerowany
+    assert primary.calls == 3
+
+
+def test_backend_demoted_after_consecutive_failures(tw, caplog):
+    primary, fallback = make_grabber(tw, "primary", failures=10 ** 6), make_grabber(tw, "fallback")
+    chain = tw.ScreenGrabberChain([primary, fallback], demote_after=3)
+    for _ in range(2):
+        chain.size()
+        assert chain.name == "primary"
+    with caplog.at_level("WARNING"):
+        chain.size()
+    assert chain.name == "fallback" and primary.closed
+    assert any("zdegradowany" in r.getMessage() and "chwilowy błąd" in r.getMessage() and r.levelname == "WARNING"
+               for r in caplog.records)
+    calls = primary.calls
+    chain.size()
+    assert primary.calls == calls
+
+
+def test_last_backend_error_is_raised(tw):
+    chain = tw.ScreenGrabberChain([make_grabber(tw, "only", failures=2)])
+    with pytest.raises(OSError):
+        chain.size()
+    assert chain.size() == (100, 100)
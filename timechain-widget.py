@@ -17,16 +17,28 @@ Nowości w v6.8.10:
 import os
 import sys
 import time
+_STARTUP_STARTED = time.perf_counter() # Początek startu procesu (pomiar czasu do pierwszego wyświetlenia)
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
 import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import simpledialog, Menu, Label, messagebox, StringVar, BooleanVar
 import logging
 import tempfile
+import json
 import threading
+import queue
 import math
+import struct
+import socket
+import mmap
+import ctypes
+import ctypes.util
 import platform
 import random
+import concurrent.futures
+from collections import OrderedDict, deque
 from typing import Optional, Tuple, List, Dict, Any
 import numpy as np
 import cv2
@@ -53,7 +65,7 @@ except ImportError:
     logging.warning("Brak modułu pyautogui. Podstawowa funkcjonalność przechwytywania może być ograniczona.")
 
 try:
-    from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageColor, PngImagePlugin
+    from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageColor, PngImagePlugin, GifImagePlugin
     try:
         from PIL import ImageGrab # ImageGrab może być w osobnym pakiecie lub niedostępny
         IMAGEGRAB_AVAILABLE = True
@@ -96,7 +108,7 @@ try:
     HAVE_PYNPUT = True
     logging.debug("Moduł pynput zaimportowany.")
 except ImportError:
-    logging.warning("Brak pynput. Skróty klawiszowe (PrintScreen, F9, F10) nie będą działać.")
+    logging.warning("Brak pynput. Skróty klawiszowe (PrintScreen, F9, F10, F8) nie będą działać.")
     # Definicja atrap, aby reszta kodu się nie wywalała
     class DummyKey:
         def __init__(self, name): self.name = name
@@ -108,6 +120,7 @@ except ImportError:
             print_screen = DummyKey('print_screen')
             f9 = DummyKey('f9')
             f10 = DummyKey('f10')
+            f8 = DummyKey('f8')
         class Listener:
             def __init__(self, on_press=None, on_release=None, suppress=False):
                 self._on_press = on_press
@@ -119,6 +132,17 @@ except ImportError:
             def __enter__(self): return self
             def __exit__(self, *args): pass
 
+# Import websocket-client (opcjonalny - powiadomienia push o nowych blokach przez WebSocket)
+HAVE_WEBSOCKET = False
+try:
+    import websocket
+    HAVE_WEBSOCKET = True
+    logging.debug("Moduł websocket-client zaimportowany.")
+except ImportError:
+    logging.debug("Brak modułu websocket-client. Źródła push ws:// i wss:// nie będą dostępne.")
+
+_STARTUP_IMPORTS_DONE = time.perf_counter()
+
 # --- Obsługa DPI (Windows) ---
 if platform.system() == "Windows":
     try:
@@ -147,8 +171,26 @@ if platform.system() == "Windows":
 # --- Konfiguracja ---
 VERSION = "6.8.10" # Zaktualizowana wersja z poprawkami
 CACHE_DIR_NAME = "timechain_widget_cache"
-CACHE_TIME_SECONDS = 60
+FONT_INDEX_FILENAME = "font_index.json" # Indeks plików czcionek w katalogu cache
+API_CACHE_FILENAME = "api_cache.json" # Wspólny plik cache wszystkich pól API (zapis atomowy)
+FONT_INDEX_VERSION = 1
+TEXT_MEASURE_CACHE_SIZE = 256 # Liczba zapamiętanych szerokości linii tekstu (łącznie dla wszystkich czcionek, LRU)
+BLOCK_INDEX_FILENAME = "block_index.bin" # Indeks wysokość -> hash/czas bloku w katalogu cache
+BLOCK_INDEX_GROW_RECORDS = 4096 # O ile rekordów powiększany jest plik indeksu bloków
+CACHE_TIME_SECONDS = 60 # Wiek danych z cache akceptowany przy starcie (potem decyduje harmonogram odpytywania)
 API_TIMEOUT_SECONDS = 10
+FETCH_SCHEDULER_WORKERS = 2 # Stała liczba wątków pobierających dane z API (jeden na endpoint)
+HTTP_POOL_MAXSIZE = 4 # Maksymalna liczba utrzymywanych połączeń keep-alive na host
+POLL_INTERVAL_SECONDS = 5 # Odstęp odpytywania wysokości (żądanie warunkowe - bez nowego bloku serwer odpowiada 304 bez treści)
+POLL_BACKOFF_MAX_SECONDS = 60 # Górny limit odstępu po kolejnych błędach (backoff wykładniczy, nie dłużej niż dawna bramka 60 s)
+HASH_RETRY_LIMIT = 5 # Ile razy ponowić pobranie hasha, który jeszcze nie zmienił się po nowej wysokości
+TIP_PUSH_SOURCE = None # Źródło powiadomień push o blokach, np. 'wss://mempool.space/api/v1/ws', 'unix:///tmp/timechain-tip.sock', 'tcp://127.0.0.1:28400'
+TIP_PUSH_RECONNECT_MAX_SECONDS = 60 # Górny limit odstępu między próbami ponownego połączenia ze źródłem push
+NODE_RPC_URL = None # Lokalny węzeł Bitcoin (JSON-RPC), np. 'http://127.0.0.1:8332/' - zastępuje publiczne API
+NODE_RPC_USER = None # Użytkownik RPC (rpcuser); bez niego używany jest plik cookie węzła
+NODE_RPC_PASSWORD = None # Hasło RPC (rpcpassword)
+NODE_RPC_COOKIE_FILE = os.path.join(os.path.expanduser("~"), ".bitcoin", ".cookie") # Plik .cookie węzła (uwierzytelnianie domyślne)
+TIP_PUSH_SAFETY_POLL_SECONDS = 0 # Odpytywanie wysokości mimo aktywnego push (0 = brak żądań, gdy push działa)
 FONT_FAMILY = "Segoe UI"  # Domyślna czcionka, może być potrzebna ścieżka w niektórych systemach
 BASE_FONT_SIZE = 15
 FONT_WEIGHT = "bold"
@@ -157,47 +199,2140 @@ DEFAULT_SHADOW_COLOR = "#333333"
 SHADOW_OFFSET_X = 1
 SHADOW_OFFSET_Y = 1
 TRANSPARENT_COLOR = '#f0f0f0'  # Kolor tła, który staje się przezroczysty
+TEXT_RENDERER_LABELS = 'labels' # Dwie etykiety Tk (tekst + cień)
+TEXT_RENDERER_CANVAS = 'canvas' # Tekst i cień jako dwa elementy jednego Canvas
+TEXT_RENDERER = TEXT_RENDERER_LABELS
 INITIAL_WINDOW_POSITION = "+100+100"
 BLOCK_HEIGHT_URL = "https://blockstream.info/api/blocks/tip/height"
 BLOCK_HASH_URL = "https://blockchain.info/q/latesthash"
+# Dostawcy zapasowi (pierwszy adres na liście to klucz cache danego pola)
+BLOCK_HEIGHT_URLS = [BLOCK_HEIGHT_URL, "https://mempool.space/api/blocks/tip/height"]
+BLOCK_HASH_URLS = [BLOCK_HASH_URL, "https://mempool.space/api/blocks/tip/hash", "https://blockstream.info/api/blocks/tip/hash"]
+# Hash bloku na danej wysokości u jednego dostawcy - weryfikuje parę z dwóch endpointów przed zapisem do indeksu bloków
+BLOCK_HASH_AT_HEIGHT_URLS = ["https://blockstream.info/api/block-height/{height}", "https://mempool.space/api/block-height/{height}"]
+PROVIDER_FETCH_WORKERS = 4 # Wątki wykonujące żądania do dostawców (w tym żądania zabezpieczające)
+PROVIDER_LATENCY_WINDOW = 50 # Liczba ostatnich czasów odpowiedzi do wyliczania p95
+PROVIDER_EWMA_ALPHA = 0.3 # Waga nowej próbki w średniej wykładniczej czasu odpowiedzi (ranking)
+PROVIDER_HEDGE_DEFAULT_DELAY_SECONDS = 1.0 # Opóźnienie żądania zabezpieczającego, zanim zbierze się próbka p95
+PROVIDER_HEDGE_MIN_DELAY_SECONDS = 0.1 # Dolny limit opóźnienia żądania zabezpieczającego
+PROVIDER_BREAKER_FAILURES = 3 # Kolejne błędy, po których dostawca jest wyłączany (circuit breaker)
+PROVIDER_BREAKER_COOLDOWN_SECONDS = 60 # Czas wyłączenia dostawcy przed próbą ponownego użycia
 
 ENABLE_DRAG_SCALING = True
 MAX_SCALE_INCREASE = 0.3 # Maksymalne powiększenie czcionki podczas przeciągania (30%)
 SCALE_DISTANCE_FACTOR = 400 # Odległość w pikselach powodująca MAX_SCALE_INCREASE
 MIN_SCALED_FONT_SIZE = 10 # Minimalny rozmiar czcionki po skalowaniu
+DRAG_FRAME_INTERVAL_MS = 16 # Najkrótszy odstęp między klatkami przeciągania (~60 Hz); ruchy myszy są łączone
+DRAG_SCALE_MAX_STEP = 2 # Maksymalna zmiana rozmiaru czcionki na klatkę (płynne dojście do docelowej skali)
 
 SCREENSHOT_MODE_WIDGET = 'widget'
 SCREENSHOT_MODE_WATERMARK = 'watermark'
 DEFAULT_SCREENSHOT_MODE = SCREENSHOT_MODE_WIDGET
+CAPTURE_AREA_FULLSCREEN = 'fullscreen' # Obszar przechwytywania: cały ekran
+CAPTURE_AREA_WIDGET = 'widget_area' # Obszar przechwytywania: okolica widgetu (z marginesem)
+CAPTURE_AREA_REGION = 'region' # Obszar przechwytywania: prostokąt zaznaczony myszą
+DEFAULT_CAPTURE_AREA = CAPTURE_AREA_FULLSCREEN
+CAPTURE_WIDGET_AREA_MARGIN = 150 # Margines (px) wokół widgetu w trybie 'okolica widgetu'
+CAPTURE_REGION_MIN_SIZE = 16 # Minimalny bok zaznaczanego obszaru (px)
 DEFAULT_WATERMARK_STYLE = "1" # 1: Center, 3: Grid(3), 5: Grid(5), 8: Grid(8)
 WATERMARK_ANGLE = 33 # Kąt obrotu znaku wodnego
 WATERMARK_OPACITY = 75 # Przezroczystość znaku wodnego w procentach (0-100)
 WATERMARK_FONT_SIZE = 30 # Rozmiar czcionki znaku wodnego
+WATERMARK_STAMP_CACHE_SIZE = 8 # Maksymalna liczba wyrenderowanych stempli trzymanych w cache (LRU)
 
 DEFAULT_VIDEO_DURATION_SECONDS = 10
 DEFAULT_GIF_DURATION_SECONDS = 7
 GIF_FRAME_DURATION_MS = 100 # Czas trwania klatki GIF w milisekundach
+GIF_ENCODER_QUEUE_SIZE = 4 # Maksymalna liczba klatek GIF czekających na kodowanie (ogranicza pamięć)
+GIF_GLOBAL_PALETTE = True # Jedna wspólna paleta dla wszystkich klatek (szybciej, bez migotania kolorów)
+GIF_PALETTE_SAMPLE_FRAMES = 4 # Liczba pierwszych klatek, z których budowana jest paleta globalna
+GIF_PALETTE_MAX_SAMPLE_PIXELS = 250_000 # Limit pikseli próbki do budowy palety
+GIF_PALETTE_LUT_BITS = 5 # Bity na składową w tablicy LUT mapowania kolorów (5 -> 32768 wpisów)
+GIF_DELTA_FRAMES = True # Zapisuj tylko zmieniony prostokąt klatki (wymaga palety globalnej)
+GIF_TRANSPARENT_INDEX = 255 # Indeks palety zarezerwowany na przezroczystość w klatkach różnicowych
 CAPTURE_SUBDIR = "Timechain_Captures" # Nazwa podkatalogu na zapisy
+VIDEO_PIPELINE_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1)) # Wątki nakładające znak wodny na klatki wideo
+VIDEO_PIPELINE_QUEUE_SIZE = 8 # Maksymalna liczba klatek oczekujących w każdej kolejce potoku wideo
 VIDEO_FOURCC = "mp4v" # Kodek dla MP4 (może wymagać instalacji kodeków systemowych), inne opcje: 'XVID', 'MJPG'
+REPLAY_ENABLED_BY_DEFAULT = False # Czy bufor natychmiastowej powtórki nagrywa od startu widgetu
+REPLAY_BUFFER_SECONDS = 30 # Długość bufora powtórki (ostatnie N sekund ekranu)
+REPLAY_FPS = 10.0 # Częstotliwość próbkowania klatek do bufora powtórki
+REPLAY_MAX_BUFFER_BYTES = 192 * 1024 * 1024 # Budżet pamięci bufora powtórki (skompresowane klatki)
+REPLAY_MAX_FRAME_WIDTH = 1920 # Szersze klatki są pomniejszane przed kompresją
+REPLAY_JPEG_QUALITY = 80 # Jakość JPEG klatek w buforze powtórki (0-100)
+REPLAY_OUTPUT_FORMAT = "video" # Format zapisu powtórki: 'video' (VideoWriter) lub 'gif'
 
 ENABLE_AUTO_COLOR_INVERSION = True # Czy automatycznie odwracać kolor tekstu na ciemny na jasnym tle
 AUTO_COLOR_BRIGHTNESS_THRESHOLD = 200 # Próg jasności (0-255), powyżej którego kolor jest odwracany
 INVERTED_TEXT_COLOR = DEFAULT_SHADOW_COLOR # Kolor tekstu na jasnym tle
 INVERTED_SHADOW_COLOR = DEFAULT_TEXT_COLOR # Kolor cienia na jasnym tle
 AUTO_COLOR_SAMPLE_SIZE = 20 # Rozmiar kwadratu (w pikselach) pod kursorem do próbkowania jasności
+AUTO_COLOR_HYSTERESIS = 12 # Margines wokół progu jasności - szum tła nie przełącza kolorów tam i z powrotem
+AUTO_COLOR_CHECK_INTERVAL_MS = 10000 # Odstęp okresowego sprawdzania jasności tła
+CLOCK_TICK_MARGIN_MS = 5 # Tick zegara wypada tyle ms po pełnej sekundzie (zapas na dokładność timera)
+
+SCREEN_GRAB_BACKEND = "auto" # 'auto' (XShm na Linux/X11, potem pyautogui, ImageGrab), 'xshm', 'pyautogui', 'imagegrab'
+SCREEN_GRAB_DEMOTE_FAILURES = 3 # Kolejne nieudane wywołania (każde z jedną powtórką), po których backend jest trwale degradowany
+XSHM_IMAGE_CACHE_SIZE = 4 # Ile obrazów SHM (po jednym na rozmiar obszaru) trzymać naraz (cały ekran, widget, próbka jasności...)
+
+# --- Backendy Przechwytywania Ekranu ---
+class ScreenGrabber:
+    """Bazowy backend przechwytywania ekranu.
+
+    Region to krotka (x, y, szerokość, wysokość) jak w pyautogui. Tablice zwracane
+    przez grab_bgra() mogą być widokiem na wewnętrzny bufor - są ważne do następnego wywołania.
+    grab_bgr() może pisać do tablicy `out` wywołującego (gdy ma pasujący kształt) - zawsze używaj wyniku.
+    """
+    name = "base"
+
+    def size(self) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    def grab_image(self, region: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        """Zwraca zrzut jako nowy obraz PIL (RGB)."""
+        raise NotImplementedError
+
+    def grab_bgra(self, region: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        """Zwraca zrzut jako tablicę BGRA (h, w, 4)."""
+        return cv2.cvtColor(np.asarray(self.grab_image(region)), cv2.COLOR_RGB2BGRA)
+
+    def grab_bgr(self, region: Optional[Tuple[int, int, int, int]] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Zwraca zrzut jako ciągłą tablicę BGR (h, w, 3) - format klatek OpenCV (w `out`, jeśli pasuje)."""
+        return cv2.cvtColor(np.asarray(self.grab_image(region)), cv2.COLOR_RGB2BGR, dst=out)
+
+    def close(self) -> None:
+        pass
+
+
+class PyAutoGuiScreenGrabber(ScreenGrabber):
+    """Przechwytywanie przez pyautogui.screenshot() (wolne, ale przenośne)."""
+    name = "pyautogui"
+
+    def size(self) -> Tuple[int, int]:
+        width, height = pyautogui.size()
+        return int(width), int(height)
+
+    def grab_image(self, region: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        img = pyautogui.screenshot(region=region) if region else pyautogui.screenshot()
+        if img is None:
+            raise RuntimeError("pyautogui.screenshot() zwróciło None.")
+        return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+class ImageGrabScreenGrabber(ScreenGrabber):
+    """Przechwytywanie przez PIL.ImageGrab.grab()."""
+    name = "ImageGrab"
+
+    def __init__(self):
+        self._size: Optional[Tuple[int, int]] = None
+
+    def size(self) -> Tuple[int, int]:
+        if self._size is None:
+            # ImageGrab nie udostępnia rozmiaru ekranu - jednorazowy pełny zrzut
+            self._size = self.grab_image().size
+        return self._size
+
+    def grab_image(self, region: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        if region:
+            x, y, w, h = region
+            img = ImageGrab.grab(bbox=(x, y, x + w, y + h))
+        else:
+            img = ImageGrab.grab()
+        if img is None:
+            raise RuntimeError("ImageGrab.grab() zwróciło None.")
+        return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int),
+                ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int)]
+
+
+class _XImage(ctypes.Structure):
+    # Tylko początkowe pola struktury XImage - odczytujemy je przez wskaźnik
+    _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int),
+                ("format", ctypes.c_int), ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int),
+                ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int),
+                ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int)]
+
+
+class XShmScreenGrabber(ScreenGrabber):
+    """Szybkie przechwytywanie X11 przez rozszerzenie MIT-SHM (ctypes, bez dodatkowych modułów).
+
+    Serwer X kopiuje piksele bezpośrednio do segmentu pamięci współdzielonej,
+    na który patrzy wielokrotnie używana tablica NumPy - bez alokacji na klatkę.
+    Obrazy SHM są trzymane w małym cache LRU wg rozmiaru, więc naprzemienne zrzuty
+    różnych obszarów (powtórka, próbka jasności, zrzut ekranu) nie tworzą segmentów od nowa.
+    """
+    name = "XShm"
+
+    _Z_PIXMAP = 2
+    _IPC_PRIVATE = 0
+    _IPC_CREAT = 0o1000
+    _IPC_RMID = 0
+    _ALL_PLANES = ctypes.c_ulong(-1).value
+
+    def __init__(self):
+        x11_path = ctypes.util.find_library('X11')
+        xext_path = ctypes.util.find_library('Xext')
+        libc_path = ctypes.util.find_library('c')
+        if not x11_path or not xext_path or not libc_path:
+            raise RuntimeError("Brak bibliotek libX11/libXext/libc.")
+        self._x11 = ctypes.CDLL(x11_path)
+        self._xext = ctypes.CDLL(xext_path)
+        self._libc = ctypes.CDLL(libc_path, use_errno=True)
+        self._declare_prototypes()
+
+        self._lock = threading.RLock() # grab_bgr/grab_image wywołują grab_bgra
+        self._display = self._x11.XOpenDisplay(None)
+        if not self._display:
+            raise RuntimeError("Nie można otworzyć połączenia z serwerem X (DISPLAY).")
+        # (szer, wys) -> (obraz XImage, segment SHM, widok NumPy); najdawniej użyty na początku
+        self._images: "OrderedDict[Tuple[int, int], Tuple[Any, _XShmSegmentInfo, np.ndarray]]" = OrderedDict()
+        self._x_error = False
+        # Referencja do callbacka musi żyć tak długo jak obiekt
+        self._error_handler = self._XErrorHandler(self._on_x_error)
+        # Handler błędów Xlib jest globalny dla procesu - instalowany raz, a nie przy każdym wywołaniu z wątków
+        # przechwytywania; błędy innych połączeń (np. Tk) przekazuje dalej poprzedniemu handlerowi
+        self._previous_error_handler = self._x11.XSetErrorHandler(ctypes.cast(self._error_handler, ctypes.c_void_p))
+        self._chained_error_handler = self._XErrorHandler(self._previous_error_handler) if self._previous_error_handler else None
+        self._error_handler_installed = True
+        try:
+            if not self._xext.XShmQueryExtension(self._display):
+                raise RuntimeError("Serwer X nie wspiera rozszerzenia MIT-SHM.")
+            screen = self._x11.XDefaultScreen(self._display)
+            self._root = self._x11.XRootWindow(self._display, screen)
+            self._visual = self._x11.XDefaultVisual(self._display, screen)
+            self._depth = self._x11.XDefaultDepth(self._display, screen)
+            self._size = (int(self._x11.XDisplayWidth(self._display, screen)),
+                          int(self._x11.XDisplayHeight(self._display, screen)))
+            # Próbny zrzut całego ekranu - weryfikuje, że SHM działa (np. nie przez sieć)
+            self._ensure_image(*self._size)
+        except Exception:
+            self.close()
+            raise
+
+    def _declare_prototypes(self) -> None:
+        x11, xext, libc = self._x11, self._xext, self._libc
+        self._XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSetErrorHandler.argtypes = [ctypes.c_void_p]
+        x11.XSetErrorHandler.restype = ctypes.c_void_p
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def _on_x_error(self, display, event) -> int:
+        if display is not None and display == self._display:
+            # Błędy naszego połączenia nie mogą zabić procesu (domyślny handler Xlib wywołuje exit)
+            self._x_error = True
+            return 0
+        if self._chained_error_handler is not None:
+            return self._chained_error_handler(display, event)
+        return 0
+
+    def _call_guarded(self, func, *args) -> Any:
+        """Wywołuje funkcję Xlib z synchronizacją; błąd serwera X dla tego połączenia zamienia na wyjątek."""
+        self._x_error = False # Wołane pod self._lock - flaga dotyczy tylko tego wywołania
+        result = func(*args)
+        self._x11.XSync(self._display, 0)
+        if self._x_error:
+            raise RuntimeError(f"Błąd serwera X podczas {getattr(func, '__name__', 'wywołania')}.")
+        return result
+
+    def _ensure_image(self, width: int, height: int) -> Tuple[Any, np.ndarray]:
+        """Zwraca obraz SHM o zadanym rozmiarze i widok NumPy na jego pamięć (z cache albo nowy)."""
+        key = (width, height)
+        cached = self._images.get(key)
+        if cached is not None:
+            self._images.move_to_end(key) # Oznacz jako ostatnio użyty
+            return cached[0], cached[2]
+
+        shminfo = _XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, self._Z_PIXMAP,
+                                           None, ctypes.byref(shminfo), width, height)
+        if not image:
+            raise RuntimeError("XShmCreateImage nie powiodło się.")
+        try:
+            if image.contents.bits_per_pixel != 32:
+                raise RuntimeError(f"Nieobsługiwana głębia obrazu X: {image.contents.bits_per_pixel} bpp.")
+
+            bytes_per_line = image.contents.bytes_per_line
+            buffer_size = bytes_per_line * height
+            shminfo.shmid = self._libc.shmget(self._IPC_PRIVATE, buffer_size, self._IPC_CREAT | 0o600)
+            if shminfo.shmid < 0:
+                raise RuntimeError(f"shmget nie powiodło się (errno {ctypes.get_errno()}).")
+            address = self._libc.shmat(shminfo.shmid, None, 0)
+            if address is None or address == ctypes.c_void_p(-1).value:
+                self._libc.shmctl(shminfo.shmid, self._IPC_RMID, None)
+                shminfo.shmid = -1
+                raise RuntimeError(f"shmat nie powiodło się (errno {ctypes.get_errno()}).")
+            shminfo.shmaddr = address
+            shminfo.readOnly = 0
+            image.contents.data = address
+            self._call_guarded(self._xext.XShmAttach, self._display, ctypes.byref(shminfo))
+            # Segment zostanie usunięty automatycznie po odłączeniu ostatniego procesu
+            self._libc.shmctl(shminfo.shmid, self._IPC_RMID, None)
+        except Exception:
+            self._release_image(image, shminfo)
+            raise
+
+        raw = (ctypes.c_uint8 * buffer_size).from_address(address)
+        # Widok (bez kopii) na pamięć SHM - uwzględnia ewentualne wyrównanie wierszy
+        buffer = np.ndarray((height, width, 4), dtype=np.uint8, buffer=raw, strides=(bytes_per_line, 4, 1))
+        self._images[key] = (image, shminfo, buffer)
+        while len(self._images) > max(1, XSHM_IMAGE_CACHE_SIZE):
+            _, (old_image, old_shminfo, _) = self._images.popitem(last=False) # Usuń najdawniej użyty
+            self._release_image(old_image, old_shminfo)
+        return image, buffer
+
+    def _release_image(self, image, shminfo: _XShmSegmentInfo) -> None:
+        try:
+            if shminfo.shmaddr:
+                self._xext.XShmDetach(self._display, ctypes.byref(shminfo))
+                self._x11.XSync(self._display, 0)
+            image.contents.data = None # Dane należą do segmentu SHM, nie do Xlib
+            self._x11.XDestroyImage(image)
+            if shminfo.shmaddr:
+                self._libc.shmdt(shminfo.shmaddr)
+        except Exception as e:
+            logging.warning(f"Błąd podczas zwalniania obrazu XShm: {e}")
+
+    def _release_all_images(self) -> None:
+        while self._images:
+            _, (image, shminfo, _) = self._images.popitem(last=False)
+            self._release_image(image, shminfo)
+
+    def _clamp_region(self, region: Optional[Tuple[int, int, int, int]]) -> Tuple[int, int, int, int]:
+        # Region poza ekranem powoduje BadMatch - przycinamy go do rozmiaru okna głównego
+        if not region:
+            return 0, 0, self._size[0], self._size[1]
+        x, y, w, h = region
+        x1, y1 = max(0, int(x)), max(0, int(y))
+        x2, y2 = min(self._size[0], int(x) + int(w)), min(self._size[1], int(y) + int(h))
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Region {region} leży poza ekranem.")
+        return x1, y1, x2 - x1, y2 - y1
+
+    def size(self) -> Tuple[int, int]:
+        return self._size
+
+    def grab_bgra(self, region: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        with self._lock:
+            x, y, w, h = self._clamp_region(region)
+            image, buffer = self._ensure_image(w, h)
+            if not self._call_guarded(self._xext.XShmGetImage, self._display, self._root,
+                                      image, x, y, self._ALL_PLANES):
+                raise RuntimeError("XShmGetImage nie powiodło się.")
+            return buffer
+
+    def grab_bgr(self, region: Optional[Tuple[int, int, int, int]] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        with self._lock:
+            return cv2.cvtColor(self.grab_bgra(region), cv2.COLOR_BGRA2BGR, dst=out)
+
+    def grab_image(self, region: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        with self._lock:
+            buffer = self.grab_bgra(region)
+            height, width = buffer.shape[:2]
+            # Jedna kopia w C: BGRX -> RGB
+            return Image.frombuffer("RGB", (width, height), np.ascontiguousarray(buffer), "raw", "BGRX", 0, 1)
+
+    def close(self) -> None:
+        with self._lock:
+            self._release_all_images()
+            if self._error_handler_installed:
+                self._error_handler_installed = False
+                current = self._x11.XSetErrorHandler(self._previous_error_handler)
+                if current != ctypes.cast(self._error_handler, ctypes.c_void_p).value:
+                    self._x11.XSetErrorHandler(current) # Ktoś zainstalował handler po nas - zostaw jego
+            if self._display:
+                try:
+                    self._x11.XCloseDisplay(self._display)
+                except Exception:
+                    pass
+                self._display = None
+
+
+class ScreenGrabberChain(ScreenGrabber):
+    """Używa pierwszego działającego backendu z fallbackiem na kolejne.
+
+    Nieudane wywołanie jest raz ponawiane (błąd przejściowy, np. chwilowy błąd X11);
+    jeśli powtórka też zawiedzie, to wywołanie obsługuje następny backend. Backend jest
+    trwale degradowany dopiero po `demote_after` kolejnych nieudanych wywołaniach.
+    """
+
+    def __init__(self, grabbers: List[ScreenGrabber], demote_after: int = SCREEN_GRAB_DEMOTE_FAILURES):
+        if not grabbers:
+            raise RuntimeError("Brak dostępnego backendu przechwytywania ekranu.")
+        self._grabbers = list(grabbers)
+        self._demote_after = max(1, demote_after)
+        self._failures: Dict[ScreenGrabber, int] = {} # Kolejne nieudane wywołania backendu (zerowane po sukcesie)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._grabbers[0].name
+
+    def _call_with_retry(self, grabber: ScreenGrabber, method: str, *args) -> Any:
+        try:
+            return getattr(grabber, method)(*args)
+        except ValueError:
+            raise # Błąd argumentów (np. region poza ekranem) - nie wina backendu
+        except Exception as e:
+            logging.debug(f"Backend przechwytywania '{grabber.name}' zawiódł ({e}). Ponawiam.")
+            return getattr(grabber, method)(*args)
+
+    def _call(self, method: str, *args) -> Any:
+        with self._lock:
+            grabbers = list(self._grabbers)
+        for index, grabber in enumerate(grabbers):
+            try:
+                result = self._call_with_retry(grabber, method, *args)
+            except ValueError:
+                raise
+            except Exception as e:
+                if index == len(grabbers) - 1:
+                    raise
+                self._record_failure(grabber, e)
+                continue
+            with self._lock:
+                self._failures.pop(grabber, None)
+            return result
+
+    def _record_failure(self, grabber: ScreenGrabber, error: Exception) -> None:
+        """Liczy kolejne nieudane wywołania i degraduje backend po przekroczeniu limitu."""
+        with self._lock:
+            failures = self._failures[grabber] = self._failures.get(grabber, 0) + 1
+            demote = failures >= self._demote_after and len(self._grabbers) > 1 and grabber in self._grabbers
+            if demote:
+                self._grabbers.remove(grabber)
+                del self._failures[grabber]
+        if not demote:
+            logging.warning(f"Backend przechwytywania '{grabber.name}' zawiódł po powtórce ({error}) - "
+                            f"{failures}/{self._demote_after} przed degradacją. Używam następnego.")
+            return
+        logging.warning(f"Backend przechwytywania '{grabber.name}' zdegradowany po {failures} kolejnych "
+                        f"nieudanych wywołaniach (ostatni błąd: {error}). Przełączam na następny.")
+        grabber.close()
+
+    def size(self) -> Tuple[int, int]:
+        return self._call('size')
+
+    def grab_image(self, region: Optional[Tuple[int, int, int, int]] = None) -> Image.Image:
+        return self._call('grab_image', region)
+
+    def grab_bgra(self, region: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        return self._call('grab_bgra', region)
+
+    def grab_bgr(self, region: Optional[Tuple[int, int, int, int]] = None, out: Optional[np.ndarray] = None) -> np.ndarray:
+        return self._call('grab_bgr', region, out)
+
+    def close(self) -> None:
+        for grabber in self._grabbers:
+            grabber.close()
+
+
+def create_screen_grabber() -> ScreenGrabber:
+    """Wybiera backend przechwytywania raz, przy starcie (z fallbackami w kolejności preferencji)."""
+    preference = SCREEN_GRAB_BACKEND.lower()
+    grabbers: List[ScreenGrabber] = []
+
+    if preference in ('auto', 'xshm') and platform.system() == "Linux" and os.environ.get("DISPLAY") and CV2_AVAILABLE and NUMPY_AVAILABLE:
+        try:
+            grabbers.append(XShmScreenGrabber())
+        except Exception as e:
+            logging.info(f"Backend XShm niedostępny: {e}")
+    pyautogui_grabber = [PyAutoGuiScreenGrabber()] if PYAUTOGUI_AVAILABLE else []
+    imagegrab_grabber = [ImageGrabScreenGrabber()] if IMAGEGRAB_AVAILABLE else []
+    if preference == 'imagegrab':
+        grabbers += imagegrab_grabber + pyautogui_grabber
+    else:
+        grabbers += pyautogui_grabber + imagegrab_grabber
+
+    chain = ScreenGrabberChain(grabbers)
+    logging.info(f"Backend przechwytywania ekranu: {' -> '.join(g.name for g in grabbers)}")
+    return chain
+
+
+# --- Próbkowanie Jasności Tła ---
+class BackgroundBrightnessSampler:
+    """Tania próbka jasności tła pod widgetem z histerezą decyzji o odwróceniu kolorów.
+
+    Przechwytywany jest tylko kwadrat AUTO_COLOR_SAMPLE_SIZE (rozmiar ekranu podaje
+    wywołujący z Tk, bez pełnego zrzutu), kopiowany przez backend do bufora wielokrotnego
+    użytku pod jego blokadą. Jasność to średnia luma Rec. 601 - ta sama wartość co średnia
+    obrazu PIL w trybie "L" (z dokładnością do zaokrągleń pikseli), na której ustawiono
+    progi AUTO_COLOR_*; liczona z średnich kanałów bez konwersji obrazu.
+    Odwrócenie zmienia się dopiero po przekroczeniu progu o AUTO_COLOR_HYSTERESIS.
+    """
+
+    _LUMA_WEIGHTS_BGR = np.array([0.114, 0.587, 0.299]) # Rec. 601, jak Image.convert("L") (kolejność BGR)
+
+    def __init__(self, grabber: ScreenGrabber, sample_size: int = AUTO_COLOR_SAMPLE_SIZE,
+                 threshold: float = AUTO_COLOR_BRIGHTNESS_THRESHOLD, hysteresis: float = AUTO_COLOR_HYSTERESIS):
+        self._grabber = grabber
+        self._sample_size = max(1, sample_size)
+        self._threshold = threshold
+        self._hysteresis = max(0.0, hysteresis)
+        self._sample_buffer: Optional[np.ndarray] = None # (h, w, 3) uint8 - cel kopii próbki z backendu
+        self.screen_size: Optional[Tuple[int, int]] = None
+        self.inverted = False
+        self.last_brightness: Optional[float] = None
+
+    def sample_region(self, center_x: int, center_y: int) -> Optional[Tuple[int, int, int, int]]:
+        """Kwadrat próbki wokół punktu, przycięty do ekranu (x, y, szerokość, wysokość)."""
+        if self.screen_size is None:
+            return None
+        half_sample = self._sample_size // 2
+        x1, y1 = max(0, center_x - half_sample), max(0, center_y - half_sample)
+        x2 = min(self.screen_size[0], center_x + half_sample)
+        y2 = min(self.screen_size[1], center_y + half_sample)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2 - x1, y2 - y1
+
+    def measure(self, center_x: int, center_y: int) -> Optional[float]:
+        """Jasność (0-255) próbki wokół punktu albo None, jeśli obszar leży poza ekranem."""
+        region = self.sample_region(center_x, center_y)
+        if region is None:
+            return None
+        # Kopia pod blokadą backendu - widok z grab_bgra() mógłby zostać unieważniony przez inny wątek przechwytywania
+        sample = self._sample_buffer = self._grabber.grab_bgr(region, out=self._sample_buffer)
+        if sample.size == 0:
+            return None
+        # Luma jest liniowa w kanałach: średnia luma = ważona suma średnich kanałów
+        channel_means = sample.reshape(-1, 3).mean(axis=0)
+        self.last_brightness = float(np.dot(channel_means, self._LUMA_WEIGHTS_BGR))
+        return self.last_brightness
+
+    def update(self, brightness: float) -> bool:
+        """Aktualizuje decyzję o odwróceniu kolorów (z histerezą) i ją zwraca."""
+        if self.inverted:
+            self.inverted = brightness > self._threshold - self._hysteresis
+        else:
+            self.inverted = brightness > self._threshold + self._hysteresis
+        return self.inverted
+
+
+# --- Potokowe Nagrywanie Wideo ---
+class VideoRecordingPipeline:
+    """Potok nagrywania: wątek przechwytujący -> pula wątków znaku wodnego -> uporządkowany zapis.
+
+    Każda klatka dostaje numer sekwencyjny i monotoniczny znacznik czasu. Kolejki są
+    ograniczone: gdy przetwarzanie nie nadąża, przechwycona klatka jest odrzucana
+    (zamiast spowalniać przechwytywanie), a luki w osi czasu zapis wypełnia
+    powtórzeniem poprzedniej klatki, więc plik zachowuje docelowe FPS.
+    """
+
+    def __init__(self, grab_frame, write_frame, fps: float, duration: float,
+                 process_frame=None, should_stop=None,
+                 num_workers: int = VIDEO_PIPELINE_WORKERS, queue_size: int = VIDEO_PIPELINE_QUEUE_SIZE):
+        self._grab_frame = grab_frame
+        self._write_frame = write_frame
+        self._process_frame = process_frame
+        self._should_stop = should_stop or (lambda: False)
+        self._fps = fps
+        self._duration = duration
+        self._num_workers = max(1, num_workers)
+        self._raw_queue: "queue.Queue[Optional[Tuple[int, float, np.ndarray]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._processed_queue: "queue.Queue[Optional[Tuple[int, float, np.ndarray]]]" = queue.Queue(maxsize=max(1, queue_size) * 2)
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._start_time = 0.0
+        self.error: Optional[Exception] = None
+        self.interrupted = False
+        self.stats: Dict[str, int] = {
+            'grabbed': 0,     # Klatki przechwycone z ekranu
+            'dropped': 0,     # Odrzucone z powodu przepełnionej kolejki (backpressure)
+            'late': 0,        # Przetworzone za późno na swój slot czasowy
+            'duplicated': 0,  # Powtórzone klatki wypełniające luki w osi czasu
+            'written': 0,     # Klatki zapisane do pliku (łącznie z powtórzeniami)
+            'grab_errors': 0, # Nieudane przechwycenia
+        }
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def run(self) -> Dict[str, int]:
+        """Uruchamia potok i blokuje do jego zakończenia. Zwraca statystyki klatek."""
+        workers = [threading.Thread(target=self._worker_loop, name=f"VideoWatermarkWorker-{i}", daemon=True)
+                   for i in range(self._num_workers)]
+        writer = threading.Thread(target=self._writer_loop, name="VideoWriterThread", daemon=True)
+        self._start_time = time.monotonic()
+        for t in workers: t.start()
+        writer.start()
+        try:
+            self._grab_loop() # Przechwytywanie w bieżącym wątku
+        finally:
+            for _ in workers:
+                self._raw_queue.put(None) # Sygnał końca dla każdego wątku roboczego
+            for t in workers: t.join()
+            writer.join()
+        logging.info(f"Statystyki potoku wideo: {self.stats}")
+        return dict(self.stats)
+
+    def _grab_loop(self) -> None:
+        frame_interval = 1.0 / self._fps
+        next_slot = 0
+        seq = 0
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now - self._start_time >= self._duration:
+                break
+            if self._should_stop():
+                logging.info("Nagrywanie wideo przerwane przez użytkownika lub zamknięcie.")
+                self.interrupted = True
+                break
+            # Sloty liczone od startu - brak dryfu przy nierównym czasie przechwytywania
+            deadline = self._start_time + next_slot * frame_interval
+            if now < deadline:
+                self._stop_event.wait(deadline - now)
+                continue
+
+            try:
+                frame = self._grab_frame()
+            except Exception as e_capture:
+                logging.warning(f"Błąd przechwytywania klatki wideo: {e_capture}")
+                self._count('grab_errors')
+                frame = None
+            timestamp = time.monotonic()
+            # Następny slot po bieżącym czasie - pominięte sloty wypełni zapis
+            next_slot = int((timestamp - self._start_time) * self._fps) + 1
+            if frame is None:
+                continue
+
+            self._count('grabbed')
+            try:
+                self._raw_queue.put_nowait((seq, timestamp, frame))
+                seq += 1
+            except queue.Full:
+                self._count('dropped')
+
+    def _worker_loop(self) -> None:
+        while True:
+            item = self._raw_queue.get()
+            if item is None:
+                self._processed_queue.put(None)
+                return
+            seq, timestamp, frame = item
+            if self._process_frame is not None and self.error is None:
+                try:
+                    frame = self._process_frame(frame)
+                except Exception as e_wm:
+                    # Kontynuuj bez znaku wodnego dla tej klatki
+                    logging.error(f"Błąd przetwarzania klatki wideo: {e_wm}")
+            self._processed_queue.put((seq, timestamp, frame))
+
+    def _writer_loop(self) -> None:
+        pending: Dict[int, Tuple[float, np.ndarray]] = {}
+        next_seq = 0
+        next_slot = 0
+        last_frame: Optional[np.ndarray] = None
+        finished_workers = 0
+        max_gap = max(1, int(self._fps * 2)) # Ogranicznik powtórzeń przy długich przestojach
+
+        def write(timestamp: float, frame: np.ndarray) -> None:
+            nonlocal next_slot, last_frame
+            if self.error is not None:
+                return # Po błędzie zapisu tylko opróżniamy kolejkę
+            slot = int((timestamp - self._start_time) * self._fps)
+            try:
+                if last_frame is not None and slot < next_slot:
+                    self._count('late')
+                    return
+                if last_frame is not None and slot > next_slot:
+                    gap = min(slot - next_slot, max_gap)
+                    for _ in range(gap):
+                        self._write_frame(last_frame)
+                    self._count('duplicated', gap)
+                    self._count('written', gap)
+                self._write_frame(frame)
+                self._count('written')
+                last_frame = frame
+                next_slot = max(slot, next_slot) + 1
+            except Exception as e_write:
+                # Jeśli zapis zawodzi, nie ma sensu kontynuować nagrywania
+                logging.error(f"Błąd zapisu klatki wideo: {e_write}")
+                self.error = e_write
+                self._stop_event.set()
+
+        while finished_workers < self._num_workers:
+            item = self._processed_queue.get()
+            if item is None:
+                finished_workers += 1
+                continue
+            seq, timestamp, frame = item
+            pending[seq] = (timestamp, frame)
+            # Zapis w kolejności przechwycenia, niezależnie od kolejności przetworzenia
+            while next_seq in pending:
+                write(*pending.pop(next_seq))
+                next_seq += 1
+
+        for seq in sorted(pending):
+            write(*pending.pop(seq))
+
+
+# --- Strumieniowy Zapis GIF ---
+class GifPalette:
+    """Wspólna (globalna) paleta GIF z mapowaniem pikseli przez tablicę LUT w NumPy.
+
+    Paleta jest budowana raz z próbki klatek, a każdy piksel jest mapowany przez
+    tablicę 2^(3*bits) wpisów indeksowaną skróconymi składowymi RGB - koszt klatki
+    jest liniowy i przewidywalny, a kolory nie migoczą między klatkami.
+    """
+
+    def __init__(self, palette_rgb: np.ndarray, lut_bits: int = GIF_PALETTE_LUT_BITS):
+        self.colors = np.asarray(palette_rgb, dtype=np.uint8).reshape(-1, 3)[:256]
+        self._bits = lut_bits
+        self._shift = 8 - lut_bits
+        self._lut = self._build_lut()
+
+    @classmethod
+    def from_samples(cls, images: List[Image.Image], colors: int = 256,
+                     max_sample_pixels: int = GIF_PALETTE_MAX_SAMPLE_PIXELS) -> "GifPalette":
+        """Buduje paletę (median cut Pillow) z podpróbkowanych pikseli kilku klatek."""
+        if not images:
+            raise ValueError("Brak klatek do zbudowania palety.")
+        per_image = max(1, max_sample_pixels // len(images))
+        samples = []
+        for image in images:
+            pixels = np.asarray(image.convert('RGB') if image.mode != 'RGB' else image)
+            step = max(1, int(math.sqrt(pixels.shape[0] * pixels.shape[1] / per_image)))
+            samples.append(pixels[::step, ::step].reshape(-1, 3))
+        sample = np.concatenate(samples)
+        sample_image = Image.fromarray(sample.reshape(-1, 1, 3), 'RGB')
+        method = Image.Quantize.MEDIANCUT if hasattr(Image, 'Quantize') else Image.MEDIANCUT
+        quantized = sample_image.quantize(colors=colors, method=method)
+        palette = np.array(quantized.getpalette()[:colors * 3], dtype=np.uint8).reshape(-1, 3)
+        used_colors = len(quantized.getcolors(colors) or []) or len(palette)
+        return cls(palette[:used_colors])
+
+    def _build_lut(self) -> np.ndarray:
+        levels = 1 << self._bits
+        # Środek każdej komórki siatki RGB
+        centers = (np.arange(levels, dtype=np.float32) * (1 << self._shift)) + ((1 << self._shift) - 1) / 2.0
+        r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+        grid = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+        palette = self.colors.astype(np.float32)
+        # argmin |c - p|^2 = argmin (|p|^2 - 2 c.p) - składnik |c|^2 nie zależy od p
+        palette_norms = (palette ** 2).sum(axis=1)
+        lut = np.empty(grid.shape[0], dtype=np.uint8)
+        chunk = 8192
+        for start in range(0, grid.shape[0], chunk):
+            distances = palette_norms[None, :] - 2.0 * (grid[start:start + chunk] @ palette.T)
+            lut[start:start + chunk] = distances.argmin(axis=1)
+        return lut
+
+    def map(self, rgb: np.ndarray) -> np.ndarray:
+        """Mapuje tablicę RGB (h, w, 3) uint8 na indeksy palety (h, w) uint8."""
+        shift, bits = self._shift, self._bits
+        index = (rgb[:, :, 0] >> shift).astype(np.uint32) << (2 * bits)
+        index |= (rgb[:, :, 1] >> shift).astype(np.uint32) << bits
+        index |= rgb[:, :, 2] >> shift
+        return self._lut[index]
+
+    def palette_bytes(self) -> bytes:
+        """Zwraca paletę jako 768 bajtów (256 wpisów RGB, dopełnione zerami)."""
+        padded = np.zeros((256, 3), dtype=np.uint8)
+        padded[:len(self.colors)] = self.colors
+        return padded.tobytes()
+
+
+class StreamingGifWriter:
+    """Zapisuje animowany GIF klatka po klatce, bez trzymania wszystkich klatek w pamięci.
+
+    Kwantyzacja i kompresja LZW (koder Pillow) działają w osobnym wątku; kolejka
+    klatek jest ograniczona, więc zużycie pamięci jest w przybliżeniu stałe niezależnie
+    od długości nagrania. Plik powstaje jako '.part' i jest podmieniany atomowo w close().
+    Przy global_palette pierwsze klatki są buforowane do zbudowania wspólnej palety.
+    Przy klatkach różnicowych zapisywany jest tylko prostokąt, który zmienił się względem
+    poprzedniej klatki (niezmienione piksele są przezroczyste), a klatki identyczne
+    wydłużają czas wyświetlania poprzedniej zamiast być zapisywane ponownie.
+    """
+
+    def __init__(self, path: str, loop: int = 0, queue_size: int = GIF_ENCODER_QUEUE_SIZE,
+                 global_palette: bool = GIF_GLOBAL_PALETTE, palette_sample_frames: int = GIF_PALETTE_SAMPLE_FRAMES):
+        self.path = path
+        self._part_path = path + ".part"
+        self._loop = loop
+        self._use_global_palette = global_palette and NUMPY_AVAILABLE
+        self._palette_sample_frames = max(1, palette_sample_frames)
+        self._palette: Optional[GifPalette] = None
+        self._pending_frames: List[Tuple[Image.Image, int]] = [] # Klatki czekające na paletę
+        self._use_delta_frames = GIF_DELTA_FRAMES and self._use_global_palette
+        self._previous_indices: Optional[np.ndarray] = None # Pełna klatka (indeksy) do porównań
+        # Ostatnia klatka różnicowa wstrzymana do zapisu - jej czas może się jeszcze wydłużyć
+        self._held_frame: Optional[Tuple[np.ndarray, Tuple[int, int], int, Optional[int]]] = None
+        self.frames_merged = 0 # Klatki identyczne z poprzednią, scalone w dłuższy czas wyświetlania
+        self._file = open(self._part_path, 'wb')
+        self._size: Optional[Tuple[int, int]] = None
+        self._queue: "queue.Queue[Optional[Tuple[Image.Image, int]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self.frames_written = 0
+        self.error: Optional[Exception] = None
+        self._closed = False
+        self._encoder_thread = threading.Thread(target=self._encoder_loop, name="GifEncoderThread", daemon=True)
+        self._encoder_thread.start()
+
+    def add_frame(self, image: Image.Image, duration_ms: int) -> None:
+        """Dodaje klatkę do kolejki kodowania (blokuje, gdy koder nie nadąża)."""
+        if self.error is not None:
+            raise IOError(f"Błąd kodera GIF: {self.error}") from self.error
+        self._queue.put((image, int(duration_ms)))
+
+    def close(self) -> int:
+        """Kończy kodowanie, zapisuje trailer i publikuje plik. Zwraca liczbę klatek."""
+        if self._closed:
+            return self.frames_written
+        self._closed = True
+        self._queue.put(None)
+        self._encoder_thread.join()
+        try:
+            if self.error is None and self.frames_written > 0:
+                self._file.write(b";") # Trailer GIF
+            self._file.close()
+        except Exception as e:
+            self.error = self.error or e
+        if self.error is not None or self.frames_written == 0:
+            self._remove_part_file()
+            if self.error is not None:
+                raise IOError(f"Nie można zapisać pliku GIF: {self.error}") from self.error
+            return 0
+        os.replace(self._part_path, self.path)
+        return self.frames_written
+
+    def abort(self) -> None:
+        """Przerywa zapis i usuwa niedokończony plik."""
+        if self._closed:
+            return
+        self._closed = True
+        self.error = self.error or RuntimeError("Przerwano zapis GIF.")
+        self._queue.put(None)
+        self._encoder_thread.join()
+        try:
+            self._file.close()
+        except Exception:
+            pass
+        self._remove_part_file()
+
+    def _remove_part_file(self) -> None:
+        try:
+            if os.path.exists(self._part_path):
+                os.remove(self._part_path)
+        except Exception as e:
+            logging.error(f"Nie można usunąć niedokończonego pliku GIF {self._part_path}: {e}")
+
+    def _write_header(self, size: Tuple[int, int]) -> None:
+        width, height = size
+        if self._palette is not None:
+            # Globalna paleta 256 kolorów: flaga GCT, 8 bitów rozdzielczości, rozmiar 2^(7+1)
+            self._file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF7, 0, 0))
+            self._file.write(self._palette.palette_bytes())
+        else:
+            self._file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0)) # Bez globalnej palety
+        # Rozszerzenie NETSCAPE2.0 - liczba powtórzeń animacji (0 = w nieskończoność)
+        self._file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self._loop) + b"\x00")
+
+    def _quantize(self, image: Image.Image) -> Image.Image:
+        """Konwertuje klatkę do trybu P: paleta globalna (LUT) lub adaptacyjna per klatka."""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if self._palette is not None:
+            frame = Image.fromarray(self._palette.map(np.asarray(image)), 'P')
+            frame.putpalette(self._palette.palette_bytes())
+            return frame
+        return image.convert('P', palette=Image.ADAPTIVE, colors=256)
+
+    def _encode_frame(self, image: Image.Image, duration_ms: int) -> None:
+        if self._size is None:
+            self._size = image.size
+            self._write_header(self._size)
+        elif image.size != self._size:
+            image = image.resize(self._size)
+        if self._use_delta_frames and self._palette is not None:
+            self._encode_delta_frame(image, duration_ms)
+            return
+        frame = self._quantize(image)
+        # getdata: rozszerzenie kontroli grafiki + deskryptor (z lokalną paletą, jeśli brak globalnej) + dane LZW
+        for chunk in GifImagePlugin.getdata(frame, (0, 0), duration=duration_ms,
+                                            include_color_table=self._palette is None):
+            self._file.write(chunk)
+        self.frames_written += 1
+
+    def _encode_delta_frame(self, image: Image.Image, duration_ms: int) -> None:
+        """Porównuje klatkę z poprzednią i wstrzymuje do zapisu tylko zmieniony prostokąt."""
+        rgb = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+        indices = self._palette.map(rgb)
+        previous = self._previous_indices
+        self._previous_indices = indices
+
+        if previous is None:
+            self._write_held_frame()
+            self._held_frame = (indices, (0, 0), duration_ms, None) # Pierwsza klatka - pełna
+            return
+
+        changed = indices != previous
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        if changed_rows.size == 0:
+            # Klatka bez zmian - wydłuż czas wyświetlania poprzedniej
+            held_indices, held_offset, held_duration, held_transparency = self._held_frame
+            self._held_frame = (held_indices, held_offset, held_duration + duration_ms, held_transparency)
+            self.frames_merged += 1
+            return
+        changed_cols = np.flatnonzero(changed.any(axis=0))
+        y1, y2 = int(changed_rows[0]), int(changed_rows[-1]) + 1
+        x1, x2 = int(changed_cols[0]), int(changed_cols[-1]) + 1
+
+        region = indices[y1:y2, x1:x2].copy()
+        # Niezmienione piksele w prostokącie - przezroczyste (lepsza kompresja LZW)
+        region[~changed[y1:y2, x1:x2]] = GIF_TRANSPARENT_INDEX
+        self._write_held_frame()
+        self._held_frame = (region, (x1, y1), duration_ms, GIF_TRANSPARENT_INDEX)
+
+    def _write_held_frame(self) -> None:
+        """Zapisuje wstrzymaną klatkę różnicową (disposal=1: pozostaw na ekranie)."""
+        if self._held_frame is None:
+            return
+        indices, offset, duration_ms, transparency = self._held_frame
+        self._held_frame = None
+        frame = Image.fromarray(indices, 'P')
+        frame.putpalette(self._palette.palette_bytes())
+        params: Dict[str, Any] = {'duration': duration_ms, 'disposal': 1, 'include_color_table': False}
+        if transparency is not None:
+            params['transparency'] = transparency
+        for chunk in GifImagePlugin.getdata(frame, offset, **params):
+            self._file.write(chunk)
+        self.frames_written += 1
+
+    def _flush_pending_frames(self) -> None:
+        """Buduje paletę globalną z buforowanych klatek i koduje je."""
+        if not self._pending_frames:
+            return
+        try:
+            started = time.monotonic()
+            # Przy klatkach różnicowych jeden indeks jest zarezerwowany na przezroczystość
+            palette_colors = GIF_TRANSPARENT_INDEX if self._use_delta_frames else 256
+            self._palette = GifPalette.from_samples([image for image, _ in self._pending_frames], colors=palette_colors)
+            logging.info(f"Zbudowano globalną paletę GIF ({len(self._palette.colors)} kolorów) w {time.monotonic() - started:.2f}s.")
+        except Exception as e:
+            logging.warning(f"Nie udało się zbudować globalnej palety GIF: {e}. Używam palet lokalnych.")
+            self._use_global_palette = False
+            self._use_delta_frames = False
+        pending, self._pending_frames = self._pending_frames, []
+        for image, duration_ms in pending:
+            self._encode_frame(image, duration_ms)
+
+    def _encoder_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                if self.error is None: # abort() ustawia błąd - wtedy nie kodujemy bufora
+                    try:
+                        self._flush_pending_frames() # Krótkie nagranie - mniej klatek niż próbka
+                        self._write_held_frame()
+                    except Exception as e:
+                        logging.error(f"Błąd kodowania klatki GIF: {e}", exc_info=True)
+                        self.error = e
+                return
+            if self.error is not None:
+                continue # Po błędzie tylko opróżniamy kolejkę
+            try:
+                if self._use_global_palette and self._palette is None:
+                    self._pending_frames.append(item)
+                    if len(self._pending_frames) >= self._palette_sample_frames:
+                        self._flush_pending_frames()
+                else:
+                    self._encode_frame(*item)
+            except Exception as e:
+                logging.error(f"Błąd kodowania klatki GIF: {e}", exc_info=True)
+                self.error = e
+
+
+# --- Bufor Natychmiastowej Powtórki ---
+class ReplayRingBuffer:
+    """Bufor pierścieniowy ostatnich N sekund ekranu, ograniczony budżetem bajtów.
+
+    Klatki trzymane są jako JPEG (szersze niż `max_width` najpierw pomniejszane),
+    więc zużycie pamięci nie rośnie z czasem działania. Najstarsze klatki są usuwane,
+    gdy przekroczony zostanie limit czasu lub budżet bajtów.
+    """
+
+    def __init__(self, max_seconds: float = REPLAY_BUFFER_SECONDS, max_bytes: int = REPLAY_MAX_BUFFER_BYTES,
+                 max_width: int = REPLAY_MAX_FRAME_WIDTH, jpeg_quality: int = REPLAY_JPEG_QUALITY):
+        self._max_seconds = max_seconds
+        self._max_bytes = max_bytes
+        self._max_width = max_width
+        self._encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), max(0, min(100, int(jpeg_quality)))]
+        self._frames: "deque[Tuple[float, bytes]]" = deque()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.frame_size: Optional[Tuple[int, int]] = None # (szerokość, wysokość) klatek po skalowaniu
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._frames)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def append(self, frame_bgr: np.ndarray, timestamp: Optional[float] = None) -> bool:
+        """Kompresuje klatkę BGR i dodaje ją do bufora. Zwraca False, jeśli kodowanie zawiodło."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        height, width = frame_bgr.shape[:2]
+        if self._max_width and width > self._max_width:
+            scale = self._max_width / float(width)
+            frame_bgr = cv2.resize(frame_bgr, (self._max_width, max(1, int(round(height * scale)))),
+                                   interpolation=cv2.INTER_AREA)
+            height, width = frame_bgr.shape[:2]
+        ok, encoded = cv2.imencode('.jpg', frame_bgr, self._encode_params)
+        if not ok:
+            return False
+        data = encoded.tobytes()
+        with self._lock:
+            if self.frame_size != (width, height):
+                # Zmiana rozdzielczości - starych klatek nie da się zapisać do jednego pliku
+                self._frames.clear()
+                self._total_bytes = 0
+                self.frame_size = (width, height)
+            self._frames.append((timestamp, data))
+            self._total_bytes += len(data)
+            while len(self._frames) > 1 and (timestamp - self._frames[0][0] > self._max_seconds
+                                             or self._total_bytes > self._max_bytes):
+                _, old = self._frames.popleft()
+                self._total_bytes -= len(old)
+                self.evicted += 1
+        return True
+
+    def snapshot(self) -> Tuple[List[Tuple[float, bytes]], Optional[Tuple[int, int]]]:
+        """Zwraca kopię listy klatek (znacznik czasu, JPEG) i ich rozmiar - bufor nagrywa dalej."""
+        with self._lock:
+            return list(self._frames), self.frame_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self._total_bytes = 0
+
+    @staticmethod
+    def decode(data: bytes) -> Optional[np.ndarray]:
+        """Dekoduje klatkę z bufora do tablicy BGR."""
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+# --- Cache Danych API ---
+class ApiDataCache:
+    """Dwupoziomowy cache odpowiedzi API: mapa w pamięci z TTL przed jednym plikiem na dysku.
+
+    Wszystkie pola (wartość, czas pobrania, dostawca) są trzymane w jednym pliku JSON,
+    wczytywanym w całości przy pierwszym dostępie. Zapis odbywa się w tle (write-behind)
+    i tylko wtedy, gdy zmieniła się wartość - przez plik tymczasowy i `os.replace`, więc
+    czytelnik widzi starą albo nową wersję pliku, nigdy urwaną. Przestarzała wartość
+    pozostaje dostępna przez `get_stale` jako fallback przy błędach sieci.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir: Optional[str], ttl_seconds: float = CACHE_TIME_SECONDS,
+                 filename: str = API_CACHE_FILENAME):
+        self._cache_dir = cache_dir
+        self._path = os.path.join(cache_dir, filename) if cache_dir else None
+        self._ttl = ttl_seconds
+        self._entries: Dict[str, Tuple[str, float, Optional[str]]] = {} # URL -> (wartość, czas pobrania, dostawca)
+        self._loaded = False
+        self._store_missing = False # Brak wspólnego pliku - wpisy mogą być jeszcze w starych plikach per URL
+        self._legacy_checked: set = set()
+        self._legacy_files: List[str] = [] # Przeniesione stare pliki, usuwane po zapisie wspólnego pliku
+        self._dirty = False # Zmieniona wartość - zapis w tle
+        self._touched = False # Zmieniony tylko czas pobrania - zapis przy flush()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # Serializuje zapisy (wątek w tle i flush)
+        self._write_event = threading.Event()
+        self._writer_thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'disk_reads': 0, 'disk_writes': 0}
+
+    def _load_locked(self) -> None:
+        """Jednorazowo wczytuje cały plik cache (jeden odczyt przy starcie)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._path:
+            return
+        try:
+            with open(self._path, 'r', encoding='utf-8') as f:
+                store = json.load(f)
+            self.stats['disk_reads'] += 1
+            if store.get('version') != self.FORMAT_VERSION:
+                logging.warning(f"Nieobsługiwana wersja pliku cache {self._path} - pomijam.")
+                return
+            for url, entry in store.get('entries', {}).items():
+                value = entry.get('value')
+                if isinstance(value, str) and value:
+                    self._entries[url] = (value, float(entry.get('fetched_at', 0.0)), entry.get('provider'))
+        except FileNotFoundError:
+            self._store_missing = True
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            logging.warning(f"Błąd odczytu cache {self._path}: {e}")
+
+    def _legacy_path(self, url: str) -> str:
+        # Nazwa pliku per URL z poprzednich wersji (tylko do jednorazowej migracji)
+        cache_key = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in url.replace("https://", "").replace("http://", "").replace("/", "_").replace(":", "_"))[:100]
+        return os.path.join(self._cache_dir, cache_key + ".cache")
+
+    def _lookup_locked(self, url: str) -> Optional[Tuple[str, float, Optional[str]]]:
+        self._load_locked()
+        entry = self._entries.get(url)
+        if entry is None and self._store_missing and url not in self._legacy_checked:
+            self._legacy_checked.add(url)
+            legacy_file = self._legacy_path(url)
+            try:
+                if os.path.exists(legacy_file):
+                    stored_at = os.path.getmtime(legacy_file)
+                    with open(legacy_file, 'r', encoding='utf-8') as f:
+                        value = f.read().strip()
+                    self.stats['disk_reads'] += 1
+                    self._legacy_files.append(legacy_file)
+                    if value:
+                        entry = self._entries[url] = (value, stored_at, None)
+                        self._dirty = True
+                        self._start_writer_locked()
+            except Exception as e:
+                logging.warning(f"Błąd odczytu starego cache {legacy_file}: {e}")
+        return entry
+
+    def get_fresh(self, url: str, max_age: Optional[float] = None) -> Optional[str]:
+        """Zwraca wartość młodszą niż `max_age` (domyślnie TTL) albo None (liczone jako trafienie/chybienie)."""
+        max_age = self._ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._lookup_locked(url)
+            if entry is not None and time.time() - entry[1] < max_age:
+                self.stats['hits'] += 1
+                return entry[0]
+            self.stats['misses'] += 1
+            return None
+
+    def get_stale(self, url: str) -> Optional[str]:
+        """Zwraca ostatnią znaną wartość niezależnie od wieku (fallback przy błędzie)."""
+        with self._lock:
+            entry = self._lookup_locked(url)
+            return entry[0] if entry is not None else None
+
+    def put(self, url: str, value: str, provider: Optional[str] = None) -> None:
+        """Zapisuje świeżą wartość w pamięci; na dysk (w tle) tylko gdy się zmieniła."""
+        with self._lock:
+            previous = self._lookup_locked(url)
+            if provider is None and previous is not None and previous[0] == value:
+                provider = previous[2] # Ta sama wartość bez wskazania źródła - zachowaj znanego dostawcę
+            self._entries[url] = (value, time.time(), provider)
+            if self._path is None:
+                return
+            if previous is not None and previous[0] == value:
+                self._touched = True
+                return
+            self._dirty = True
+            self._start_writer_locked()
+        self._write_event.set()
+
+    def _start_writer_locked(self) -> None:
+        if self._writer_thread is None or not self._writer_thread.is_alive():
+            self._writer_thread = threading.Thread(target=self._writer_loop, name="CacheWriter", daemon=True)
+            self._writer_thread.start()
+        self._write_event.set()
+
+    def flush(self) -> None:
+        """Synchronicznie zapisuje stan, także same czasy pobrania (np. przy zamykaniu)."""
+        self._write_store(include_touched=True)
+
+    def _write_store(self, include_touched: bool = False) -> None:
+        with self._write_lock:
+            with self._lock:
+                if not self._path or not (self._dirty or (include_touched and self._touched)):
+                    return
+                store = {'version': self.FORMAT_VERSION,
+                         'entries': {url: {'value': value, 'fetched_at': fetched_at, 'provider': provider}
+                                     for url, (value, fetched_at, provider) in self._entries.items()}}
+                self._dirty = self._touched = False
+                legacy_files, self._legacy_files = self._legacy_files, []
+            tmp_file = self._path + ".tmp"
+            try:
+                # Zapis do pliku tymczasowego i podmiana - czytelnik nigdy nie zobaczy połowy pliku
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(store, f, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self._path)
+                with self._lock:
+                    self.stats['disk_writes'] += 1
+                logging.debug(f"Zapisano cache API ({len(store['entries'])} pól): {self._path}")
+            except Exception as e:
+                logging.warning(f"Błąd zapisu do cache {self._path}: {e}")
+                with self._lock:
+                    self._dirty = True # Spróbuj ponownie przy następnej zmianie lub flush()
+                    self._legacy_files.extend(legacy_files)
+                return
+            for legacy_file in legacy_files:
+                try:
+                    os.remove(legacy_file)
+                except OSError:
+                    pass
+
+    def _writer_loop(self) -> None:
+        while True:
+            self._write_event.wait()
+            self._write_event.clear()
+            self._write_store()
+
+
+# --- Klient HTTP ---
+class ApiHttpClient:
+    """Współdzielony klient HTTP: pula połączeń keep-alive i żądania warunkowe.
+
+    Jedna sesja `requests.Session` dla wszystkich wątków pobierających, więc kolejne
+    zapytania nie płacą za nowy handshake TCP/TLS. Dla każdego URL zapamiętywane są
+    ETag/Last-Modified i treść ostatniej odpowiedzi - gdy serwer odpowie 304 Not Modified,
+    zwracana jest zapamiętana treść bez ponownego przesyłania danych.
+    """
+
+    def __init__(self, pool_maxsize: int = HTTP_POOL_MAXSIZE):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update({'User-Agent': f'TimechainWidget/{VERSION}'})
+        self._validators: Dict[str, Tuple[Optional[str], Optional[str], str]] = {} # URL -> (ETag, Last-Modified, treść)
+        self._lock = threading.Lock()
+        self.not_modified = 0 # Liczba odpowiedzi 304 (statystyka)
+
+    def get_text(self, url: str, timeout: float = API_TIMEOUT_SECONDS) -> str:
+        """Pobiera treść URL (bez białych znaków na końcach). Błędy HTTP/sieci rzucają wyjątki requests."""
+        with self._lock:
+            cached = self._validators.get(url)
+        headers = {}
+        if cached:
+            etag, last_modified, _ = cached
+            if etag: headers['If-None-Match'] = etag
+            if last_modified: headers['If-Modified-Since'] = last_modified
+
+        response = self._session.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and cached:
+            with self._lock:
+                self.not_modified += 1
+            logging.debug(f"Brak zmian (304) dla {url}")
+            return cached[2]
+        response.raise_for_status() # Rzuci wyjątkiem dla błędów HTTP (4xx, 5xx)
+        data = response.text.strip()
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._lock:
+            if etag or last_modified:
+                self._validators[url] = (etag, last_modified, data)
+            else:
+                self._validators.pop(url, None) # Serwer nie wspiera żądań warunkowych
+        return data
+
+    def close(self) -> None:
+        self._session.close()
+
+
+# --- Rejestr Dostawców API ---
+class ProviderHealth:
+    """Statystyki jednego endpointu: EWMA i okno czasów odpowiedzi, licznik błędów, circuit breaker."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma: Optional[float] = None
+        self._samples: "deque[float]" = deque(maxlen=PROVIDER_LATENCY_WINDOW)
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self.ewma = latency if self.ewma is None else PROVIDER_EWMA_ALPHA * latency + (1 - PROVIDER_EWMA_ALPHA) * self.ewma
+            self._samples.append(latency)
+            if self.open_until:
+                logging.info(f"Dostawca {self.url} ponownie dostępny.")
+            self.failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self, now: float) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= PROVIDER_BREAKER_FAILURES:
+                # Po okresie wyłączenia jedno żądanie próbne; kolejny błąd wyłącza ponownie
+                self.open_until = now + PROVIDER_BREAKER_COOLDOWN_SECONDS
+                logging.warning(f"Dostawca {self.url} wyłączony na {PROVIDER_BREAKER_COOLDOWN_SECONDS}s po {self.failures} błędach.")
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def rank(self) -> float:
+        # Niezmierzony dostawca idzie pierwszy - raz, żeby poznać jego czas odpowiedzi
+        return self.ewma if self.ewma is not None else 0.0
+
+    def hedge_delay(self) -> float:
+        """Opóźnienie żądania zabezpieczającego: p95 z okna czasów odpowiedzi."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 5:
+            return PROVIDER_HEDGE_DEFAULT_DELAY_SECONDS
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        return max(PROVIDER_HEDGE_MIN_DELAY_SECONDS, min(API_TIMEOUT_SECONDS, p95))
+
+
+class ProviderRegistry:
+    """Rejestr dostawców API z kilkoma endpointami na pole i żądaniami zabezpieczającymi.
+
+    Pole jest identyfikowane pierwszym (kanonicznym) adresem na liście. Najpierw pytany
+    jest najszybszy dostępny dostawca (ranking EWMA); gdy nie odpowie w czasie p95 swoich
+    odpowiedzi, wysyłane jest jedno żądanie zabezpieczające do następnego - wygrywa
+    pierwsza poprawna odpowiedź. Po błędzie od razu próbowany jest kolejny dostawca.
+    """
+
+    def __init__(self, get_text, num_workers: int = PROVIDER_FETCH_WORKERS):
+        self._get_text = get_text
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(2, num_workers),
+                                                               thread_name_prefix="ProviderFetch")
+        self._fields: Dict[str, Tuple[List[ProviderHealth], Any]] = {} # kanoniczny URL -> (endpointy, walidator)
+
+    def register(self, urls: List[str], validate=None) -> None:
+        unique_urls = list(dict.fromkeys(urls))
+        self._fields[unique_urls[0]] = ([ProviderHealth(url) for url in unique_urls], validate)
+
+    def _attempt(self, health: ProviderHealth, validate) -> Tuple[str, str]:
+        started = time.monotonic()
+        try:
+            data = self._get_text(health.url, timeout=API_TIMEOUT_SECONDS)
+            if validate is not None and not validate(data):
+                raise requests.exceptions.RequestException(f"Niepoprawna odpowiedź {health.url}: {data[:40]!r}")
+        except Exception:
+            health.record_failure(time.monotonic())
+            raise
+        health.record_success(time.monotonic() - started)
+        return data, health.url
+
+    def fetch(self, url: str) -> str:
+        """Pobiera pole o kanonicznym adresie `url` (nieznany adres - zwykłe żądanie)."""
+        return self.fetch_with_provider(url)[0]
+
+    def fetch_with_provider(self, url: str) -> Tuple[str, str]:
+        """Jak `fetch`, ale zwraca też adres dostawcy, który odpowiedział."""
+        if url not in self._fields:
+            return self._get_text(url, timeout=API_TIMEOUT_SECONDS), url
+        providers, validate = self._fields[url]
+        now = time.monotonic()
+        candidates = sorted((h for h in providers if h.available(now)), key=ProviderHealth.rank)
+        if not candidates:
+            raise requests.exceptions.ConnectionError(f"Wszyscy dostawcy dla {url} są wyłączeni (circuit breaker).")
+
+        pending: Dict[concurrent.futures.Future, ProviderHealth] = {}
+        def launch(health: ProviderHealth) -> None:
+            pending[self._executor.submit(self._attempt, health, validate)] = health
+
+        launch(candidates.pop(0))
+        hedge_delay = next(iter(pending.values())).hedge_delay()
+        hedged = False
+        last_error: Optional[Exception] = None
+        deadline = now + API_TIMEOUT_SECONDS + 1
+        while pending:
+            wait_for = hedge_delay if candidates and not hedged else max(0.0, deadline - time.monotonic())
+            done, _ = concurrent.futures.wait(pending, timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                if candidates and not hedged:
+                    hedged = True
+                    logging.debug(f"Brak odpowiedzi po {hedge_delay:.2f}s (p95) - żądanie zabezpieczające do {candidates[0].url}")
+                    launch(candidates.pop(0))
+                    continue
+                break # Przekroczony całkowity czas
+            for future in done:
+                health = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    logging.debug(f"Dostawca {health.url} zawiódł: {e}")
+                    last_error = e
+                    if candidates:
+                        launch(candidates.pop(0)) # Szybkie przełączenie po błędzie
+        if last_error is not None:
+            raise last_error
+        raise requests.exceptions.Timeout(f"Brak odpowiedzi dostawców dla {url} w {API_TIMEOUT_SECONDS}s.")
+
+    def stats(self) -> Dict[str, List[str]]:
+        return {url: [f"{h.url} (ewma={h.ewma if h.ewma is None else round(h.ewma, 3)}, błędy={h.failures})" for h in providers]
+                for url, (providers, _) in self._fields.items()}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+# --- Adaptacyjne Odpytywanie Bloków ---
+class BlockPollPolicy:
+    """Decyduje, kiedy odpytać endpointy tipu łańcucha.
+
+    Wysokość bloku jest odpytywana co POLL_INTERVAL_SECONDS przez klienta z żądaniami
+    warunkowymi (ETag/If-Modified-Since): dopóki nie ma nowego bloku, serwer odpowiada 304
+    bez treści, więc częste odpytanie jest tanie, a nowy blok widać najpóźniej po jednym odstępie.
+    Hash pobierany jest tylko po zmianie wysokości - i ponawiany, jeśli jego endpoint nie widzi
+    jeszcze nowego bloku. Tylko błędy wydłużają odstęp (wykładniczo, do POLL_BACKOFF_MAX_SECONDS).
+    Metody wywołuje wątek Tkinter (bez blokad).
+    """
+
+    def __init__(self, interval: float = POLL_INTERVAL_SECONDS, backoff_max: float = POLL_BACKOFF_MAX_SECONDS,
+                 hash_retry_limit: int = HASH_RETRY_LIMIT):
+        self._interval = interval
+        self._backoff_max = max(interval, backoff_max)
+        self._hash_retry_limit = hash_retry_limit
+        self._last_height: Optional[str] = None
+        self._last_hash: Optional[str] = None
+        self._errors: Dict[str, int] = {'height': 0, 'hash': 0} # Kolejne błędy per endpoint
+        self._next_poll: Dict[str, float] = {'height': 0.0, 'hash': 0.0}
+        self._hash_wanted = True
+        self._hash_retries = 0
+        self._push_active = False
+
+    def _backoff(self, key: str) -> float:
+        return min(self._backoff_max, self._interval * (2 ** self._errors[key]))
+
+    def height_interval(self, now: float) -> float:
+        """Odstęp do następnego odpytania wysokości (stały; dłuższy tylko przy push lub po błędach)."""
+        if self._push_active:
+            # Nowe bloki przychodzą jako powiadomienia - co najwyżej rzadkie odpytywanie kontrolne
+            return TIP_PUSH_SAFETY_POLL_SECONDS if TIP_PUSH_SAFETY_POLL_SECONDS > 0 else float('inf')
+        if self._errors['height']:
+            return self._backoff('height')
+        return self._interval
+
+    def due(self, now: float) -> List[str]:
+        """Zwraca klucze endpointów, które należy teraz odpytać."""
+        keys = []
+        if now >= self._next_poll['height']:
+            keys.append('height')
+        if self._hash_wanted and now >= self._next_poll['hash']:
+            keys.append('hash')
+        return keys
+
+    def set_push_active(self, active: bool, now: float) -> None:
+        """Włącza/wyłącza tryb push: gdy źródło powiadomień działa, wysokość nie jest odpytywana."""
+        if active == self._push_active:
+            return
+        self._push_active = active
+        if self._next_poll['height'] != float('inf'): # Nie ruszaj żądania w toku
+            self._next_poll['height'] = now + self.height_interval(now) if active else now
+        logging.info(f"Powiadomienia push o blokach {'aktywne - odpytywanie wstrzymane' if active else 'nieaktywne - wznowiono odpytywanie'}.")
+
+    def next_due_in(self, now: float) -> float:
+        """Sekundy do najbliższego terminu odpytania (inf, gdy wszystko czeka na wynik lub push)."""
+        deadlines = [self._next_poll['height']]
+        if self._hash_wanted:
+            deadlines.append(self._next_poll['hash'])
+        return max(0.0, min(deadlines) - now)
+
+    @property
+    def tip_settled(self) -> bool:
+        """True, gdy hash odpowiada ostatniej wysokości (nie czekamy na hash nowego bloku)."""
+        return not self._hash_wanted
+
+    def mark_requested(self, key: str) -> None:
+        """Wstrzymuje kolejne odpytania endpointu do czasu nadejścia wyniku ('tip' = wysokość i hash)."""
+        for k in (('height', 'hash') if key == 'tip' else (key,)):
+            self._next_poll[k] = float('inf')
+
+    def on_result(self, key: str, value: Optional[str], now: float) -> None:
+        """Przyjmuje wynik pobierania (value=None oznacza błąd) i planuje następne odpytanie."""
+        if value is None:
+            self._errors[key] += 1
+            self._next_poll[key] = now + self._backoff(key)
+            return
+        self._errors[key] = 0
+
+        if key == 'height':
+            if value != self._last_height:
+                if self._last_height is not None:
+                    logging.info(f"Nowy blok: {self._last_height} -> {value}. Pobieranie hasha.")
+                self._last_height = value
+                self._hash_wanted = True
+                self._hash_retries = 0
+                self._next_poll['hash'] = now
+            self._next_poll['height'] = now + self.height_interval(now)
+        elif key == 'hash':
+            if value == self._last_hash and self._hash_retries < self._hash_retry_limit:
+                # Endpoint hasha (inny dostawca) jeszcze nie widzi nowego bloku - spróbuj wkrótce
+                self._hash_retries += 1
+                self._next_poll['hash'] = now + self._interval
+            else:
+                self._last_hash = value
+                self._hash_wanted = False
+
+
+# --- Powiadomienia Push o Nowych Blokach ---
+class TipPushProvider:
+    """Bazowy dostawca powiadomień push: wątek w tle utrzymuje subskrypcję i ponawia połączenie.
+
+    Podklasy implementują `_listen()` - blokuje na czas połączenia i dla każdego zdarzenia
+    wywołuje `_emit(wysokość, hash)`. Callback `on_tip` i `on_state` są wołane z wątku
+    dostawcy, więc odbiorca musi sam przekazać dane do wątku Tkinter.
+    """
+
+    name = "push"
+
+    def __init__(self, on_tip, on_state=None, reconnect_max: float = TIP_PUSH_RECONNECT_MAX_SECONDS):
+        self._on_tip = on_tip
+        self._on_state = on_state or (lambda connected: None)
+        self._reconnect_max = reconnect_max
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._connected = False
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"TipPush-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._close_connection()
+
+    def _close_connection(self) -> None:
+        pass
+
+    def _set_connected(self, connected: bool) -> None:
+        if connected != self._connected:
+            self._connected = connected
+            self._on_state(connected)
+
+    def _emit(self, height: Any = None, block_hash: Any = None) -> None:
+        """Waliduje zdarzenie i przekazuje je odbiorcy (niepoprawne pola są pomijane)."""
+        height = str(height) if height is not None and str(height).isdigit() else None
+        if not (isinstance(block_hash, str) and len(block_hash) == 64
+                and all(c in '0123456789abcdef' for c in block_hash.lower())):
+            block_hash = None
+        if height is None and block_hash is None:
+            return
+        logging.debug(f"Powiadomienie push ({self.name}): wysokość={height}, hash={block_hash}")
+        self._on_tip(height, block_hash)
+
+    def _listen(self) -> None:
+        raise NotImplementedError
+
+    def _run(self) -> None:
+        delay = 1.0
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                delay = 1.0 # Połączenie zakończyło się normalnie - ponów od razu z małym odstępem
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                logging.warning(f"Błąd źródła powiadomień push ({self.name}): {e}. Ponowienie za {delay:.0f}s.")
+            finally:
+                self._set_connected(False)
+            self._stop_event.wait(delay)
+            delay = min(self._reconnect_max, delay * 2)
+        logging.debug(f"Wątek źródła push ({self.name}) zakończony.")
+
+
+class LineStreamTipProvider(TipPushProvider):
+    """Strumień tekstowy przez gniazdo Unix lub TCP - jedna linia na blok.
+
+    Linia to obiekt JSON z polami `height` i/lub `hash`, albo tokeny oddzielone spacjami
+    (liczba = wysokość, 64 znaki hex = hash). Pasuje np. do skryptu `blocknotify` węzła
+    albo lokalnego zastępczego serwera w testach.
+    """
+
+    def __init__(self, address: str, on_tip, on_state=None, **kwargs):
+        super().__init__(on_tip, on_state, **kwargs)
+        self._address = address
+        self.name = address
+        self._sock: Optional[socket.socket] = None
+
+    def _connect(self) -> socket.socket:
+        if self._address.startswith("unix://"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(API_TIMEOUT_SECONDS)
+            sock.connect(self._address[len("unix://"):])
+        else:
+            host, _, port = self._address[len("tcp://"):].rpartition(":")
+            sock = socket.create_connection((host, int(port)), timeout=API_TIMEOUT_SECONDS)
+        sock.settimeout(1.0) # Krótki timeout odczytu - regularne sprawdzanie sygnału stop
+        return sock
+
+    def _close_connection(self) -> None:
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try: sock.close()
+            except OSError: pass
+
+    def _handle_line(self, line: str) -> None:
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith("{"):
+            message = json.loads(line)
+            self._emit(message.get('height'), message.get('hash') or message.get('id'))
+            return
+        height = block_hash = None
+        for token in line.split():
+            if token.isdigit():
+                height = token
+            elif len(token) == 64:
+                block_hash = token
+        self._emit(height, block_hash)
+
+    def _listen(self) -> None:
+        self._sock = self._connect()
+        self._set_connected(True)
+        logging.info(f"Połączono ze źródłem powiadomień push: {self._address}")
+        pending = b""
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    chunk = self._sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise ConnectionError("źródło zamknęło połączenie")
+                pending += chunk
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    try:
+                        self._handle_line(line.decode('utf-8', 'replace'))
+                    except Exception as e:
+                        logging.warning(f"Niepoprawna linia ze źródła push ({self._address}): {line[:80]!r} ({e})")
+        finally:
+            self._close_connection()
+
+
+class WebSocketTipProvider(TipPushProvider):
+    """Kanał WebSocket w stylu mempool.space (`{"action": "want", "data": ["blocks"]}`)."""
+
+    PING_INTERVAL_SECONDS = 30
+
+    def __init__(self, url: str, on_tip, on_state=None, **kwargs):
+        super().__init__(on_tip, on_state, **kwargs)
+        self._url = url
+        self.name = url
+        self._ws = None
+
+    def _close_connection(self) -> None:
+        ws, self._ws = self._ws, None
+        if ws is not None:
+            try: ws.close()
+            except Exception: pass
+
+    def _handle_message(self, message: Dict[str, Any]) -> None:
+        if isinstance(message.get('block'), dict):
+            block = message['block']
+            self._emit(block.get('height'), block.get('id'))
+        elif isinstance(message.get('blocks'), list) and message['blocks']:
+            # Pierwsza wiadomość po subskrypcji: ostatnie bloki - bierzemy najwyższy
+            block = max((b for b in message['blocks'] if isinstance(b, dict)), key=lambda b: b.get('height', -1), default=None)
+            if block:
+                self._emit(block.get('height'), block.get('id'))
+
+    def _listen(self) -> None:
+        self._ws = websocket.create_connection(self._url, timeout=API_TIMEOUT_SECONDS,
+                                               header=[f"User-Agent: TimechainWidget/{VERSION}"])
+        self._ws.settimeout(1.0)
+        self._ws.send(json.dumps({"action": "want", "data": ["blocks"]}))
+        self._set_connected(True)
+        logging.info(f"Połączono ze źródłem powiadomień push: {self._url}")
+        last_ping = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                if time.monotonic() - last_ping >= self.PING_INTERVAL_SECONDS:
+                    self._ws.ping()
+                    last_ping = time.monotonic()
+                try:
+                    raw = self._ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                if not raw:
+                    raise ConnectionError("źródło zamknęło połączenie")
+                try:
+                    self._handle_message(json.loads(raw))
+                except ValueError:
+                    logging.debug(f"Pominięto niepoprawną wiadomość WebSocket: {raw[:80]!r}")
+        finally:
+            self._close_connection()
+
+
+def create_tip_push_provider(source: Optional[str], on_tip, on_state=None) -> Optional[TipPushProvider]:
+    """Tworzy dostawcę push dla podanego adresu (None, jeśli push wyłączony lub niedostępny)."""
+    if not source:
+        return None
+    if source.startswith(("ws://", "wss://")):
+        if not HAVE_WEBSOCKET:
+            logging.warning(f"Źródło push {source} wymaga modułu websocket-client (pip install websocket-client). Używam odpytywania.")
+            return None
+        return WebSocketTipProvider(source, on_tip, on_state)
+    if source.startswith(("unix://", "tcp://")):
+        if source.startswith("unix://") and not hasattr(socket, "AF_UNIX"):
+            logging.warning("Gniazda Unix nie są dostępne w tym systemie. Używam odpytywania.")
+            return None
+        return LineStreamTipProvider(source, on_tip, on_state)
+    logging.warning(f"Nieznany typ źródła powiadomień push: {source}. Używam odpytywania.")
+    return None
+
+
+# --- Lokalny Węzeł Bitcoin (JSON-RPC) ---
+class NodeRpcClient:
+    """Klient JSON-RPC lokalnego węzła Bitcoin Core na trwałym połączeniu keep-alive.
+
+    Wysokość, hash i czas tipu pochodzą z jednego zapytania w jednej paczce
+    (`getblockchaininfo`): węzeł odczytuje je z tego samego stanu łańcucha, więc para
+    jest spójna nawet wtedy, gdy w trakcie pojawia się nowy blok - bez drugiego zapytania
+    o nagłówek. Czas bloku (`time`) podają węzły od wersji 23; starsze zwracają tylko parę.
+    """
+
+    def __init__(self, url: str, user: Optional[str] = None, password: Optional[str] = None,
+                 cookie_file: Optional[str] = NODE_RPC_COOKIE_FILE):
+        self._url = url
+        self._user = user
+        self._password = password
+        self._cookie_file = cookie_file
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update({'User-Agent': f'TimechainWidget/{VERSION}'})
+        self._session.auth = self._load_auth()
+        self._lock = threading.Lock() # requests.Session nie gwarantuje bezpieczeństwa wątków
+
+    def _load_auth(self) -> Optional[Tuple[str, str]]:
+        if self._user:
+            return (self._user, self._password or "")
+        if self._cookie_file:
+            try:
+                with open(self._cookie_file, 'r', encoding='utf-8') as f:
+                    user, _, password = f.read().strip().partition(":")
+                return (user, password)
+            except OSError as e:
+                logging.warning(f"Nie można odczytać pliku cookie węzła {self._cookie_file}: {e}")
+        return None
+
+    def _batch(self, calls: List[Tuple[str, List[Any]]]) -> List[Any]:
+        """Wysyła paczkę wywołań JSON-RPC i zwraca wyniki w kolejności wywołań."""
+        payload = [{"jsonrpc": "1.0", "id": i, "method": method, "params": params}
+                   for i, (method, params) in enumerate(calls)]
+        with self._lock:
+            response = self._session.post(self._url, json=payload, timeout=API_TIMEOUT_SECONDS)
+            if response.status_code == 401 and not self._user:
+                # Węzeł po restarcie generuje nowe cookie - wczytaj i ponów raz
+                self._session.auth = self._load_auth()
+                response = self._session.post(self._url, json=payload, timeout=API_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        replies = {reply.get('id'): reply for reply in response.json()}
+        results = []
+        for i, (method, _) in enumerate(calls):
+            reply = replies.get(i)
+            if reply is None:
+                raise RuntimeError(f"Brak odpowiedzi węzła na {method}.")
+            if reply.get('error'):
+                raise RuntimeError(f"Błąd węzła w {method}: {reply['error'].get('message', reply['error'])}")
+            results.append(reply.get('result'))
+        return results
+
+    def get_tip(self) -> Tuple[int, str, Optional[int]]:
+        """Zwraca (wysokość, hash, czas bloku) tipu łańcucha."""
+        info = self._batch([("getblockchaininfo", [])])[0]
+        try:
+            height, best_hash = int(info['blocks']), str(info['bestblockhash'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise RuntimeError(f"Niepełna odpowiedź getblockchaininfo: {e}")
+        block_time = info.get('time')
+        return height, best_hash, int(block_time) if isinstance(block_time, int) else None
+
+    def close(self) -> None:
+        self._session.close()
+
+
+# --- Harmonogram Pobierania Danych ---
+class FetchScheduler:
+    """Stała pula wątków pobierających dane z API, bez nakładania się żądań.
+
+    Każdy endpoint (klucz) ma co najwyżej jedno żądanie w toku - kolejne zlecenia są
+    pomijane, dopóki poprzednie się nie zakończy. `fetch_func(url, **kwargs)` zwraca parę
+    (dane, ok). Wyniki trafiają do kolejki `results`, którą opróżnia wątek Tkinter,
+    więc przy wolnej sieci nie przybywa wątków. Opcjonalny `on_result()` jest wołany z wątku
+    roboczego po każdym wyniku (np. żeby obudzić wątek Tkinter).
+    """
+
+    def __init__(self, fetch_func, endpoints: Dict[str, str], num_workers: int = FETCH_SCHEDULER_WORKERS, on_result=None):
+        self._fetch_func = fetch_func
+        self._on_result = on_result
+        self._endpoints = dict(endpoints)
+        self._jobs: "queue.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.Queue()
+        self.results: "queue.Queue[Tuple[str, Optional[str], bool, float]]" = queue.Queue() # (klucz, dane, ok, czas żądania)
+        self._in_flight: set = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stopped = False
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"FetchWorker-{i}", daemon=True)
+                         for i in range(max(1, num_workers))]
+        for t in self._workers: t.start()
+
+    def request(self, key: str, **fetch_kwargs) -> bool:
+        """Zleca pobranie endpointu. Zwraca False, jeśli żądanie już trwa (lub harmonogram zatrzymano)."""
+        with self._lock:
+            if self._stopped or key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+        self._jobs.put((key, fetch_kwargs))
+        return True
+
+    def request_all(self, **fetch_kwargs) -> List[str]:
+        """Zleca pobranie wszystkich endpointów bez żądania w toku. Zwraca klucze nowych zleceń."""
+        return [key for key in self._endpoints if self.request(key, **fetch_kwargs)]
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Czeka, aż nie będzie żądań w toku. Zwraca False po przekroczeniu timeoutu."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self) -> None:
+        """Zatrzymuje wątki robocze (nie czeka na żądania w toku - wątki są daemon)."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        for _ in self._workers:
+            self._jobs.put(None)
+
+    def _worker_loop(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            key, fetch_kwargs = job
+            url = self._endpoints[key]
+            started = time.monotonic()
+            try:
+                data, ok = self._fetch_func(url, **fetch_kwargs)
+            except Exception as e:
+                logging.warning(f"Wyjątek podczas pobierania danych dla {key} ({url}): {e}")
+                data, ok = f"Error: {e.__class__.__name__}", False
+            # Wynik trafia do kolejki przed zwolnieniem endpointu - kolejne żądanie nie wyprzedzi wyniku
+            self.results.put((key, data, ok, time.monotonic() - started))
+            with self._idle:
+                self._in_flight.discard(key)
+                self._idle.notify_all()
+            if self._on_result is not None:
+                try:
+                    self._on_result()
+                except Exception as e:
+                    logging.debug(f"Błąd powiadomienia o wyniku pobierania: {e}")
+
+
+# --- Indeks Nagłówków Bloków ---
+class BlockHeaderIndex:
+    """Trwały indeks wysokość -> (hash, czas) bloku w pliku mapowanym do pamięci.
+
+    Rekordy mają stałą długość i leżą pod przesunięciem `nagłówek + wysokość * 40 B`,
+    więc odczyt po wysokości to O(1), a cały łańcuch (~900 tys. bloków) zajmuje ok. 36 MB.
+    Plik rośnie tylko na końcu; wpis dla istniejącej wysokości jest nadpisywany jedynie
+    przy reorganizacji łańcucha albo przez zweryfikowaną parę (niezweryfikowana nie nadpisuje
+    zweryfikowanej). Wyszukiwanie po hashu korzysta z posortowanej tablicy
+    (ostatnie 8 bajtów hasha -> wysokość), budowanej przy pierwszym zapytaniu.
+    """
+
+    MAGIC = b"TCWBIDX1"
+    VERSION = 1
+    HEADER = struct.Struct("<8sII") # magic, wersja, rozmiar rekordu
+    RECORD = struct.Struct("<32sII") # hash (bajty w kolejności wyświetlania), czas unix, flagi
+    FLAG_PRESENT = 1
+    FLAG_OBSERVED_TIME = 2 # Czas zaobserwowania bloku, nie znacznik czasu z nagłówka
+    FLAG_VERIFIED_PAIR = 4 # Para z jednego zapytania (węzeł) lub potwierdzona hashem bloku na tej wysokości
+
+    def __init__(self, path: str, grow_records: int = BLOCK_INDEX_GROW_RECORDS):
+        self._path = path
+        self._grow_records = max(1, grow_records)
+        self._lock = threading.Lock()
+        self._hash_index: Optional[Tuple[np.ndarray, np.ndarray]] = None # (posortowane sufiksy, wysokości)
+        exists = os.path.exists(path) and os.path.getsize(path) >= self.HEADER.size
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        try:
+            if exists:
+                magic, version, record_size = self.HEADER.unpack(self._file.read(self.HEADER.size))
+                if magic != self.MAGIC or version != self.VERSION or record_size != self.RECORD.size:
+                    raise ValueError(f"Nieobsługiwany format indeksu bloków: {path}")
+            else:
+                self._file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size))
+                self._file.flush()
+            self._capacity = (os.fstat(self._file.fileno()).st_size - self.HEADER.size) // self.RECORD.size
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        except Exception:
+            self._file.close()
+            raise
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def _ensure_capacity_locked(self, height: int) -> None:
+        if height < self._capacity:
+            return
+        new_capacity = (height // self._grow_records + 1) * self._grow_records
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self.HEADER.size + new_capacity * self.RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._capacity = new_capacity
+
+    def record(self, height: int, block_hash: str, block_time: Optional[int] = None, verified: bool = False) -> bool:
+        """Zapisuje blok. Zwraca False, jeśli identyczny wpis już istnieje."""
+        raw_hash = bytes.fromhex(block_hash)
+        if height < 0 or len(raw_hash) != 32:
+            raise ValueError(f"Niepoprawny blok do indeksu: {height} {block_hash}")
+        flags = self.FLAG_PRESENT | (0 if block_time else self.FLAG_OBSERVED_TIME) | (self.FLAG_VERIFIED_PAIR if verified else 0)
+        with self._lock:
+            self._ensure_capacity_locked(height)
+            offset = self.HEADER.size + height * self.RECORD.size
+            old_hash, _, old_flags = self.RECORD.unpack_from(self._map, offset)
+            if old_flags & self.FLAG_PRESENT and old_flags & self.FLAG_VERIFIED_PAIR and not verified and old_hash != raw_hash:
+                return False # Para z dwóch endpointów nie może zastąpić zweryfikowanego wpisu
+            if old_flags & self.FLAG_PRESENT and old_hash == raw_hash:
+                # Ten sam blok - nadpisz tylko, jeśli nowy wpis ma dokładniejszy czas lub weryfikację
+                if (old_flags & self.FLAG_OBSERVED_TIME) <= (flags & self.FLAG_OBSERVED_TIME) \
+                        and (old_flags & self.FLAG_VERIFIED_PAIR) >= (flags & self.FLAG_VERIFIED_PAIR):
+                    return False
+            self.RECORD.pack_into(self._map, offset, raw_hash, int(block_time or time.time()), flags)
+            self._hash_index = None
+        return True
+
+    def get(self, height: int) -> Optional[Tuple[str, int, int]]:
+        """Zwraca (hash, czas, flagi) dla wysokości albo None."""
+        with self._lock:
+            if height < 0 or height >= self._capacity:
+                return None
+            raw_hash, block_time, flags = self.RECORD.unpack_from(self._map, self.HEADER.size + height * self.RECORD.size)
+        if not flags & self.FLAG_PRESENT:
+            return None
+        return raw_hash.hex(), block_time, flags
+
+    def find_height(self, block_hash: str) -> Optional[int]:
+        """Zwraca wysokość bloku o podanym hashu (wyszukiwanie binarne w posortowanym indeksie)."""
+        raw_hash = bytes.fromhex(block_hash)
+        key = int.from_bytes(raw_hash[24:], 'big') # Początek hasha to zera - sufiks jest losowy
+        with self._lock:
+            if self._hash_index is None:
+                self._hash_index = self._build_hash_index_locked()
+            suffixes, heights = self._hash_index
+            i = int(np.searchsorted(suffixes, np.uint64(key), side='left')) # Bez konwersji do float64
+            while i < len(suffixes) and int(suffixes[i]) == key:
+                height = int(heights[i])
+                offset = self.HEADER.size + height * self.RECORD.size
+                if self._map[offset:offset + 32] == raw_hash:
+                    return height
+                i += 1
+        return None
+
+    def _build_hash_index_locked(self) -> Tuple[np.ndarray, np.ndarray]:
+        records = np.frombuffer(self._map, dtype=np.uint8, count=self._capacity * self.RECORD.size,
+                                offset=self.HEADER.size).reshape(self._capacity, self.RECORD.size)
+        # Kopie kolumn - widok na mmap nie może przeżyć tej funkcji (blokowałby zmianę rozmiaru)
+        suffixes = np.ascontiguousarray(records[:, 24:32]).view('>u8').ravel().astype(np.uint64)
+        flags = np.ascontiguousarray(records[:, 36:40]).view('<u4').ravel()
+        del records
+        heights = np.nonzero(flags & self.FLAG_PRESENT)[0]
+        order = np.argsort(suffixes[heights], kind='stable')
+        return suffixes[heights][order], heights[order]
+
+    def close(self) -> None:
+        with self._lock:
+            self._hash_index = None
+            try:
+                self._map.flush()
+                self._map.close()
+            finally:
+                self._file.close()
+
+
+# --- Model Renderowania Etykiet ---
+class LabelRenderState:
+    """Ostatnio zastosowane opcje etykiety Tk.
+
+    `apply` przekazuje do `config` tylko opcje, których wartość się zmieniła, a `place` /
+    `forget` pamiętają, czy etykieta jest umieszczona - cykl odświeżania nie rekonfiguruje
+    Tk, gdy nic się nie zmieniło.
+    """
+
+    def __init__(self, widget: tk.Widget, **applied: Any):
+        self.widget = widget
+        self._applied: Dict[str, Any] = dict(applied)
+        self.placed = False
+        self.config_calls = 0 # Statystyka: faktyczne wywołania config()
+
+    def apply(self, **options: Any) -> bool:
+        """Ustawia opcje etykiety; zwraca True, jeśli którakolwiek się zmieniła."""
+        changed = {name: value for name, value in options.items() if self._applied.get(name) != value}
+        if not changed:
+            return False
+        self._configure(changed)
+        self._applied.update(changed)
+        self.config_calls += 1
+        return True
+
+    def _configure(self, options: Dict[str, Any]) -> None:
+        self.widget.config(**options)
+
+    def place(self, x: int, y: int) -> None:
+        if not self.placed:
+            self.widget.place(x=x, y=y)
+            self.placed = True
+
+    def forget(self) -> None:
+        if self.placed:
+            self.widget.place_forget()
+            self.placed = False
+
+
+class CanvasTextState(LabelRenderState):
+    """Odpowiednik `LabelRenderState` dla elementu tekstowego na wspólnym Canvas.
+
+    Opcje mają nazwy jak dla etykiety (`fg` zamiast `fill`), a ukrycie cienia zmienia
+    tylko stan elementu - Canvas nie układa widżetów potomnych przy każdej zmianie.
+    """
+
+    _OPTION_NAMES = {'fg': 'fill'}
+
+    def __init__(self, canvas: tk.Canvas, item: int, **applied: Any):
+        super().__init__(canvas, **applied)
+        self.item = item
+        self.placed = True # Element istnieje od utworzenia (stan 'normal')
+
+    def _configure(self, options: Dict[str, Any]) -> None:
+        self.widget.itemconfigure(self.item, **{self._OPTION_NAMES.get(name, name): value for name, value in options.items()})
+
+    def place(self, x: int, y: int) -> None:
+        if not self.placed:
+            self.widget.coords(self.item, x, y)
+            self.widget.itemconfigure(self.item, state='normal')
+            self.placed = True
+
+    def forget(self) -> None:
+        if self.placed:
+            self.widget.itemconfigure(self.item, state='hidden')
+            self.placed = False
+
+
+# --- Zegar Wyrównany do Pełnych Sekund ---
+class SecondAlignedTicker:
+    """Wylicza opóźnienia ticków zegara wypadających tuż po pełnych sekundach czasu ściennego.
+
+    Każde opóźnienie liczone jest od nowa względem najbliższej granicy sekundy (a nie jako
+    stałe 1000 ms po wykonanej pracy), więc błąd się nie kumuluje. Termin ticku jest trzymany
+    w czasie monotonicznym - spóźnienie o ponad sekundę (pominięta sekunda na ekranie) jest
+    liczone, a tick, który przyszedł przed granicą sekundy, jest rozpoznawany i powtarzany.
+    """
+
+    def __init__(self, margin_ms: int = CLOCK_TICK_MARGIN_MS):
+        self._margin = max(0, margin_ms) / 1000.0
+        self._deadline: Optional[float] = None # Monotoniczny termin następnego ticku
+        self._last_second: Optional[int] = None # Ostatnia obsłużona sekunda czasu ściennego
+        self.late_ticks = 0 # Statystyka: ticki spóźnione o ponad sekundę
+
+    def next_delay_ms(self) -> int:
+        """Opóźnienie (ms) do ticku tuż po następnej pełnej sekundzie."""
+        wall, mono = time.time(), time.monotonic()
+        next_second = math.floor(wall) + 1
+        if next_second == self._last_second:
+            next_second += 1 # Bieżąca sekunda już obsłużona (tick przyszedł przed czasem)
+        self._deadline = mono + (next_second - wall) + self._margin
+        return max(1, math.ceil((self._deadline - mono) * 1000))
+
+    def begin_tick(self) -> Optional[float]:
+        """Zwraca czas ścienny ticku albo None, jeśli sekunda nie zmieniła się od poprzedniego."""
+        wall, mono = time.time(), time.monotonic()
+        second = int(wall)
+        if second == self._last_second:
+            return None
+        if self._deadline is not None and mono - self._deadline > 1.0:
+            self.late_ticks += 1
+            logging.debug(f"Tick zegara spóźniony o {mono - self._deadline:.2f}s.")
+        self._last_second = second
+        return wall
+
+
+# --- Pomiar Czasu Startu ---
+class StartupTimer:
+    """Zbiera czasy kolejnych etapów startu aż do pierwszego wyświetlenia widgetu."""
+
+    def __init__(self, started: float):
+        self._started = started
+        self._last = started
+        self.phases: List[Tuple[str, float]] = [] # (etap, czas trwania w sekundach)
+
+    def mark(self, phase: str, now: Optional[float] = None) -> None:
+        """Zamyka etap `phase` w chwili `now` (domyślnie teraz)."""
+        now = time.perf_counter() if now is None else now
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def elapsed(self) -> float:
+        """Czas od początku startu do teraz."""
+        return time.perf_counter() - self._started
+
+    def summary(self) -> str:
+        parts = [f"{phase} {duration * 1000:.0f} ms" for phase, duration in self.phases]
+        return f"{(self._last - self._started) * 1000:.0f} ms ({', '.join(parts)})"
+
 
 # --- Główna Klasa Widgetu ---
 class TimechainWidget:
-    def __init__(self, master: tk.Tk, initial_prompt: str, lang: str):
+    def __init__(self, master: tk.Tk, initial_prompt: str, lang: str, startup_timer: Optional[StartupTimer] = None):
         self.master = master
         self.prompt = initial_prompt
         self.lang = lang
+        self._startup_timer = startup_timer or StartupTimer(time.perf_counter())
+        self._first_paint_done = False
         self._cache_dir = self._setup_cache_dir()
+        # Indeks czcionek (budowany raz) i cache załadowanych czcionek PIL
+        self._font_index: Optional[Dict[str, str]] = None
+        self._resolved_font_paths: Dict[Tuple[str, Tuple[str, ...]], Optional[str]] = {}
+        self._loaded_fonts: Dict[Tuple[Optional[str], int], Any] = {}
+        self._loaded_fonts_lock = threading.Lock()
+        self._font_lookup_lock = threading.Lock() # Indeks i ścieżki czcionek (wątek w tle i wątki przechwytywania)
         self._cancel_update = False
         self._key_listener_thread = None
         self._key_listener_stop_event = threading.Event()
         self._listener_instance = None # Przechowuje instancję listenera pynput
-        self._update_timer = None
+        self._update_timer = None # Tick zegara (co sekundę, wyrównany do pełnych sekund)
+        self._data_timer = None # Odświeżenie danych (termin z polityki odpytywania)
+        self._color_check_timer = None
+        self._clock_ticker = SecondAlignedTicker()
+        self._fetch_wakeup_pending = False
+        self._first_data_logged = False
 
         # Dane dynamiczne
         self._current_time_str = "..."
@@ -206,37 +2341,108 @@ class TimechainWidget:
         self._block_hash_short_str = "..."
         self._full_block_hash_str = None
         self._last_error = None
+        self._fetch_errors: Dict[str, str] = {} # Ostatni błąd per endpoint (składa się na _last_error)
+        self._stale_fields: set = set() # Pola pokazywane z ostatniego znanego stanu, bez świeżego potwierdzenia
+        self._tip_block_time: Optional[int] = None # Znacznik czasu tipu z nagłówka (tylko z węzła)
+        self._header_index = self._open_header_index()
+        self._last_indexed_tip: Optional[Tuple[str, str]] = None
+        self._tip_verification_active = False # Czy wątek weryfikacji pary wysokość/hash działa
+        # Stała pula pobierająca dane z API przez współdzielony klient HTTP; wyniki odbiera wątek Tkinter z kolejki
+        self._http_client = ApiHttpClient()
+        self._api_cache = ApiDataCache(self._cache_dir)
+        # Kilku dostawców na pole: ranking wg czasu odpowiedzi, żądania zabezpieczające, circuit breaker
+        self._providers = ProviderRegistry(self._http_client.get_text)
+        self._providers.register(BLOCK_HEIGHT_URLS, validate=lambda d: d.isdigit())
+        self._providers.register(BLOCK_HASH_URLS, validate=lambda d: len(d) == 64 and all(c in '0123456789abcdef' for c in d.lower()))
+        # Lokalny węzeł (jeśli skonfigurowany) zastępuje dwa publiczne endpointy jednym źródłem 'tip'
+        self._node_rpc = NodeRpcClient(NODE_RPC_URL, NODE_RPC_USER, NODE_RPC_PASSWORD) if NODE_RPC_URL else None
+        if self._node_rpc is not None:
+            self._fetch_scheduler = FetchScheduler(self._fetch_node_tip, {'tip': NODE_RPC_URL}, num_workers=1,
+                                                   on_result=self._wake_for_fetch_results)
+        else:
+            self._fetch_scheduler = FetchScheduler(self._fetch_endpoint, {'height': BLOCK_HEIGHT_URL, 'hash': BLOCK_HASH_URL},
+                                                   on_result=self._wake_for_fetch_results)
+        self._poll_policy = BlockPollPolicy() # Kiedy odpytywać wysokość/hash (wywoływane w wątku Tkinter)
+        # Opcjonalne źródło powiadomień push (wstrzymuje odpytywanie, gdy jest połączone)
+        self._tip_push_provider = create_tip_push_provider(TIP_PUSH_SOURCE, self._on_tip_push, self._on_tip_push_state)
 
         # Stan UI
         self.label_shadow: Optional[Label] = None
         self.label_main: Optional[Label] = None
         self._base_font_options = (FONT_FAMILY, BASE_FONT_SIZE, FONT_WEIGHT)
         self._current_font_options = self._base_font_options
+        self._text_canvas: Optional[tk.Canvas] = None # Tylko dla TEXT_RENDERER_CANVAS
+        self._main_text_state: Optional[LabelRenderState] = None
+        self._shadow_text_state: Optional[LabelRenderState] = None
+        self._tk_fonts: Dict[Tuple[Any, ...], Tuple[tkfont.Font, int]] = {} # Opcje czcionki -> (Font, wysokość linii)
+        self._text_width_cache: "OrderedDict[Tuple[Tuple[Any, ...], str], int]" = OrderedDict()
+        self._text_padding = (0, 0) # Ramka i marginesy wokół tekstu (szerokość, wysokość) doliczane do rozmiaru okna
+        self._shadow_position = (SHADOW_OFFSET_X, SHADOW_OFFSET_Y) # Położenie cienia w oknie
+        self._applied_window_size: Optional[Tuple[int, int]] = None
         self._display_full_hash_permanently_var = BooleanVar(value=False)
         self.last_click_x = 0
         self.last_click_y = 0
         self._drag_start_x_root = 0
         self._drag_start_y_root = 0
         self._is_dragging = False
+        self._drag_pointer: Optional[Tuple[int, int]] = None # Ostatnia pozycja myszy (jeszcze nie zastosowana)
+        self._drag_window_position: Optional[Tuple[int, int]] = None # Pozycja okna ustawiona przez ostatnią klatkę
+        self._drag_frame_job = None
+        self._last_drag_frame = 0.0
+        self._drag_fonts_prepared = False
 
         # Konfiguracja przechwytywania
         self._screenshot_mode_var = StringVar(value=DEFAULT_SCREENSHOT_MODE)
         self._watermark_mode_var = StringVar(value=DEFAULT_WATERMARK_STYLE)
+        self._watermark_style = DEFAULT_WATERMARK_STYLE # Kopia zmiennej Tk dla wątków przechwytywania (zapis tylko w wątku Tk)
+        self._watermark_mode_var.trace_add('write', self._on_watermark_settings_change)
         self._active_capture_thread: Optional[threading.Thread] = None
+        self._capture_area_var = StringVar(value=DEFAULT_CAPTURE_AREA)
+        self._capture_area = DEFAULT_CAPTURE_AREA # Kopia zmiennej Tk dla wątków przechwytywania (zapis tylko w wątku Tk)
+        self._capture_area_var.trace_add('write', self._on_capture_area_change)
+        self._capture_region: Optional[Tuple[int, int, int, int]] = None # Zaznaczony prostokąt (x, y, szer, wys)
+        self._widget_geometry: Optional[Tuple[int, int, int, int]] = None # Aktualizowana w wątku Tk (<Configure>)
         self._video_duration_seconds = DEFAULT_VIDEO_DURATION_SECONDS
         self._gif_duration_seconds = DEFAULT_GIF_DURATION_SECONDS
         self._fixed_watermark_paste_positions: Optional[List[Tuple[int, int]]] = None
         self._video_gif_random_seed: Optional[int] = None
+        self._screen_grabber = create_screen_grabber() # Backend wybierany raz, przy starcie
+        self._brightness_sampler = BackgroundBrightnessSampler(self._screen_grabber)
+        # Cache wyrenderowanych (obróconych) stempli znaku wodnego - klucz: parametry renderowania
+        self._watermark_stamp_cache: "OrderedDict[Tuple[Any, ...], Image.Image]" = OrderedDict()
+        self._watermark_stamp_array_cache: "OrderedDict[Tuple[Any, ...], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._watermark_stamp_cache_lock = threading.Lock()
+        # Bufor natychmiastowej powtórki (ostatnie N sekund ekranu w pamięci)
+        self._replay_enabled_var = BooleanVar(value=REPLAY_ENABLED_BY_DEFAULT)
+        self._replay_buffer: Optional[ReplayRingBuffer] = None
+        self._replay_thread: Optional[threading.Thread] = None
+        self._replay_stop_event = threading.Event()
 
         # Konfiguracja wyglądu
         self._show_shadow_var = BooleanVar(value=True)
+        self._show_shadow = True # Kopia zmiennej Tk dla wątków przechwytywania (zapis tylko w wątku Tk)
+        self._show_shadow_var.trace_add('write', self._on_watermark_settings_change)
         self._current_text_color = DEFAULT_TEXT_COLOR
         self._current_shadow_color = DEFAULT_SHADOW_COLOR
 
+        # Ostatni znany stan z cache - widget pokazuje się od razu, bez czekania na sieć
+        self._restore_last_known_state()
+        self._startup_timer.mark("widget_init")
+
+        # Czcionka Tk potrzebna do pierwszego wyświetlenia (indeks plików czcionek PIL budowany dopiero po nim)
+        self._get_tk_font(self._base_font_options)
+        self._startup_timer.mark("font_lookup")
+
         self._setup_ui()
         self._bind_events()
-        threading.Thread(target=self._initial_data_fetch_and_show, name="InitialFetch", daemon=True).start()
+        self._startup_timer.mark("ui_setup")
+        self._start_initial_fetch()
+        self.master.after(0, self._show_and_start_updates)
         self._setup_key_listener()
+        if self._replay_enabled_var.get():
+            self._start_replay_recorder()
+        if self._tip_push_provider is not None:
+            self._tip_push_provider.start()
 
     def _setup_cache_dir(self) -> Optional[str]:
         """Konfiguruje i zwraca ścieżkę do katalogu cache."""
@@ -263,6 +2469,44 @@ class TimechainWidget:
             logging.error(f"Nie udało się utworzyć katalogu cache: {e}. Cache będzie wyłączony.")
             return None
 
+    def _restore_last_known_state(self) -> None:
+        """Wypełnia pola ostatnimi zapisanymi wartościami (oznaczonymi jako nieaktualne)."""
+        if self._node_rpc is not None:
+            tip = self._api_cache.get_stale(NODE_RPC_URL)
+            parts = tip.split() if tip else []
+            height, block_hash = (parts[0], parts[1]) if len(parts) >= 2 else (None, None)
+        else:
+            height = self._api_cache.get_stale(BLOCK_HEIGHT_URL)
+            block_hash = self._api_cache.get_stale(BLOCK_HASH_URL)
+        if height and height.isdigit():
+            self._block_height_str = height
+            self._stale_fields.add('height')
+        if block_hash and len(block_hash) == 64 and all(c in '0123456789abcdef' for c in block_hash.lower()):
+            self._full_block_hash_str = block_hash
+            self._block_hash_short_str = f"{block_hash[:6]}...{block_hash[-4:]}"
+            self._stale_fields.add('hash')
+        if self._stale_fields:
+            logging.info(f"Przywrócono ostatni znany stan ({', '.join(sorted(self._stale_fields))}) - odświeżanie w tle.")
+
+    def _open_header_index(self) -> Optional[BlockHeaderIndex]:
+        """Otwiera (lub tworzy) indeks nagłówków bloków w katalogu cache."""
+        if not self._cache_dir:
+            return None
+        path = os.path.join(self._cache_dir, BLOCK_INDEX_FILENAME)
+        try:
+            return BlockHeaderIndex(path)
+        except ValueError as e:
+            # Niezgodny format (np. inna wersja) - zacznij od nowa, indeks jest odtwarzalny
+            logging.warning(f"{e}. Tworzę indeks bloków od nowa.")
+            try:
+                os.remove(path)
+                return BlockHeaderIndex(path)
+            except Exception as e_retry:
+                logging.error(f"Nie udało się utworzyć indeksu bloków: {e_retry}")
+        except Exception as e:
+            logging.error(f"Nie udało się otworzyć indeksu bloków {path}: {e}")
+        return None
+
     def _setup_ui(self) -> None:
         """Inicjalizuje interfejs użytkownika widgetu."""
         self.master.attributes('-topmost', True) # Zawsze na wierzchu
@@ -278,31 +2522,87 @@ class TimechainWidget:
 
 
         init_text = "Ładowanie..." if self.lang == 'pl' else "Loading..."
+        if TEXT_RENDERER == TEXT_RENDERER_CANVAS:
+            self._setup_canvas_text(init_text)
+        else:
+            self._setup_label_text(init_text)
+
+        self.master.geometry(INITIAL_WINDOW_POSITION) # Początkowa pozycja okna
+
+    def _setup_label_text(self, init_text: str) -> None:
+        """Tworzy dwie etykiety: cień (pod spodem) i tekst główny."""
         # Etykieta cienia
         self.label_shadow = Label(self.master, text=init_text, font=self._base_font_options,
                                  fg=self._current_shadow_color, bg=TRANSPARENT_COLOR,
                                  justify=tk.LEFT, anchor='nw')
+        self._shadow_text_state = LabelRenderState(self.label_shadow, text=init_text, font=self._base_font_options,
+                                                   fg=self._current_shadow_color)
         if self._show_shadow_var.get():
-            self.label_shadow.place(x=SHADOW_OFFSET_X, y=SHADOW_OFFSET_Y)
+            self._shadow_text_state.place(*self._shadow_position)
 
         # Główna etykieta
         self.label_main = Label(self.master, text=init_text, font=self._base_font_options,
                                 fg=self._current_text_color, bg=TRANSPARENT_COLOR,
                                 justify=tk.LEFT, anchor='nw')
-        self.label_main.place(x=0, y=0)
-
-        self.master.geometry(INITIAL_WINDOW_POSITION) # Początkowa pozycja okna
+        self._main_text_state = LabelRenderState(self.label_main, text=init_text, font=self._base_font_options,
+                                                 fg=self._current_text_color)
+        self._main_text_state.place(0, 0)
+        # Rozmiar etykiety = tekst + 2 * (ramka + podświetlenie + margines) - liczone raz, bez układania okna
+        inset = self.label_main.winfo_pixels(self.label_main.cget('borderwidth')) + \
+                self.label_main.winfo_pixels(self.label_main.cget('highlightthickness'))
+        self._text_padding = (2 * (inset + self.label_main.winfo_pixels(self.label_main.cget('padx'))),
+                              2 * (inset + self.label_main.winfo_pixels(self.label_main.cget('pady'))))
+
+    def _setup_canvas_text(self, init_text: str) -> None:
+        """Tworzy jeden Canvas z dwoma elementami tekstowymi: cieniem i tekstem głównym."""
+        font = self._get_tk_font(self._base_font_options)[0]
+        self._text_canvas = tk.Canvas(self.master, bg=TRANSPARENT_COLOR, highlightthickness=0, borderwidth=0)
+        self._text_canvas.place(x=0, y=0, relwidth=1, relheight=1) # Canvas wypełnia okno
+        # Ujemne przesunięcie cienia przesuwa tekst główny, żeby oba mieściły się w oknie
+        main_x, main_y = max(0, -SHADOW_OFFSET_X), max(0, -SHADOW_OFFSET_Y)
+        self._shadow_position = (main_x + SHADOW_OFFSET_X, main_y + SHADOW_OFFSET_Y)
+        shadow_item = self._text_canvas.create_text(*self._shadow_position, text=init_text,
+                                                    font=font, fill=self._current_shadow_color, anchor='nw', justify=tk.LEFT)
+        main_item = self._text_canvas.create_text(main_x, main_y, text=init_text, font=font,
+                                                  fill=self._current_text_color, anchor='nw', justify=tk.LEFT)
+        self._shadow_text_state = CanvasTextState(self._text_canvas, shadow_item, text=init_text, font=font,
+                                                  fg=self._current_shadow_color)
+        if not self._show_shadow_var.get():
+            self._shadow_text_state.forget()
+        self._main_text_state = CanvasTextState(self._text_canvas, main_item, text=init_text, font=font,
+                                                fg=self._current_text_color)
+        self._text_padding = (0, 0) # Tekst na Canvas nie ma ramki ani marginesów etykiety
 
     def _bind_events(self) -> None:
         """Wiąże zdarzenia myszy z odpowiednimi metodami."""
         # Wiązanie zdarzeń dla głównego okna i etykiet, aby przeciąganie działało płynnie
-        widgets_to_bind = [self.master, self.label_main, self.label_shadow]
+        widgets_to_bind = [self.master, self.label_main, self.label_shadow, self._text_canvas]
         for widget in widgets_to_bind:
             if widget and hasattr(widget, 'winfo_exists') and widget.winfo_exists():
                 widget.bind("<Button-1>", self._on_left_click_press) # Lewy przycisk wciśnięty
                 widget.bind("<B1-Motion>", self._on_drag) # Lewy przycisk wciśnięty i ruch
                 widget.bind("<ButtonRelease-1>", self._on_left_click_release) # Lewy przycisk puszczony
                 widget.bind("<Button-3>", self._on_right_click) # Prawy przycisk kliknięty
+        # Geometria okna zapamiętywana dla wątków przechwytywania (nie wołają winfo_* poza wątkiem Tk)
+        self.master.bind("<Configure>", self._on_configure, add='+')
+
+    def _on_configure(self, event: tk.Event) -> None:
+        """Zapamiętuje położenie i rozmiar okna widgetu (używane przy przechwytywaniu okolicy widgetu)."""
+        if event.widget is not self.master: return # Zdarzenia etykiet też trafiają do okna głównego
+        try:
+            self._widget_geometry = (self.master.winfo_rootx(), self.master.winfo_rooty(),
+                                     self.master.winfo_width(), self.master.winfo_height())
+        except tk.TclError:
+            pass
+
+    def _on_capture_area_change(self, *_args) -> None:
+        """Kopiuje wybrany tryb obszaru do zwykłego atrybutu (wątki przechwytywania nie czytają zmiennych Tk)."""
+        self._capture_area = self._capture_area_var.get()
+
+    def _on_watermark_settings_change(self, *_args) -> None:
+        """Kopiuje styl znaku wodnego i widoczność cienia do zwykłych atrybutów (czytanych przez wątki przechwytywania)."""
+        self._watermark_style = self._watermark_mode_var.get()
+        self._show_shadow = bool(self._show_shadow_var.get())
 
     def _on_left_click_press(self, event: tk.Event) -> None:
         """Obsługa wciśnięcia lewego przycisku myszy (początek przeciągania)."""
@@ -316,50 +2616,88 @@ class TimechainWidget:
         # Zapisanie globalnej pozycji startowej przeciągania (dla skalowania)
         self._drag_start_x_root = event.x_root
         self._drag_start_y_root = event.y_root
+        if ENABLE_DRAG_SCALING:
+            self._prepare_drag_scaling()
+
+    def _prepare_drag_scaling(self) -> None:
+        """Tworzy czcionki dla wszystkich rozmiarów skalowania (raz) i mierzy w nich bieżący tekst."""
+        max_size = int(BASE_FONT_SIZE * (1.0 + MAX_SCALE_INCREASE))
+        sizes = range(min(MIN_SCALED_FONT_SIZE, BASE_FONT_SIZE), max(max_size, BASE_FONT_SIZE) + 1)
+        if not self._drag_fonts_prepared:
+            started = time.perf_counter()
+            for size in sizes:
+                self._get_tk_font((FONT_FAMILY, size, FONT_WEIGHT))
+            self._drag_fonts_prepared = True
+            logging.debug(f"Przygotowano {len(sizes)} rozmiarów czcionki do skalowania w {(time.perf_counter() - started) * 1000:.1f} ms.")
+        # Szerokości linii trafiają do cache - klatki przeciągania nie mierzą tekstu od nowa
+        display_text = self._format_display_text()
+        for size in sizes:
+            self._measure_text(display_text, (FONT_FAMILY, size, FONT_WEIGHT))
+
+    def _drag_target_font_size(self, x_root: int, y_root: int) -> int:
+        """Docelowy rozmiar czcionki dla odległości od początku przeciągania."""
+        distance = math.hypot(x_root - self._drag_start_x_root, y_root - self._drag_start_y_root)
+        # Skala rośnie liniowo z odległością, z ograniczeniem MAX_SCALE_INCREASE
+        scale = 1.0 + min(MAX_SCALE_INCREASE, distance / SCALE_DISTANCE_FACTOR)
+        return max(MIN_SCALED_FONT_SIZE, int(BASE_FONT_SIZE * scale))
 
     def _on_drag(self, event: tk.Event) -> None:
-        """Obsługa przeciągania okna i dynamicznego skalowania czcionki."""
-        if not self._is_dragging or not self.master.winfo_exists():
-            self._is_dragging = False # Na wszelki wypadek
+        """Obsługa przeciągania: zapamiętuje pozycję myszy, okno przesuwa najbliższa klatka."""
+        if not self._is_dragging:
             return
+        self._drag_pointer = (event.x_root, event.y_root)
+        if self._drag_frame_job is None:
+            # Wszystkie ruchy do najbliższej klatki (limit ~60 Hz) dają jedną zmianę geometrii
+            elapsed_ms = (time.perf_counter() - self._last_drag_frame) * 1000
+            delay_ms = max(0, int(DRAG_FRAME_INTERVAL_MS - elapsed_ms))
+            try:
+                self._drag_frame_job = self.master.after(delay_ms, self._apply_drag_frame)
+            except tk.TclError:
+                self._is_dragging = False
 
-        # Obliczenie nowej pozycji okna
-        new_x = event.x_root - self.last_click_x
-        new_y = event.y_root - self.last_click_y
-        try:
-            self.master.geometry(f"+{new_x}+{new_y}")
-        except tk.TclError:
-            # Okno mogło zostać zniszczone w międzyczasie
-            self._is_dragging = False
-            if not self._cancel_update: self._close_widget()
+    def _apply_drag_frame(self) -> None:
+        """Jedna klatka przeciągania: położenie okna i krok skalowania czcionki w jednym wywołaniu geometrii."""
+        self._drag_frame_job = None
+        if self._drag_pointer is None or self._cancel_update or not self.master.winfo_exists():
             return
-
-        # Dynamiczne skalowanie czcionki podczas przeciągania
-        if ENABLE_DRAG_SCALING:
-            distance = math.hypot(event.x_root - self._drag_start_x_root, event.y_root - self._drag_start_y_root)
-            # Skala rośnie liniowo z odległością, z ograniczeniem MAX_SCALE_INCREASE
-            scale = 1.0 + min(MAX_SCALE_INCREASE, distance / SCALE_DISTANCE_FACTOR)
-            new_font_size = max(MIN_SCALED_FONT_SIZE, int(BASE_FONT_SIZE * scale))
-
-            # Zaktualizuj czcionkę tylko jeśli rozmiar się zmienił
-            if new_font_size != self._current_font_options[1]:
-                self._current_font_options = (FONT_FAMILY, new_font_size, FONT_WEIGHT)
-                try:
-                    if self.label_main and self.label_main.winfo_exists():
-                        self.label_main.config(font=self._current_font_options)
-                    if self.label_shadow and self.label_shadow.winfo_exists():
-                        self.label_shadow.config(font=self._current_font_options)
-                    # Odśwież wyświetlanie, aby dostosować rozmiar okna do nowej czcionki
-                    self.master.after_idle(lambda: self._update_display(force_resize=True))
-                except tk.TclError:
-                     if not self._cancel_update: self._close_widget()
-
+        self._last_drag_frame = time.perf_counter()
+        x_root, y_root = self._drag_pointer
+        # Obliczenie nowej pozycji okna
+        new_x = x_root - self.last_click_x
+        new_y = y_root - self.last_click_y
+
+        settled = True
+        if ENABLE_DRAG_SCALING and self._is_dragging:
+            # Rozmiar czcionki dochodzi do docelowego stopniowo (najwyżej DRAG_SCALE_MAX_STEP na klatkę)
+            target_size = self._drag_target_font_size(x_root, y_root)
+            current_size = self._current_font_options[1]
+            if target_size != current_size:
+                step = max(-DRAG_SCALE_MAX_STEP, min(DRAG_SCALE_MAX_STEP, target_size - current_size))
+                self._current_font_options = (FONT_FAMILY, current_size + step, FONT_WEIGHT)
+                settled = current_size + step == target_size
+
+        self._drag_window_position = (new_x, new_y)
+        self._update_display(position=(new_x, new_y))
+        if not settled and self._is_dragging and self._drag_frame_job is None:
+            self._drag_frame_job = self.master.after(DRAG_FRAME_INTERVAL_MS, self._apply_drag_frame)
 
     def _on_left_click_release(self, event: tk.Event) -> None:
         """Obsługa puszczenia lewego przycisku myszy (koniec przeciągania)."""
         if not self._is_dragging: return
         self._is_dragging = False
 
+        # Zastosuj ostatnią, jeszcze nieobsłużoną pozycję myszy
+        if self._drag_frame_job is not None:
+            try:
+                self.master.after_cancel(self._drag_frame_job)
+            except tk.TclError:
+                pass
+            self._drag_frame_job = None
+            self._apply_drag_frame()
+        self._drag_pointer = None
+        # winfo_x()/winfo_y() mogą jeszcze zwracać pozycję sprzed przeciągania (menedżer okien nie przetworzył geometrii)
+        final_position, self._drag_window_position = self._drag_window_position, None
+
         # Sprawdź kolor tła po zakończeniu przeciągania
         if ENABLE_AUTO_COLOR_INVERSION and self.master.winfo_exists():
             self.master.after(50, self._check_and_update_widget_color) # Małe opóźnienie
@@ -367,105 +2705,38 @@ class TimechainWidget:
         # Przywróć bazowy rozmiar czcionki, jeśli była skalowana
         if ENABLE_DRAG_SCALING and self._current_font_options != self._base_font_options:
             self._current_font_options = self._base_font_options
-            try:
-                if self.label_main and self.label_main.winfo_exists():
-                    self.label_main.config(font=self._base_font_options)
-                if self.label_shadow and self.label_shadow.winfo_exists():
-                    self.label_shadow.config(font=self._base_font_options)
-                # Odśwież wyświetlanie, aby dostosować rozmiar okna
-                self.master.after(10, lambda: self._update_display(force_resize=True)) # Małe opóźnienie
-            except tk.TclError:
-                 if not self._cancel_update: self._close_widget()
+            # Odśwież wyświetlanie, aby przywrócić czcionkę i dostosować rozmiar okna (w miejscu upuszczenia)
+            self._update_display(force_resize=True, position=final_position)
 
     def _get_widget_background_brightness(self) -> Optional[float]:
-        """Pobiera próbkę tła pod środkiem widgetu i oblicza średnią jasność."""
+        """Pobiera próbkę tła pod środkiem widgetu i oblicza jej jasność (0-255)."""
         if not self.master.winfo_exists() or not self.master.winfo_viewable():
             return None
         try:
-            # Upewnij się, że geometria okna jest aktualna
-            self.master.update_idletasks()
-
-            width = self.master.winfo_width()
-            height = self.master.winfo_height()
-            x = self.master.winfo_x()
-            y = self.master.winfo_y()
-
+            # Geometria z <Configure> (bez update_idletasks); przed pierwszym zdarzeniem - z winfo
+            geometry = self._widget_geometry or (self.master.winfo_rootx(), self.master.winfo_rooty(),
+                                                 self.master.winfo_width(), self.master.winfo_height())
+            x, y, width, height = geometry
             if width <= 0 or height <= 0:
                 logging.debug("Jasność tła: Nieprawidłowe wymiary widgetu.")
                 return None
 
-            # Środek widgetu
-            center_x, center_y = x + width // 2, y + height // 2
-            half_sample = AUTO_COLOR_SAMPLE_SIZE // 2
+            # Rozmiar ekranu z Tk (bez zrzutu całego ekranu); zmiana rozdzielczości aktualizuje próbnik
+            screen_size = (self.master.winfo_screenwidth(), self.master.winfo_screenheight())
+            if self._brightness_sampler.screen_size != screen_size:
+                self._brightness_sampler.screen_size = screen_size
 
-            # Definiowanie obszaru próbkowania na ekranie
-            screen_size = pyautogui.size() if PYAUTOGUI_AVAILABLE else (0,0) # Potrzebujemy rozmiaru ekranu
-            if not screen_size or screen_size == (0,0):
-                if IMAGEGRAB_AVAILABLE:
-                    # Próba uzyskania rozmiaru ekranu inaczej (może nie działać wszędzie)
-                    try:
-                         temp_im = ImageGrab.grab()
-                         screen_size = temp_im.size
-                    except Exception:
-                         logging.warning("Nie można uzyskać rozmiaru ekranu dla próbkowania jasności.")
-                         return None
-                else:
-                     logging.warning("Nie można uzyskać rozmiaru ekranu (brak pyautogui/ImageGrab).")
-                     return None
-
-
-            sample_x1 = max(0, center_x - half_sample)
-            sample_y1 = max(0, center_y - half_sample)
-            sample_x2 = min(screen_size[0], center_x + half_sample)
-            sample_y2 = min(screen_size[1], center_y + half_sample)
-
-            sample_width = sample_x2 - sample_x1
-            sample_height = sample_y2 - sample_y1
-
-            if sample_width <= 0 or sample_height <= 0:
+            # Przechwytywanie tylko małego kwadratu pod środkiem widgetu
+            try:
+                avg_brightness = self._brightness_sampler.measure(x + width // 2, y + height // 2)
+            except Exception as e:
+                logging.warning(f"Błąd przechwytywania próbki tła ({self._screen_grabber.name}): {e}")
+                return None
+            if avg_brightness is None:
                 logging.debug("Jasność tła: Nieprawidłowy obszar próbkowania.")
                 return None
 
-            # Przechwytywanie małego obszaru ekranu
-            screenshot = None
-            if IMAGEGRAB_AVAILABLE:
-                try:
-                    screenshot = ImageGrab.grab(bbox=(sample_x1, sample_y1, sample_x2, sample_y2))
-                except Exception as e:
-                    logging.warning(f"Błąd ImageGrab.grab: {e}. Próba z pyautogui.")
-                    screenshot = None # Resetuj, aby spróbować pyautogui
-
-            if screenshot is None and PYAUTOGUI_AVAILABLE:
-                try:
-                    # Pyautogui używa regionu (x, y, width, height)
-                    screenshot = pyautogui.screenshot(region=(sample_x1, sample_y1, sample_width, sample_height))
-                except Exception as e:
-                    logging.warning(f"Błąd pyautogui.screenshot: {e}")
-                    return None # Obie metody zawiodły
-
-            if screenshot is None:
-                 logging.warning("Nie udało się przechwycić próbki tła.")
-                 return None
-
-            # Konwersja do skali szarości i obliczenie średniej jasności
-            grayscale = screenshot.convert("L")
-            if NUMPY_AVAILABLE:
-                 # Użycie numpy jest szybsze
-                 brightness_array = np.array(grayscale)
-                 # Sprawdzenie, czy tablica nie jest pusta
-                 if brightness_array.size == 0:
-                     logging.warning("Pusta tablica jasności.")
-                     return None
-                 avg_brightness = float(np.mean(brightness_array))
-            else:
-                 # Fallback bez numpy (wolniejszy)
-                 pixels = list(grayscale.getdata())
-                 if not pixels:
-                     logging.warning("Brak pikseli w próbce jasności.")
-                     return None
-                 avg_brightness = sum(pixels) / len(pixels)
-
-            logging.debug(f"Średnia jasność tła: {avg_brightness:.2f}")
+            logging.debug(f"Jasność tła: {avg_brightness:.2f}")
             return avg_brightness
 
         except tk.TclError:
@@ -490,11 +2761,12 @@ class TimechainWidget:
                 logging.debug("Przywracanie domyślnych kolorów z powodu błędu odczytu jasności.")
                 self._current_text_color = DEFAULT_TEXT_COLOR
                 self._current_shadow_color = DEFAULT_SHADOW_COLOR
+                self._brightness_sampler.inverted = False
                 self._apply_color_update_to_labels()
             return
 
-        # Sprawdź, czy należy odwrócić kolory
-        should_invert = avg_brightness > AUTO_COLOR_BRIGHTNESS_THRESHOLD
+        # Sprawdź, czy należy odwrócić kolory (histereza: szum wokół progu nie przełącza kolorów)
+        should_invert = self._brightness_sampler.update(avg_brightness)
         target_text_color = INVERTED_TEXT_COLOR if should_invert else DEFAULT_TEXT_COLOR
         target_shadow_color = INVERTED_SHADOW_COLOR if should_invert else DEFAULT_SHADOW_COLOR # Poprawka: Cień też powinien się odwracać
 
@@ -509,21 +2781,7 @@ class TimechainWidget:
         """Aktualizuje kolory etykiet (głównej i cienia)."""
         if not self.master.winfo_exists(): return
         try:
-            if self.label_main and self.label_main.winfo_exists():
-                self.label_main.config(fg=self._current_text_color)
-
-            if self.label_shadow and self.label_shadow.winfo_exists():
-                 if self._show_shadow_var.get():
-                     self.label_shadow.config(fg=self._current_shadow_color)
-                     # Upewnij się, że cień jest widoczny, jeśli powinien być
-                     if not self.label_shadow.winfo_ismapped():
-                         self.label_shadow.place(x=SHADOW_OFFSET_X, y=SHADOW_OFFSET_Y)
-                 else:
-                     # Ukryj cień, jeśli nie powinien być widoczny
-                     if self.label_shadow.winfo_ismapped():
-                         self.label_shadow.place_forget()
-
-            # Odświeżenie może być potrzebne, ale unikaj force_resize, jeśli to tylko zmiana koloru
+            # Kolory (i widoczność cienia) ustawia model renderowania - bez przeliczania rozmiaru
             self._update_display(force_resize=False)
         except tk.TclError:
             if not self._cancel_update: self._close_widget()
@@ -543,19 +2801,107 @@ class TimechainWidget:
             # Użyj after(0, ...) aby wykonać to w pętli zdarzeń Tkinter
             self.master.after(0, self._safely_restore_widget_visibility)
 
+    def _select_capture_region(self) -> None:
+        """Wyświetla półprzezroczystą nakładkę, na której użytkownik zaznacza prostokąt do przechwytywania."""
+        if not self.master.winfo_exists(): return
+        overlay = tk.Toplevel(self.master)
+        overlay.overrideredirect(True)
+        overlay.attributes('-topmost', True)
+        try:
+            overlay.attributes('-alpha', 0.3)
+        except tk.TclError:
+            logging.debug("System nie wspiera atrybutu -alpha dla nakładki zaznaczania.")
+        overlay.geometry(f"{self.master.winfo_screenwidth()}x{self.master.winfo_screenheight()}+0+0")
+        canvas = tk.Canvas(overlay, bg='black', cursor='crosshair', highlightthickness=0)
+        canvas.pack(fill=tk.BOTH, expand=True)
+        selection = {'start': None, 'rect': None}
+
+        def finish(region: Optional[Tuple[int, int, int, int]]) -> None:
+            try:
+                overlay.grab_release()
+                overlay.destroy()
+            except tk.TclError:
+                pass
+            if region:
+                self._capture_region = region
+                self._capture_area_var.set(CAPTURE_AREA_REGION)
+                logging.info(f"Zaznaczono obszar przechwytywania: {region}")
+            elif self._capture_region is None:
+                # Anulowano bez wcześniejszego zaznaczenia - wróć do całego ekranu
+                self._capture_area_var.set(CAPTURE_AREA_FULLSCREEN)
+
+        def on_press(event: tk.Event) -> None:
+            selection['start'] = (event.x_root, event.y_root)
+            selection['rect'] = canvas.create_rectangle(event.x, event.y, event.x, event.y, outline='red', width=2)
+
+        def on_motion(event: tk.Event) -> None:
+            if selection['start'] is None: return
+            start_x, start_y = selection['start']
+            canvas.coords(selection['rect'], start_x - overlay.winfo_rootx(), start_y - overlay.winfo_rooty(), event.x, event.y)
+
+        def on_release(event: tk.Event) -> None:
+            if selection['start'] is None: return
+            start_x, start_y = selection['start']
+            x, y = min(start_x, event.x_root), min(start_y, event.y_root)
+            w, h = abs(event.x_root - start_x), abs(event.y_root - start_y)
+            if w < CAPTURE_REGION_MIN_SIZE or h < CAPTURE_REGION_MIN_SIZE:
+                logging.info("Zaznaczony obszar jest zbyt mały - anulowano.")
+                finish(None)
+            else:
+                finish((x, y, w, h))
+
+        canvas.bind("<Button-1>", on_press)
+        canvas.bind("<B1-Motion>", on_motion)
+        canvas.bind("<ButtonRelease-1>", on_release)
+        overlay.bind("<Escape>", lambda e: finish(None))
+        overlay.focus_force()
+        try:
+            overlay.grab_set()
+        except tk.TclError:
+            pass # Okno może nie być jeszcze widoczne - zaznaczanie działa i bez grab
+
+    def _get_capture_region(self) -> Optional[Tuple[int, int, int, int]]:
+        """Zwraca obszar przechwytywania (x, y, szer, wys) wg wybranego trybu albo None dla całego ekranu.
+
+        Obszar jest przesuwany tak, by mieścił się na ekranie (rozmiar się nie zmienia, np. przy
+        widgecie przy krawędzi), a wymiary są parzyste - wymagają tego niektóre kodeki wideo.
+        Wołana także z wątków przechwytywania - czyta tylko zwykłe atrybuty, nie zmienne Tk.
+        """
+        area = self._capture_area
+        if area == CAPTURE_AREA_WIDGET and self._widget_geometry is not None:
+            x, y, w, h = self._widget_geometry
+            margin = CAPTURE_WIDGET_AREA_MARGIN
+            region = (x - margin, y - margin, w + 2 * margin, h + 2 * margin)
+        elif area == CAPTURE_AREA_REGION and self._capture_region is not None:
+            region = self._capture_region
+        else:
+            return None
+
+        try:
+            screen_w, screen_h = self._screen_grabber.size()
+        except Exception as e:
+            logging.warning(f"Błąd pobierania rozmiaru ekranu dla obszaru przechwytywania: {e}. Używam całego ekranu.")
+            return None
+        x, y, w, h = region
+        w, h = min(int(w), screen_w) & ~1, min(int(h), screen_h) & ~1
+        x, y = min(max(0, int(x)), screen_w - w), min(max(0, int(y)), screen_h - h)
+        if w < 2 or h < 2 or (w, h) == (screen_w & ~1, screen_h & ~1) and (x, y) == (0, 0):
+            return None # Obszar pusty albo obejmujący cały ekran
+        return x, y, w, h
+
     def _toggle_shadow(self) -> None:
         """Włącza lub wyłącza wyświetlanie cienia pod tekstem."""
         if not self.master.winfo_exists(): return
         show = self._show_shadow_var.get()
         try:
-            if self.label_shadow and self.label_shadow.winfo_exists():
+            if self._shadow_text_state is not None:
                 if show:
                     # Pokaż cień z aktualnym kolorem cienia
-                    self.label_shadow.config(fg=self._current_shadow_color) # Użyj aktualnego koloru
-                    self.label_shadow.place(x=SHADOW_OFFSET_X, y=SHADOW_OFFSET_Y)
+                    self._shadow_text_state.apply(fg=self._current_shadow_color) # Użyj aktualnego koloru
+                    self._shadow_text_state.place(*self._shadow_position)
                 else:
                     # Ukryj cień
-                    self.label_shadow.place_forget()
+                    self._shadow_text_state.forget()
             # Odśwież widget, wymuszając przeliczenie rozmiaru, bo cień wpływa na wymiary
             self.master.after_idle(lambda: self._update_display(force_resize=True))
         except tk.TclError:
@@ -664,6 +3010,15 @@ class TimechainWidget:
                 watermark_submenu.add_radiobutton(label=(labels[0] if self.lang == 'pl' else labels[1]),
                                                   variable=self._watermark_mode_var, value=value,
                                                   command=lambda v=value: self._set_watermark_style(v))
+            # Obszar przechwytywania
+            capture_menu.add_separator()
+            capture_menu.add_radiobutton(label=('Cały Ekran' if self.lang == 'pl' else 'Full Screen'),
+                                         variable=self._capture_area_var, value=CAPTURE_AREA_FULLSCREEN)
+            capture_menu.add_radiobutton(label=('Okolica Widgetu' if self.lang == 'pl' else 'Around Widget'),
+                                         variable=self._capture_area_var, value=CAPTURE_AREA_WIDGET)
+            capture_menu.add_radiobutton(label=('Zaznacz Obszar...' if self.lang == 'pl' else 'Select Region...'),
+                                         variable=self._capture_area_var, value=CAPTURE_AREA_REGION,
+                                         command=self._select_capture_region)
             popup.add_separator()
 
             # --- Czasy Nagrywania ---
@@ -676,6 +3031,16 @@ class TimechainWidget:
                                       command=lambda: self._configure_duration('gif'))
             popup.add_separator()
 
+            # --- Natychmiastowa Powtórka ---
+            replay_menu = Menu(popup, tearoff=0)
+            popup.add_cascade(label=('Natychmiastowa Powtórka' if self.lang == 'pl' else 'Instant Replay'), menu=replay_menu)
+            replay_menu.add_checkbutton(label=(f'Buforuj Ostatnie {REPLAY_BUFFER_SECONDS}s' if self.lang == 'pl' else f'Buffer Last {REPLAY_BUFFER_SECONDS}s'),
+                                        variable=self._replay_enabled_var, command=self._toggle_replay_buffer)
+            replay_menu.add_command(label=('Zapisz Powtórkę (F8)' if self.lang == 'pl' else 'Save Replay (F8)'),
+                                    command=self._start_replay_save_thread,
+                                    state=(tk.NORMAL if self._replay_buffer is not None else tk.DISABLED))
+            popup.add_separator()
+
             # --- Zamknij ---
             popup.add_command(label=('Zamknij Widget' if self.lang == 'pl' else 'Close Widget'), command=self._close_widget)
 
@@ -727,14 +3092,16 @@ class TimechainWidget:
         logging.info("Inicjowanie zamknięcia widgetu...")
         self._cancel_update = True # Ustaw flagę anulowania
 
-        # Anuluj zaplanowany timer aktualizacji
-        if self._update_timer:
-            try:
-                self.master.after_cancel(self._update_timer)
-                logging.debug("Anulowano timer aktualizacji.")
-            except Exception as e:
-                 logging.warning(f"Błąd podczas anulowania timera: {e}")
-            self._update_timer = None
+        # Anuluj zaplanowane timery (zegar, odświeżanie danych, sprawdzanie koloru)
+        for timer_attr in ('_update_timer', '_data_timer', '_color_check_timer'):
+            timer = getattr(self, timer_attr)
+            if timer:
+                try:
+                    self.master.after_cancel(timer)
+                    logging.debug(f"Anulowano timer {timer_attr}.")
+                except Exception as e:
+                     logging.warning(f"Błąd podczas anulowania timera: {e}")
+                setattr(self, timer_attr, None)
 
         # Zatrzymaj nasłuchiwanie klawiszy (jeśli działa)
         if HAVE_PYNPUT and self._key_listener_thread and self._key_listener_thread.is_alive():
@@ -742,6 +3109,15 @@ class TimechainWidget:
             self._key_listener_stop_event.set()
             # Nie czekaj tutaj na join, zrobimy to na końcu aplikacji
 
+        # Zatrzymaj wątki pobierające dane i źródło powiadomień push
+        self._fetch_scheduler.stop()
+        if self._tip_push_provider is not None:
+            self._tip_push_provider.stop()
+
+        # Zatrzymaj bufor powtórki (jeśli działa)
+        if self._replay_thread and self._replay_thread.is_alive():
+            self._stop_replay_recorder()
+
         # Zatrzymaj aktywny wątek przechwytywania (jeśli istnieje)
         # Wątki przechwytywania powinny same sprawdzać _cancel_update lub _key_listener_stop_event
         if self._active_capture_thread and self._active_capture_thread.is_alive():
@@ -770,17 +3146,11 @@ class TimechainWidget:
         except Exception as e:
              logging.error(f"Nieoczekiwany błąd podczas niszczenia okna: {e}", exc_info=True)
 
-    def _initial_data_fetch_and_show(self) -> None:
-        """Pobiera początkowe dane i następnie pokazuje widget."""
-        logging.debug("Rozpoczęcie początkowego pobierania danych.")
-        self._fetch_and_update_data() # Pobierz dane pierwszy raz
-        if not self._cancel_update and self.master.winfo_exists():
-            # Użyj after(0, ...) aby wykonać operacje UI w głównym wątku
-            logging.debug("Planowanie pokazania widgetu i rozpoczęcia aktualizacji.")
-            self.master.after(0, self._show_and_start_updates)
-        elif self._cancel_update:
-            logging.info("Anulowano przed pokazaniem widgetu.")
-
+    def _start_initial_fetch(self) -> None:
+        """Zleca pierwsze pobranie danych (wątek Tkinter); wyniki obudzą widok same."""
+        # Przy starcie akceptujemy dane z cache młodsze niż CACHE_TIME_SECONDS
+        for key in self._fetch_scheduler.request_all(max_age=CACHE_TIME_SECONDS):
+            self._poll_policy.mark_requested(key)
 
     def _show_and_start_updates(self) -> None:
         """Pokazuje widget i rozpoczyna cykliczne aktualizacje."""
@@ -789,29 +3159,33 @@ class TimechainWidget:
             return
 
         try:
-            # Upewnij się, że widget jest gotowy do pokazania
-            self.master.update_idletasks()
-
-            # Zastosuj aktualne kolory przed pokazaniem
-            if self.label_main: self.label_main.config(fg=self._current_text_color)
-            if self.label_shadow and self._show_shadow_var.get(): self.label_shadow.config(fg=self._current_shadow_color)
-
-            # Zaktualizuj tekst i rozmiar
+            # Odbierz dane pobrane przy starcie i zaktualizuj tekst, kolory i rozmiar
+            self._apply_fetch_results()
+            self._refresh_clock_strings(time.time())
             self._update_display(force_resize=True)
 
             # Pokaż okno
             self.master.deiconify() # Pokaż okno (jeśli było ukryte przez withdraw())
             self.master.lift() # Podnieś okno na wierzch
             self.master.attributes('-topmost', True) # Upewnij się, że jest na wierzchu
+            if not self._first_paint_done:
+                self._first_paint_done = True
+                self.master.update_idletasks() # Narysuj okno przed pomiarem
+                self._startup_timer.mark("first_paint")
+                logging.info(f"Czas do pierwszego wyświetlenia: {self._startup_timer.summary()}")
+                # Skanowanie katalogów czcionek (znak wodny) poza ścieżką pierwszego wyświetlenia
+                threading.Thread(target=self._warm_up_font_lookup, name="FontIndexWarmup", daemon=True).start()
 
             logging.info("Widget pokazany. Rozpoczynanie cyklicznych aktualizacji.")
 
-            # Sprawdź kolor tła po krótkiej chwili (daj czas na rendering)
+            # Sprawdź kolor tła po krótkiej chwili (daj czas na rendering), potem okresowo
             if ENABLE_AUTO_COLOR_INVERSION:
                 self.master.after(300, self._check_and_update_widget_color)
+                self._color_check_timer = self.master.after(AUTO_COLOR_CHECK_INTERVAL_MS, self._periodic_color_check)
 
-            # Rozpocznij cykl aktualizacji
+            # Rozpocznij tick zegara i (niezależnie) harmonogram odświeżania danych
             self._schedule_next_update()
+            self._schedule_data_refresh()
 
         except tk.TclError as e:
             logging.error(f"Błąd TclError podczas pokazywania widgetu: {e}")
@@ -821,102 +3195,181 @@ class TimechainWidget:
              if not self._cancel_update: self._close_widget()
 
 
-    def _fetch_and_update_data(self) -> None:
-        """Pobiera dane z API i aktualizuje wewnętrzne zmienne stanu."""
-        if self._cancel_update: return
-
-        logging.debug("Rozpoczęcie pobierania danych z API.")
-        self._last_error = None # Resetuj ostatni błąd
-        results = {'beat': None, 'height': None, 'hash_short': None, 'hash_full': None}
-        fetch_errors = [] # Lista błędów z tego cyklu
-
-        # Funkcja pomocnicza do bezpiecznego pobierania danych w wątku
-        def fetch_api_data_safe(url: str, key: str, process_func) -> None:
-            if self._cancel_update: return
+    def _apply_fetch_results(self) -> bool:
+        """Przetwarza wyniki z kolejki harmonogramu pobierania (w wątku Tkinter). Zwraca True, jeśli były nowe dane."""
+        changed = False
+        while True:
             try:
-                data = self._get_api_data(url) # Używa cache i timeout
-                if data and "Error" not in data: # Podstawowa walidacja
-                    processed_data = process_func(data)
-                    results[key] = processed_data
-                    # Jeśli przetwarzanie zwróci błąd, dodaj go do listy
-                    if isinstance(processed_data, str) and "Error" in processed_data:
-                         fetch_errors.append(f"{key}: Processing failed ({processed_data})")
-                elif data and "Error" in data:
-                    results[key] = data # Zapisz błąd pobierania
-                    fetch_errors.append(f"{key}: Fetch failed ({data})")
+                key, data, ok, elapsed = self._fetch_scheduler.results.get_nowait()
+            except queue.Empty:
+                break
+            changed = True
+            logging.debug(f"Wynik pobierania {key} po {elapsed:.2f}s (ok: {ok}): {data!r:.80}")
+
+            if key == 'tip':
+                # Węzeł zwraca "wysokość hash [czas bloku]" z jednego zapytania - spójna para
+                parts = data.split() if data and "Error" not in data else []
+                if len(parts) >= 2:
+                    self._tip_block_time = int(parts[2]) if len(parts) >= 3 and parts[2].isdigit() else None
+                    self._apply_fetch_result('height', parts[0], ok)
+                    self._apply_fetch_result('hash', parts[1], ok)
                 else:
-                    # Puste dane lub inny problem
-                    results[key] = "Error: No data"
-                    fetch_errors.append(f"{key}: No data received")
-
-            except Exception as e:
-                error_msg = f"Error: {e.__class__.__name__}"
-                results[key] = error_msg
-                fetch_errors.append(f"{key}: Exception - {e}")
-                logging.warning(f"Wyjątek podczas pobierania danych dla {key} ({url}): {e}")
-
-        # Definicje funkcji przetwarzających dane
-        def process_beat_time(_: Optional[str]) -> str: # Argument ignorowany
-            return self._get_swatch_internet_time()
+                    self._apply_fetch_result('height', data, False)
+                    self._apply_fetch_result('hash', data, False)
+            else:
+                self._apply_fetch_result(key, data, ok)
+
+        if changed:
+            # Zapisz skonsolidowany błąd, jeśli wystąpiły problemy
+            self._last_error = "; ".join(self._fetch_errors.values()) or None
+            if self._last_error:
+                logging.warning(f"Błędy podczas pobierania danych: {self._last_error}")
+            self._record_tip_in_index()
+        return changed
+
+    def _record_tip_in_index(self) -> None:
+        """Dopisuje aktualny tip do indeksu bloków - tylko parę wysokość/hash z jednego spójnego źródła.
+
+        Para z węzła (jedno zapytanie wsadowe) jest zapisywana od razu. Wysokość i hash od
+        publicznych dostawców pochodzą z osobnych żądań, więc przed zapisem są sprawdzane
+        w wątku w tle hashem bloku na tej wysokości u jednego dostawcy.
+        """
+        if self._header_index is None or not self._poll_policy.tip_settled:
+            return # Po zmianie wysokości hash może jeszcze należeć do poprzedniego bloku
+        height, block_hash = self._block_height_str, self._full_block_hash_str
+        if not height.isdigit() or not (isinstance(block_hash, str) and len(block_hash) == 64):
+            return
+        if (height, block_hash) == self._last_indexed_tip:
+            return
+        if self._node_rpc is not None:
+            self._last_indexed_tip = (height, block_hash)
+            self._write_tip_to_index(int(height), block_hash, self._tip_block_time)
+            return
+        if self._tip_verification_active:
+            return # Następna zmiana tipu zostanie sprawdzona po zakończeniu bieżącej weryfikacji
+        self._last_indexed_tip = (height, block_hash)
+        self._tip_verification_active = True
+        threading.Thread(target=self._verify_and_record_tip, args=(int(height), block_hash),
+                         name="BlockIndexVerify", daemon=True).start()
+
+    def _verify_and_record_tip(self, height: int, block_hash: str) -> None:
+        """Wątek w tle: zapisuje parę do indeksu, jeśli dostawca potwierdzi hash bloku na tej wysokości."""
+        try:
+            for url_template in BLOCK_HASH_AT_HEIGHT_URLS:
+                url = url_template.format(height=height)
+                try:
+                    confirmed_hash = self._http_client.get_text(url).lower()
+                except requests.exceptions.RequestException as e:
+                    logging.debug(f"Weryfikacja bloku {height} u {url} nieudana: {e}")
+                    continue
+                if confirmed_hash == block_hash.lower():
+                    self._write_tip_to_index(height, block_hash, None)
+                else:
+                    logging.warning(f"Niespójna para wysokość/hash ({height}, ...{block_hash[-8:]}) - "
+                                    f"{url} podaje ...{confirmed_hash[-8:]}. Pomijam zapis do indeksu bloków.")
+                return
+            logging.info(f"Nie udało się zweryfikować bloku {height} - nie zapisano go w indeksie bloków.")
+        finally:
+            self._tip_verification_active = False
 
-        def process_height(data: Optional[str]) -> str:
+    def _write_tip_to_index(self, height: int, block_hash: str, block_time: Optional[int]) -> None:
+        """Zapisuje zweryfikowaną parę (indeks ma własną blokadę - wołane z wątku Tk lub weryfikacji)."""
+        if self._cancel_update: return # Indeks jest zamykany razem z widgetem
+        try:
+            if self._header_index.record(height, block_hash, block_time, verified=True):
+                logging.debug(f"Zapisano blok {height} w indeksie bloków.")
+        except Exception as e:
+            logging.warning(f"Błąd zapisu do indeksu bloków: {e}")
+
+    def _apply_fetch_result(self, key: str, data: Optional[str], ok: bool) -> None:
+        """Waliduje pojedynczy wynik ('height' lub 'hash'), aktualizuje stan widgetu i politykę odpytywania."""
+        valid = False
+        if not data or "Error" in data:
+            # Błąd pobierania (bez danych w cache jako fallback)
+            error = data or "Error: No data"
+            if key == 'height':
+                self._block_height_str = error
+            else:
+                self._block_hash_short_str = error
+                self._full_block_hash_str = None
+            self._fetch_errors[key] = f"{key}: Fetch failed ({error})" if data else f"{key}: No data received"
+        elif key == 'height':
             # Prosta walidacja - czy jest liczbą
-            if isinstance(data, str) and data.isdigit():
-                return data
+            if data.isdigit():
+                self._block_height_str = data
+                self._fetch_errors.pop(key, None)
+                valid = True
             else:
                 logging.warning(f"Otrzymano nieprawidłową wysokość bloku: {data}")
-                return "Error: Invalid Height"
-
-        def process_hash(data: Optional[str]) -> str:
-             # Walidacja hasha (64 znaki hex)
-             if isinstance(data, str) and len(data) == 64 and all(c in '0123456789abcdefABCDEF' for c in data.lower()):
-                 results['hash_full'] = data # Zapisz pełny hash
-                 return f"{data[:6]}...{data[-4:]}" # Zwróć skróconą wersję
-             else:
-                 logging.warning(f"Otrzymano nieprawidłowy hash bloku: {data}")
-                 results['hash_full'] = f"Error: Invalid Hash ({data[:20]}...)" if data else "Error: Invalid Hash (None)"
-                 return "Error: Invalid Hash"
-
-        # Tworzenie i uruchamianie wątków pobierających
-        threads = [
-            threading.Thread(target=lambda: results.__setitem__('beat', process_beat_time(None)), daemon=True, name="FetchBeatTime"),
-            threading.Thread(target=fetch_api_data_safe, args=(BLOCK_HEIGHT_URL, 'height', process_height), daemon=True, name="FetchBlockHeight"),
-            threading.Thread(target=fetch_api_data_safe, args=(BLOCK_HASH_URL, 'hash_short', process_hash), daemon=True, name="FetchBlockHash")
-        ]
-
-        for t in threads: t.start()
-        # Czekaj na zakończenie wątków z timeoutem
-        join_timeout = API_TIMEOUT_SECONDS + 2 # Daj trochę więcej czasu niż timeout API
-        for t in threads: t.join(timeout=join_timeout)
-
-        # Sprawdź, czy któryś wątek nadal działa (timeout)
-        active_threads = [t.name for t in threads if t.is_alive()]
-        if active_threads:
-            error_msg = f"Timeout waiting for threads: {', '.join(active_threads)}"
-            fetch_errors.append(error_msg)
-            logging.warning(error_msg)
-
-        # Zakończ, jeśli widget został anulowany w międzyczasie
-        if self._cancel_update:
-            logging.debug("Pobieranie danych przerwane (anulowano).")
-            return
+                self._block_height_str = "Error: Invalid Height"
+                self._fetch_errors[key] = f"{key}: Processing failed (Error: Invalid Height)"
+        elif key == 'hash':
+            # Walidacja hasha (64 znaki hex)
+            if len(data) == 64 and all(c in '0123456789abcdef' for c in data.lower()):
+                self._full_block_hash_str = data
+                self._block_hash_short_str = f"{data[:6]}...{data[-4:]}"
+                self._fetch_errors.pop(key, None)
+                valid = True
+            else:
+                logging.warning(f"Otrzymano nieprawidłowy hash bloku: {data}")
+                self._full_block_hash_str = f"Error: Invalid Hash ({data[:20]}...)"
+                self._block_hash_short_str = "Error: Invalid Hash"
+                self._fetch_errors[key] = f"{key}: Processing failed (Error: Invalid Hash)"
+
+        if valid:
+            # Świeża wartość zdejmuje znacznik ostatniego znanego stanu; zastępcza z cache go nakłada
+            if ok: self._stale_fields.discard(key)
+            else: self._stale_fields.add(key)
+        # Dane zastępcze z cache (ok=False) wyświetlamy, ale dla harmonogramu to błąd (backoff)
+        self._poll_policy.on_result(key, data if ok and valid else None, time.monotonic())
+
+    def _on_tip_push(self, height: Optional[str], block_hash: Optional[str]) -> None:
+        """Callback źródła push (jego wątek): dane trafiają do kolejki wyników, wątek Tkinter jest budzony od razu."""
+        if self._cancel_update: return
+        # Wysokość przed hashem - polityka odpytywania nie zleci wtedy zbędnego pobrania hasha
+        if height is not None:
+            self._fetch_scheduler.results.put(('height', height, True, 0.0))
+            self._api_cache.put(BLOCK_HEIGHT_URL, height, provider=TIP_PUSH_SOURCE)
+        if block_hash is not None:
+            self._fetch_scheduler.results.put(('hash', block_hash, True, 0.0))
+            self._api_cache.put(BLOCK_HASH_URL, block_hash, provider=TIP_PUSH_SOURCE)
+        self._wake_for_fetch_results()
+
+    def _wake_for_fetch_results(self) -> None:
+        """Budzi wątek Tkinter, żeby przetworzył nowe wyniki (wołane z wątków pobierania i push)."""
+        if self._cancel_update or self._fetch_wakeup_pending:
+            return # Odświeżenie już zaplanowane - przetworzy wszystkie wyniki z kolejki
+        self._fetch_wakeup_pending = True
+        try:
+            self.master.after(0, self._refresh_from_fetch_results)
+        except RuntimeError:
+            pass # Pętla Tkinter już nie działa
 
-        # Aktualizuj zmienne stanu widgetu wynikami
-        # Używaj .get() z domyślną wartością na wypadek, gdyby klucz nie istniał
-        self._beat_time_str = results.get('beat') or "@ErrorBeat"
-        self._block_height_str = results.get('height') or "ErrorHeight"
-        self._block_hash_short_str = results.get('hash_short') or "ErrorHashShort"
-        # _full_block_hash_str jest ustawiany w process_hash, ale upewnijmy się, że ma jakąś wartość
-        self._full_block_hash_str = results.get('hash_full') # Może być None lub "Error: ..."
+    def _on_tip_push_state(self, connected: bool) -> None:
+        """Callback źródła push (jego wątek): przełącza politykę odpytywania w wątku Tkinter."""
+        if self._cancel_update: return
+        try:
+            self.master.after(0, lambda: self._set_push_active(connected))
+        except RuntimeError:
+            pass
 
-        # Zapisz skonsolidowany błąd, jeśli wystąpiły problemy
-        if fetch_errors:
-            self._last_error = "; ".join(fetch_errors)
-            logging.warning(f"Błędy podczas pobierania danych: {self._last_error}")
+    def _set_push_active(self, connected: bool) -> None:
+        """Przełącza politykę odpytywania w tryb push i przelicza termin odświeżenia danych (wątek Tkinter)."""
+        if self._cancel_update: return
+        self._poll_policy.set_push_active(connected, time.monotonic())
+        self._schedule_data_refresh()
 
-        # Zgłoś potrzebę aktualizacji UI (zrobione w _perform_update_cycle)
-        logging.debug("Zakończono pobieranie danych.")
-        # Aktualizacja UI jest wywoływana po powrocie z wątku w _perform_update_cycle
+    def _refresh_from_fetch_results(self) -> None:
+        """Przetwarza oczekujące wyniki i odświeża widok od razu, bez czekania na tick zegara."""
+        self._fetch_wakeup_pending = False
+        if self._cancel_update or not self.master.winfo_exists(): return
+        if self._apply_fetch_results():
+            if not self._first_data_logged:
+                self._first_data_logged = True
+                logging.info(f"Pierwsze dane z API po {self._startup_timer.elapsed() * 1000:.0f} ms od startu.")
+            self._update_display(force_resize=True) # Szerokość tekstu mogła się zmienić (np. "..." -> hash)
+        # Wynik zmienił terminy polityki odpytywania (następne odpytanie, ponowienie hasha, backoff)
+        self._schedule_data_refresh()
 
     def _format_display_text(self) -> str:
         """Formatuje tekst do wyświetlenia w widgecie."""
@@ -931,6 +3384,11 @@ class TimechainWidget:
              display_hash = self._block_hash_short_str
         else:
             display_hash = ('Błąd Hasha' if self.lang == 'pl' else 'Hash Err')
+        # "~" = ostatnia znana wartość (np. z poprzedniego uruchomienia), jeszcze niepotwierdzona
+        if 'height' in self._stale_fields and "Error" not in self._block_height_str:
+            height_str = f"~{height_str}"
+        if 'hash' in self._stale_fields and "Error" not in str(self._block_hash_short_str):
+            display_hash = f"~{display_hash}"
 
         # Formatowanie monitu
         prompt_part = f"{self.prompt}@" if self.prompt.endswith('@') else f"{self.prompt} @"
@@ -950,75 +3408,53 @@ class TimechainWidget:
 
         return "\n".join(text_lines)
 
-    def _update_display(self, force_resize: bool = False) -> None:
-        """Aktualizuje tekst i potencjalnie rozmiar widgetu."""
+    def _update_display(self, force_resize: bool = False, position: Optional[Tuple[int, int]] = None) -> None:
+        """Aktualizuje tekst i rozmiar widgetu, wywołując Tk tylko dla rzeczywistych zmian.
+
+        `position` (przeciąganie) przesuwa okno w tym samym wywołaniu geometrii co zmiana rozmiaru.
+        """
         if self._cancel_update or not self.master.winfo_exists(): return
-        # Sprawdź, czy etykiety istnieją (na wszelki wypadek)
-        if not self.label_main or not self.label_main.winfo_exists():
-            logging.warning("Próba aktualizacji nieistniejącej etykiety głównej.")
+        # Sprawdź, czy tekst został utworzony (na wszelki wypadek)
+        if self._main_text_state is None:
+            logging.warning("Próba aktualizacji przed utworzeniem tekstu widgetu.")
             return
 
         try:
-            # Zaktualizuj czas lokalny
-            self._current_time_str = time.strftime('%H:%M:%S')
-            # Pobierz sformatowany tekst
+            # Pobierz sformatowany tekst (czas i @beats ustawia tick zegara)
             display_text = self._format_display_text()
-
-            # Ustaw tekst i czcionkę dla głównej etykiety
-            self.label_main.config(text=display_text, font=self._current_font_options, fg=self._current_text_color)
-
-            # Ustaw tekst i czcionkę dla cienia (jeśli istnieje i jest włączony)
-            if self.label_shadow and self.label_shadow.winfo_exists():
-                if self._show_shadow_var.get():
-                    self.label_shadow.config(text=display_text, font=self._current_font_options, fg=self._current_shadow_color)
-                    # Upewnij się, że cień jest na miejscu
-                    if not self.label_shadow.winfo_ismapped():
-                        self.label_shadow.place(x=SHADOW_OFFSET_X, y=SHADOW_OFFSET_Y)
-                elif self.label_shadow.winfo_ismapped(): # Ukryj, jeśli nie powinien być widoczny
-                    self.label_shadow.place_forget()
-
-            # Dostosuj rozmiar okna, jeśli tekst się zmienił lub wymuszono resize
-            if force_resize:
-                # update_idletasks() jest potrzebne, aby .winfo_reqwidth/height() zwróciły aktualne wartości
-                self.master.update_idletasks()
-
-                # Pobierz wymagany rozmiar głównej etykiety
-                main_width = self.label_main.winfo_reqwidth()
-                main_height = self.label_main.winfo_reqheight()
-
-                # Uwzględnij przesunięcie cienia (jeśli jest widoczny) w wymaganym rozmiarze okna
-                shadow_x_margin = abs(SHADOW_OFFSET_X) if self._show_shadow_var.get() and self.label_shadow and self.label_shadow.winfo_ismapped() else 0
-                shadow_y_margin = abs(SHADOW_OFFSET_Y) if self._show_shadow_var.get() and self.label_shadow and self.label_shadow.winfo_ismapped() else 0
-
-                req_width = main_width + shadow_x_margin
-                req_height = main_height + shadow_y_margin
-
-                # Ustaw nową geometrię tylko jeśli wymiary są poprawne
-                if req_width > 0 and req_height > 0:
-                    current_x = self.master.winfo_x()
-                    current_y = self.master.winfo_y()
-
-                    # Prosta ochrona przed ustawieniem okna poza ekranem (np. po zmianie rozdzielczości)
-                    # To nie jest pełne rozwiązanie, ale zapobiega "zniknięciu" okna
-                    screen_width = self.master.winfo_screenwidth()
-                    screen_height = self.master.winfo_screenheight()
-                    if current_x + req_width < 50: # Jeśli prawy brzeg jest blisko lewej krawędzi ekranu
-                         current_x = 50
-                    if current_y + req_height < 50: # Jeśli dolny brzeg jest blisko górnej krawędzi ekranu
-                         current_y = 50
-                    if current_x > screen_width - 50: # Jeśli lewy brzeg jest blisko prawej krawędzi
-                         current_x = screen_width - req_width - 50
-                    if current_y > screen_height - 50: # Jeśli górny brzeg jest blisko dolnej krawędzi
-                         current_y = screen_height - req_height - 50
-
-                    # Zabezpieczenie przed ujemnymi koordynatami, które mogą powodować problemy
-                    current_x = max(0, current_x)
-                    current_y = max(0, current_y)
-
-
-                    self.master.geometry(f"{req_width}x{req_height}+{current_x}+{current_y}")
+            font_options = self._current_font_options
+            font = self._get_tk_font(font_options)[0] # Ta sama czcionka Tk dla etykiet/Canvas i pomiaru
+
+            # Ustaw tekst, czcionkę i kolor - model renderowania pomija niezmienione opcje
+            text_changed = self._main_text_state.apply(text=display_text, font=font)
+            self._main_text_state.apply(fg=self._current_text_color)
+            show_shadow = self._show_shadow_var.get() and self._shadow_text_state is not None
+            if show_shadow:
+                self._shadow_text_state.apply(text=display_text, font=font, fg=self._current_shadow_color)
+                self._shadow_text_state.place(*self._shadow_position)
+            elif self._shadow_text_state is not None:
+                self._shadow_text_state.forget()
+
+            # Rozmiar okna z metryk czcionki (bez update_idletasks); geometria tylko przy zmianie wymiarów
+            new_size = None
+            if text_changed or force_resize:
+                text_width, text_height = self._measure_text(display_text, font_options)
+                req_width = text_width + self._text_padding[0] + (abs(SHADOW_OFFSET_X) if show_shadow else 0)
+                req_height = text_height + self._text_padding[1] + (abs(SHADOW_OFFSET_Y) if show_shadow else 0)
+                if (req_width, req_height) != self._applied_window_size or force_resize:
+                    new_size = (req_width, req_height)
+            if position is not None:
+                if new_size is not None:
+                    self.master.geometry(f"{new_size[0]}x{new_size[1]}+{position[0]}+{position[1]}")
+                    self._applied_window_size = new_size
                 else:
-                    logging.warning(f"Obliczono nieprawidłowy rozmiar widgetu: {req_width}x{req_height}")
+                    self.master.geometry(f"+{position[0]}+{position[1]}")
+            elif new_size is not None and self._is_dragging:
+                # Położenie należy do klatek przeciągania - zmień tylko rozmiar
+                self.master.geometry(f"{new_size[0]}x{new_size[1]}")
+                self._applied_window_size = new_size
+            elif new_size is not None:
+                self._apply_window_size(*new_size)
 
         except tk.TclError as e:
             # Obsługa błędu, który może wystąpić, jeśli okno zostanie zamknięte podczas aktualizacji
@@ -1027,71 +3463,173 @@ class TimechainWidget:
         except Exception as e:
              logging.error(f"Nieoczekiwany błąd podczas aktualizacji wyświetlania: {e}", exc_info=True)
 
+    def _get_tk_font(self, font_options: Tuple[Any, ...]) -> Tuple[tkfont.Font, int]:
+        """Zwraca obiekt czcionki Tk i wysokość linii dla (rodzina, rozmiar, grubość) - tworzone raz."""
+        cached = self._tk_fonts.get(font_options)
+        if cached is None:
+            family, size, weight = font_options
+            font = tkfont.Font(root=self.master, family=family, size=size, weight=weight)
+            cached = self._tk_fonts[font_options] = (font, font.metrics('linespace'))
+        return cached
+
+    def _measure_text(self, text: str, font_options: Tuple[Any, ...]) -> Tuple[int, int]:
+        """Szerokość i wysokość wielolinijkowego tekstu w pikselach (szerokości linii z cache)."""
+        font, linespace = self._get_tk_font(font_options)
+        lines = text.split("\n")
+        width = 0
+        for line in lines:
+            key = (font_options, line)
+            line_width = self._text_width_cache.get(key)
+            if line_width is None:
+                line_width = font.measure(line)
+                self._text_width_cache[key] = line_width
+                if len(self._text_width_cache) > TEXT_MEASURE_CACHE_SIZE:
+                    self._text_width_cache.popitem(last=False) # Usuń najdawniej użytą (np. minioną linię czasu)
+            else:
+                # LRU: stałe linie (monit, hash) trafiane co sekundę nie są wypychane przez zmienną linię czasu
+                self._text_width_cache.move_to_end(key)
+            width = max(width, line_width)
+        return width, linespace * len(lines)
+
+    def _apply_window_size(self, req_width: int, req_height: int) -> None:
+        """Ustawia rozmiar okna, pilnując, by nie wyszło poza ekran."""
+        # Ustaw nową geometrię tylko jeśli wymiary są poprawne
+        if req_width <= 0 or req_height <= 0:
+            logging.warning(f"Obliczono nieprawidłowy rozmiar widgetu: {req_width}x{req_height}")
+            return
+        current_x = self.master.winfo_x()
+        current_y = self.master.winfo_y()
+
+        # Prosta ochrona przed ustawieniem okna poza ekranem (np. po zmianie rozdzielczości)
+        # To nie jest pełne rozwiązanie, ale zapobiega "zniknięciu" okna
+        screen_width = self.master.winfo_screenwidth()
+        screen_height = self.master.winfo_screenheight()
+        if current_x + req_width < 50: # Jeśli prawy brzeg jest blisko lewej krawędzi ekranu
+             current_x = 50
+        if current_y + req_height < 50: # Jeśli dolny brzeg jest blisko górnej krawędzi ekranu
+             current_y = 50
+        if current_x > screen_width - 50: # Jeśli lewy brzeg jest blisko prawej krawędzi
+             current_x = screen_width - req_width - 50
+        if current_y > screen_height - 50: # Jeśli górny brzeg jest blisko dolnej krawędzi
+             current_y = screen_height - req_height - 50
+
+        # Zabezpieczenie przed ujemnymi koordynatami, które mogą powodować problemy
+        current_x = max(0, current_x)
+        current_y = max(0, current_y)
+
+        self.master.geometry(f"{req_width}x{req_height}+{current_x}+{current_y}")
+        self._applied_window_size = (req_width, req_height)
+
 
     def _schedule_next_update(self) -> None:
-        """Planuje następne wywołanie cyklu aktualizacji."""
+        """Planuje następny tick zegara tuż po najbliższej pełnej sekundzie (bez dryfu)."""
+        if self._cancel_update or not self.master.winfo_exists():
+            return
+        self._update_timer = self.master.after(self._clock_ticker.next_delay_ms(), self._on_clock_tick)
+
+    def _on_clock_tick(self) -> None:
+        """Tick zegara: czas lokalny i @beats (tanie, co sekundę). Dane odświeża osobny harmonogram."""
+        self._update_timer = None
+        if self._cancel_update or not self.master.winfo_exists():
+            return
+        now = self._clock_ticker.begin_tick()
+        if now is not None: # None - timer zadziałał przed granicą sekundy, wyświetlana sekunda jest aktualna
+            self._refresh_clock_strings(now)
+            # Rozmiar przeliczany tylko przy zmianie szerokości tekstu (model renderowania)
+            self._update_display(force_resize=False)
+        self._schedule_next_update()
+
+    def _refresh_clock_strings(self, now: float) -> None:
+        """Ustawia czas lokalny i @beats z jednego odczytu zegara."""
+        self._current_time_str = time.strftime('%H:%M:%S', time.localtime(now))
+        self._beat_time_str = self._get_swatch_internet_time(now)
+
+    def _schedule_data_refresh(self) -> None:
+        """Planuje odświeżenie danych na najbliższy termin z polityki odpytywania (bez budzenia co sekundę)."""
+        if self._cancel_update: return
+        if self._data_timer is not None:
+            try:
+                self.master.after_cancel(self._data_timer)
+            except tk.TclError:
+                pass
+            self._data_timer = None
+        delay = self._poll_policy.next_due_in(time.monotonic())
+        if delay == float('inf'):
+            return # Wszystko czeka na wyniki (lub działa push) - obudzi nas _refresh_from_fetch_results
+        self._data_timer = self.master.after(max(1, math.ceil(delay * 1000)), self._perform_data_refresh)
+
+    def _perform_data_refresh(self) -> None:
+        """Zleca pobranie endpointów, których termin minął (z pominięciem cache - o częstotliwości decyduje polityka)."""
+        self._data_timer = None
         if self._cancel_update or not self.master.winfo_exists():
             return
-        # Zaplanuj wywołanie _perform_update_cycle za 1000 ms (1 sekunda)
-        self._update_timer = self.master.after(1000, self._perform_update_cycle)
-
-    def _perform_update_cycle(self) -> None:
-        """Wykonuje jeden cykl aktualizacji: pobiera dane, aktualizuje UI."""
+        due_keys = self._poll_policy.due(time.monotonic())
+        if self._node_rpc is not None and due_keys:
+            due_keys = ['tip'] # Węzeł zwraca wysokość i hash jednym zapytaniem
+        for key in due_keys:
+            self._fetch_scheduler.request(key, max_age=0.0)
+            # Także gdy żądanie już trwa (np. z pobrania startowego) - jego wynik przez on_result() ustawi nowy termin;
+            # bez tego termin zostałby w przeszłości i timer budziłby się co 1 ms
+            self._poll_policy.mark_requested(key)
+        self._schedule_data_refresh()
+
+    def _periodic_color_check(self) -> None:
+        """Okresowo sprawdza jasność tła (osobny timer, niezależny od ticku zegara)."""
+        self._color_check_timer = None
         if self._cancel_update or not self.master.winfo_exists():
             return
-
-        # Uruchom pobieranie danych w osobnym wątku, aby nie blokować UI
-        threading.Thread(target=self._fetch_and_update_data, name="DataFetchWorker", daemon=True).start()
-
-        # Zaktualizuj wyświetlanie (czas lokalny i potencjalnie stare dane, dopóki nowe nie przyjdą)
-        # force_resize=False, bo zwykle tylko czas się zmienia co sekundę
-        self._update_display(force_resize=False)
-
-        # Sprawdzaj kolor tła co jakiś czas (np. co 10 sekund), a nie co sekundę
-        if not hasattr(self, '_color_check_counter'): self._color_check_counter = 0
-        self._color_check_counter = (self._color_check_counter + 1) % 10 # Licznik modulo 10
-        if self._color_check_counter == 0 and ENABLE_AUTO_COLOR_INVERSION:
-            # Sprawdź kolor w głównym wątku
-            self.master.after(10, self._check_and_update_widget_color) # Małe opóźnienie
-
-        # Zaplanuj następny cykl
-        self._schedule_next_update()
-
-    def _get_api_data(self, url: str) -> Optional[str]:
-        """Pobiera dane z URL, używając cache."""
-        cache_file = None
-        if self._cache_dir:
-            # Proste tworzenie klucza cache z URL
-            cache_key = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in url.replace("https://", "").replace("http://", "").replace("/", "_").replace(":", "_"))[:100]
-            cache_file = os.path.join(self._cache_dir, cache_key + ".cache")
-
-            # Sprawdź cache
-            if os.path.exists(cache_file):
-                try:
-                    cache_age = time.time() - os.path.getmtime(cache_file)
-                    if cache_age < CACHE_TIME_SECONDS:
-                        logging.debug(f"Używam danych z cache dla {url} (wiek: {cache_age:.1f}s)")
-                        with open(cache_file, 'r', encoding='utf-8') as f:
-                            return f.read().strip()
-                except Exception as e:
-                    logging.warning(f"Błąd odczytu cache {cache_file}: {e}")
+        self._check_and_update_widget_color()
+        self._color_check_timer = self.master.after(AUTO_COLOR_CHECK_INTERVAL_MS, self._periodic_color_check)
+
+    def _fetch_endpoint(self, url: str, max_age: float = CACHE_TIME_SECONDS) -> Tuple[Optional[str], bool]:
+        """Pobiera dane dla harmonogramu. Zwraca (dane, ok); przy błędzie dane mogą pochodzić z cache."""
+        data = self._get_api_data(url, max_age=max_age, stale_on_error=False)
+        if data and "Error" not in data:
+            return data, True
+        stale = self._api_cache.get_stale(url)
+        if stale is not None:
+            logging.warning(f"Zwracam przestarzałe dane z cache dla {url} z powodu błędu: {data}")
+            return stale, False
+        return data, False
+
+    def _fetch_node_tip(self, url: str, max_age: float = CACHE_TIME_SECONDS) -> Tuple[Optional[str], bool]:
+        """Pobiera tip z lokalnego węzła dla harmonogramu. Zwraca ("wysokość hash czas", ok)."""
+        cached = self._api_cache.get_fresh(url, max_age=max_age)
+        if cached is not None:
+            return cached, True
+        try:
+            height, block_hash, block_time = self._node_rpc.get_tip()
+            data = f"{height} {block_hash} {block_time or ''}".strip()
+            self._api_cache.put(url, data, provider=NODE_RPC_URL)
+            return data, True
+        except requests.exceptions.Timeout:
+            logging.warning(f"Timeout podczas zapytania do węzła {url}")
+            error_msg = "Error: Timeout"
+        except (requests.exceptions.RequestException, ValueError, RuntimeError) as e:
+            logging.warning(f"Błąd zapytania do węzła {url}: {e}")
+            error_msg = f"Error: Node RPC failed ({e.__class__.__name__})"
+        stale = self._api_cache.get_stale(url)
+        if stale is not None:
+            logging.warning(f"Zwracam przestarzałe dane węzła z cache z powodu błędu: {error_msg}")
+            return stale, False
+        return error_msg, False
+
+    def _get_api_data(self, url: str, max_age: float = CACHE_TIME_SECONDS, stale_on_error: bool = True) -> Optional[str]:
+        """Pobiera dane z URL, używając cache (pamięć z TTL, potem dysk)."""
+        cached = self._api_cache.get_fresh(url, max_age=max_age)
+        if cached is not None:
+            logging.debug(f"Używam danych z cache dla {url}")
+            return cached
 
         # Jeśli brak cache lub jest przestarzały, pobierz z sieci
         try:
             logging.debug(f"Pobieranie danych z API: {url}")
-            headers = {'User-Agent': f'TimechainWidget/{VERSION}'}
-            response = requests.get(url, timeout=API_TIMEOUT_SECONDS, headers=headers)
-            response.raise_for_status() # Rzuci wyjątkiem dla błędów HTTP (4xx, 5xx)
-            data = response.text.strip()
+            # Najszybszy dostępny dostawca pola (z żądaniem zabezpieczającym); połączenia z puli keep-alive
+            data, provider = self._providers.fetch_with_provider(url)
 
-            # Zapisz do cache, jeśli pobrano poprawnie i cache jest włączony
-            if cache_file and data:
-                try:
-                    with open(cache_file, 'w', encoding='utf-8') as f:
-                        f.write(data)
-                    logging.debug(f"Zapisano dane do cache: {cache_file}")
-                except Exception as e:
-                    logging.warning(f"Błąd zapisu do cache {cache_file}: {e}")
+            # Zapisz do cache, jeśli pobrano poprawnie (na dysk tylko przy zmianie wartości)
+            if data:
+                self._api_cache.put(url, data, provider=provider)
             return data
 
         except requests.exceptions.Timeout:
@@ -1106,23 +3644,20 @@ class TimechainWidget:
 
 
         # Jeśli wystąpił błąd, spróbuj zwrócić stare dane z cache jako fallback
-        if cache_file and os.path.exists(cache_file):
-            try:
-                logging.warning(f"Zwracam przestarzałe dane z cache dla {url} z powodu błędu: {error_msg}")
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    return f.read().strip()
-            except Exception as e:
-                 logging.warning(f"Błąd odczytu przestarzałego cache {cache_file}: {e}")
+        stale = self._api_cache.get_stale(url) if stale_on_error else None
+        if stale is not None:
+            logging.warning(f"Zwracam przestarzałe dane z cache dla {url} z powodu błędu: {error_msg}")
+            return stale
 
         # Jeśli nie ma fallbacku, zwróć błąd
         return error_msg
 
 
-    def _get_swatch_internet_time(self) -> str:
-        """Oblicza aktualny czas Swatch Internet Time (@beats)."""
+    def _get_swatch_internet_time(self, now: Optional[float] = None) -> str:
+        """Oblicza czas Swatch Internet Time (@beats) dla chwili `now` (domyślnie teraz)."""
         try:
             # Użyj UTC+1 (Biel Mean Time - BMT)
-            now_utc = datetime.datetime.now(datetime.timezone.utc)
+            now_utc = datetime.datetime.fromtimestamp(time.time() if now is None else now, datetime.timezone.utc)
             # Przesunięcie do strefy czasowej BMT (UTC+1)
             bmt_offset = datetime.timedelta(hours=1)
             now_bmt = now_utc + bmt_offset
@@ -1141,54 +3676,145 @@ class TimechainWidget:
 
     # --- Funkcje Pomocnicze dla Przechwytywania ---
 
+    def _get_font_search_dirs(self) -> List[str]:
+        """Zwraca standardowe katalogi czcionek dla bieżącego systemu."""
+        font_dirs = []
+        if platform.system() == "Windows":
+            win_dir = os.environ.get("WINDIR", "C:\\Windows")
+            if win_dir: font_dirs.append(os.path.join(win_dir, "Fonts"))
+        elif platform.system() == "Darwin": # macOS
+            font_dirs.extend(["/Library/Fonts", "/System/Library/Fonts", os.path.join(os.path.expanduser("~"), "Library", "Fonts")])
+        else: # Linux / other Unix
+            font_dirs.extend(["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(os.path.expanduser("~"), ".fonts"), os.path.join(os.path.expanduser("~"), ".local/share/fonts")])
+        return font_dirs
+
+    def _load_font_index(self) -> Dict[str, str]:
+        """Wczytuje (lub buduje) indeks plików czcionek: nazwa pliku (małe litery) -> pełna ścieżka.
+
+        Indeks jest trzymany w katalogu cache i unieważniany, gdy zmieni się mtime
+        któregokolwiek z przeszukiwanych katalogów.
+        """
+        index_file = os.path.join(self._cache_dir, FONT_INDEX_FILENAME) if self._cache_dir else None
+
+        # Spróbuj użyć zapisanego indeksu
+        if index_file and os.path.exists(index_file):
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                stored_mtimes = stored.get('dir_mtimes', {})
+                index_valid = stored.get('version') == FONT_INDEX_VERSION and bool(stored_mtimes)
+                for dir_path, mtime in stored_mtimes.items():
+                    try:
+                        if os.path.getmtime(dir_path) != mtime:
+                            index_valid = False
+                            break
+                    except OSError:
+                        index_valid = False # Katalog zniknął
+                        break
+                # Nowy katalog czcionek (np. utworzony ~/.fonts) też unieważnia indeks
+                if index_valid and any(d not in stored_mtimes and os.path.isdir(d) for d in self._get_font_search_dirs()):
+                    index_valid = False
+                if index_valid:
+                    logging.debug(f"Używam zapisanego indeksu czcionek ({len(stored.get('files', {}))} plików).")
+                    return stored.get('files', {})
+                logging.info("Indeks czcionek nieaktualny, przebudowuję.")
+            except Exception as e:
+                logging.warning(f"Błąd odczytu indeksu czcionek {index_file}: {e}. Przebudowuję.")
+
+        # Zbuduj indeks od nowa
+        files: Dict[str, str] = {}
+        dir_mtimes: Dict[str, float] = {}
+        for font_dir in self._get_font_search_dirs():
+            if not os.path.isdir(font_dir): continue # Pomiń jeśli katalog nie istnieje
+            for root_dir, _, filenames in os.walk(font_dir):
+                try:
+                    dir_mtimes[root_dir] = os.path.getmtime(root_dir)
+                except OSError:
+                    continue
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(('.ttf', '.otf', '.ttc')):
+                        # Pierwsze trafienie wygrywa - zachowuje kolejność katalogów
+                        files.setdefault(filename.lower(), os.path.join(root_dir, filename))
+        logging.info(f"Zbudowano indeks czcionek: {len(files)} plików w {len(dir_mtimes)} katalogach.")
+
+        if index_file:
+            try:
+                with open(index_file, 'w', encoding='utf-8') as f:
+                    json.dump({'version': FONT_INDEX_VERSION, 'dir_mtimes': dir_mtimes, 'files': files}, f)
+            except Exception as e:
+                logging.warning(f"Błąd zapisu indeksu czcionek {index_file}: {e}")
+        return files
+
+    def _get_font(self, font_path: Optional[str], size: int) -> Any:
+        """Zwraca załadowaną czcionkę PIL dla (ścieżka, rozmiar), z cache w pamięci procesu.
+
+        Rzuca IOError/OSError, jeśli czcionki nie da się załadować (jak ImageFont.truetype).
+        """
+        cache_key = (font_path, size)
+        with self._loaded_fonts_lock:
+            font = self._loaded_fonts.get(cache_key)
+        if font is not None:
+            return font
+        font = ImageFont.truetype(font_path, size) if font_path else ImageFont.load_default()
+        with self._loaded_fonts_lock:
+            self._loaded_fonts[cache_key] = font
+        return font
+
+    def _warm_up_font_lookup(self) -> None:
+        """Wątek w tle po pierwszym wyświetleniu: wczytuje indeks czcionek i ścieżkę czcionki znaku wodnego."""
+        started = time.perf_counter()
+        try:
+            self._get_main_font_path()
+            logging.debug(f"Indeks czcionek gotowy po {(time.perf_counter() - started) * 1000:.0f} ms (w tle).")
+        except Exception as e:
+            logging.warning(f"Błąd wstępnego wyszukiwania czcionek: {e}")
+
     def _get_font_path(self, font_name_preference: str, fallback_filenames: List[str]) -> Optional[str]:
-        """Próbuje znaleźć ścieżkę do pliku czcionki."""
+        """Próbuje znaleźć ścieżkę do pliku czcionki (wynik zapamiętywany na czas działania)."""
+        memo_key = (font_name_preference, tuple(fallback_filenames))
+        with self._font_lookup_lock: # Przechwytywanie przed końcem skanowania w tle czeka na jego wynik
+            if memo_key in self._resolved_font_paths:
+                return self._resolved_font_paths[memo_key]
+
+            resolved = self._find_font_path(font_name_preference, fallback_filenames)
+            self._resolved_font_paths[memo_key] = resolved
+            return resolved
+
+    def _find_font_path(self, font_name_preference: str, fallback_filenames: List[str]) -> Optional[str]:
+        """Szuka pliku czcionki: najpierw po nazwie systemowej, potem w indeksie czcionek."""
         # Najpierw sprawdź, czy system/PIL zna czcionkę po nazwie
         try:
-            ImageFont.truetype(font_name_preference, 10)
+            self._get_font(font_name_preference, 10)
             logging.debug(f"Znaleziono czcionkę systemową: {font_name_preference}")
             return font_name_preference
         except Exception:
             logging.debug(f"Czcionka systemowa '{font_name_preference}' niedostępna, szukam plików.")
             pass # Szukaj dalej w plikach
 
-        # Standardowe lokalizacje czcionek
-        font_dirs = []
-        if platform.system() == "Windows":
-            win_dir = os.environ.get("WINDIR", "C:\\Windows")
-            if win_dir: font_dirs.append(os.path.join(win_dir, "Fonts"))
-        elif platform.system() == "Darwin": # macOS
-            font_dirs.extend(["/Library/Fonts", "/System/Library/Fonts", os.path.join(os.path.expanduser("~"), "Library", "Fonts")])
-        else: # Linux / other Unix
-            font_dirs.extend(["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(os.path.expanduser("~"), ".fonts"), os.path.join(os.path.expanduser("~"), ".local/share/fonts")])
+        if self._font_index is None:
+            self._font_index = self._load_font_index()
 
         # Dodaj bardziej generyczne fallbacki na koniec listy
-        common_fallbacks = ["arial.ttf", "Arial.ttf", "verdana.ttf", "Verdana.ttf", "dejavusans.ttf", "DejaVuSans.ttf", " LiberationSans-Regular.ttf", "FreeSans.ttf", "NotoSans-Regular.ttf"]
+        common_fallbacks = ["arial.ttf", "Arial.ttf", "verdana.ttf", "Verdana.ttf", "dejavusans.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf", "FreeSans.ttf", "NotoSans-Regular.ttf"]
         search_paths = fallback_filenames + [f for f in common_fallbacks if f not in fallback_filenames]
 
         # Szukaj plików czcionek
         for font_filename in search_paths:
             # Sprawdź, czy to już pełna ścieżka
-            if os.path.isabs(font_filename) and os.path.exists(font_filename):
-                try:
-                    ImageFont.truetype(font_filename, 10)
-                    logging.debug(f"Znaleziono czcionkę w podanej ścieżce: {font_filename}")
-                    return font_filename
-                except Exception:
-                    continue # Spróbuj następnej
-
-            # Szukaj w standardowych katalogach
-            for font_dir in font_dirs:
-                if not os.path.isdir(font_dir): continue # Pomiń jeśli katalog nie istnieje
-                full_path = os.path.join(font_dir, font_filename)
-                if os.path.exists(full_path):
-                    try:
-                        ImageFont.truetype(full_path, 10) # Sprawdź, czy PIL może ją załadować
-                        logging.info(f"Znaleziono odpowiednią czcionkę: {full_path}")
-                        return full_path
-                    except Exception:
-                        logging.debug(f"Plik {full_path} istnieje, ale PIL nie może go załadować.")
-                        continue # Spróbuj następnego pliku/katalogu
+            if os.path.isabs(font_filename):
+                candidate = font_filename if os.path.exists(font_filename) else None
+            else:
+                # Szukaj w indeksie standardowych katalogów
+                candidate = self._font_index.get(font_filename.strip().lower())
+            if not candidate:
+                continue
+            try:
+                self._get_font(candidate, 10) # Sprawdź, czy PIL może ją załadować
+                logging.info(f"Znaleziono odpowiednią czcionkę: {candidate}")
+                return candidate
+            except Exception:
+                logging.debug(f"Plik {candidate} istnieje, ale PIL nie może go załadować.")
+                continue # Spróbuj następnego pliku
 
         logging.warning(f"Nie znaleziono odpowiedniej czcionki dla '{font_name_preference}' ani fallbacków. Użycie domyślnej PIL.")
         return None # Zwróć None, jeśli nic nie znaleziono
@@ -1225,12 +3851,22 @@ class TimechainWidget:
         height_str = self._block_height_str if "Error" not in self._block_height_str else "Błąd Wys." if self.lang == 'pl' else "Hgt Err"
         beat_str = self._beat_time_str if "Error" not in self._beat_time_str else "@???"
 
+        # Ostatni znany stan (niepotwierdzony) nie może wyglądać na bieżący dowód czasu - jak na etykiecie "~" i jawny dopisek
+        stale_fields = tuple(self._stale_fields) # Kopia - zbiór zmienia wątek Tkinter
+        stale_note = ""
+        if 'height' in stale_fields and "Error" not in self._block_height_str:
+            height_str = f"~{height_str}"
+        if 'hash' in stale_fields and "Error" not in hash_to_use:
+            hash_to_use = f"~{hash_to_use}"
+        if stale_fields:
+            stale_note = " (nieaktualne)" if self.lang == 'pl' else " (stale)"
+
         prompt_part = f"{self.prompt}@" if self.prompt.endswith('@') else f"{self.prompt} @"
 
         # Zwróć sformatowany tekst wieloliniowy
         return (
             f"{prompt_part}\n"
-            f"{'Czas' if self.lang == 'pl' else 'Time'}: {self._current_time_str} | BeatTime: {beat_str} | {'Blok' if self.lang == 'pl' else 'Block'}: {height_str}\n"
+            f"{'Czas' if self.lang == 'pl' else 'Time'}: {self._current_time_str} | BeatTime: {beat_str} | {'Blok' if self.lang == 'pl' else 'Block'}: {height_str}{stale_note}\n"
             f"{'Hash' if self.lang == 'pl' else 'Hash'}: {hash_to_use}"
         )
 
@@ -1301,6 +3937,183 @@ class TimechainWidget:
         return positions
 
 
+    def _watermark_stamp_cache_key(self, text: str) -> Tuple[Any, ...]:
+        """Zwraca klucz cache stempla: wszystkie parametry wpływające na jego wygląd."""
+        font_path = self._get_main_font_path()
+        alpha = max(0, min(255, int(255 * (WATERMARK_OPACITY / 100.0))))
+        show_shadow = self._show_shadow
+        return (text, font_path, WATERMARK_FONT_SIZE, self._current_text_color,
+                self._current_shadow_color, alpha, WATERMARK_ANGLE, show_shadow)
+
+    def _get_watermark_stamp(self, text: str, cache_key: Optional[Tuple[Any, ...]] = None) -> Optional[Image.Image]:
+        """Zwraca obrócony stempel znaku wodnego, korzystając z cache LRU.
+
+        Tekst, kolory, przezroczystość i kąt nie zmieniają się w trakcie nagrania,
+        więc stempel jest rasteryzowany raz, a kolejne klatki tylko go wklejają.
+        Stempel jest rysowany wyłącznie z parametrów klucza - zmiana koloru w trakcie
+        (np. odwrócenie) nie zapisze stempla pod kluczem z innymi kolorami.
+        """
+        if cache_key is None:
+            cache_key = self._watermark_stamp_cache_key(text)
+
+        with self._watermark_stamp_cache_lock:
+            cached_stamp = self._watermark_stamp_cache.get(cache_key)
+            if cached_stamp is not None:
+                self._watermark_stamp_cache.move_to_end(cache_key) # Oznacz jako ostatnio użyty
+                return cached_stamp
+
+        stamp = self._render_watermark_stamp(*cache_key)
+        if stamp is None:
+            return None
+
+        with self._watermark_stamp_cache_lock:
+            self._watermark_stamp_cache[cache_key] = stamp
+            self._watermark_stamp_cache.move_to_end(cache_key)
+            while len(self._watermark_stamp_cache) > WATERMARK_STAMP_CACHE_SIZE:
+                self._watermark_stamp_cache.popitem(last=False) # Usuń najdawniej użyty
+        logging.debug(f"Wyrenderowano i zapisano w cache stempel znaku wodnego ({stamp.size[0]}x{stamp.size[1]}).")
+        return stamp
+
+    def _render_watermark_stamp(self, text: str, font_path: Optional[str], font_size: int, text_color: str,
+                                shadow_color: str, alpha: int, angle: float, show_shadow: bool) -> Optional[Image.Image]:
+        """Rasteryzuje (i obraca) stempel znaku wodnego z podanych parametrów (klucza cache). Wywoływane tylko przy braku w cache."""
+        try:
+            font = self._get_font(font_path, font_size)
+            if not font_path:
+                 logging.warning("Używam domyślnej czcionki PIL dla znaku wodnego.")
+        except IOError:
+            logging.error(f"Nie można załadować czcionki {font_path}. Używam domyślnej.")
+            font = self._get_font(None, font_size)
+
+        # Zmierz rozmiar tekstu, aby utworzyć stempel odpowiedniej wielkości
+        # Użyj textbbox dla dokładniejszego pomiaru, jeśli dostępny (nowsze Pillow)
+        temp_img_for_measurement = Image.new("RGBA", (1, 1)) # Minimalny obrazek
+        temp_draw = ImageDraw.Draw(temp_img_for_measurement)
+        try:
+            # textbbox zwraca (left, top, right, bottom)
+            bbox = temp_draw.textbbox((0, 0), text, font=font, spacing=4, align="left") # align może pomóc
+            # Rzeczywista szerokość i wysokość
+            measured_text_width = bbox[2] - bbox[0]
+            measured_text_height = bbox[3] - bbox[1]
+            # Pozycja rysowania tekstu na stemplu, aby uwzględnić bbox[0], bbox[1]
+            text_draw_x = -bbox[0]
+            text_draw_y = -bbox[1]
+        except AttributeError:
+            # Starsza wersja Pillow - użyj multiline_textsize (mniej dokładne)
+            size = temp_draw.multiline_textsize(text, font=font, spacing=4)
+            measured_text_width = size[0]
+            measured_text_height = size[1]
+            text_draw_x = 0
+            text_draw_y = 0
+            logging.debug("Używam multiline_textsize do pomiaru tekstu znaku wodnego (starsze Pillow?).")
+
+        del temp_draw
+        del temp_img_for_measurement
+
+        if measured_text_width <= 0 or measured_text_height <= 0:
+             logging.error("Obliczony rozmiar tekstu znaku wodnego jest nieprawidłowy.")
+             return None
+
+        # Dodaj margines do stempla
+        margin = 10
+        stamp_width = max(1, measured_text_width + 2 * margin)
+        stamp_height = max(1, measured_text_height + 2 * margin)
+
+        # Pozycja tekstu na stemplu (z uwzględnieniem marginesu i bbox)
+        final_text_x = margin + text_draw_x
+        final_text_y = margin + text_draw_y
+
+        # Utwórz obraz stempla (przezroczysty)
+        stamp_image = Image.new("RGBA", (stamp_width, stamp_height), (0, 0, 0, 0))
+        draw_stamp = ImageDraw.Draw(stamp_image)
+
+        # Pobierz kolory RGB (upewnij się, że są krotkami)
+        try:
+            wm_shadow_color_rgb = ImageColor.getrgb(shadow_color)
+        except ValueError:
+            logging.warning(f"Nieprawidłowy kolor cienia '{shadow_color}', używam czarnego.")
+            wm_shadow_color_rgb = (0, 0, 0)
+        try:
+            wm_text_color_rgb = ImageColor.getrgb(text_color)
+        except ValueError:
+            logging.warning(f"Nieprawidłowy kolor tekstu '{text_color}', używam białego.")
+            wm_text_color_rgb = (255, 255, 255)
+
+        # Narysuj cień (jeśli włączony)
+        if show_shadow:
+             shadow_offset_wm = 2 # Małe przesunięcie dla cienia na znaku wodnym
+             draw_stamp.text(
+                 (final_text_x + shadow_offset_wm, final_text_y + shadow_offset_wm),
+                 text,
+                 font=font,
+                 fill=(*wm_shadow_color_rgb, alpha), # Kolor cienia z przezroczystością
+                 spacing=4,
+                 align="left"
+             )
+
+        # Narysuj główny tekst
+        draw_stamp.text(
+            (final_text_x, final_text_y),
+            text,
+            font=font,
+            fill=(*wm_text_color_rgb, alpha), # Kolor tekstu z przezroczystością
+            spacing=4,
+            align="left"
+        )
+
+        # --- Obrót stempla ---
+        if angle == 0:
+            return stamp_image
+        try:
+            # Wybierz metodę resampling (nowsze Pillow używa Image.Resampling)
+            resample_method = Image.Resampling.BICUBIC if hasattr(Image, 'Resampling') else Image.BICUBIC
+            # Obróć stempel, expand=True dostosowuje rozmiar obrazu
+            rotated_stamp = stamp_image.rotate(angle, resample=resample_method, expand=True)
+            logging.debug(f"Obrócono stempel o {angle} stopni. Nowy rozmiar: {rotated_stamp.size[0]}x{rotated_stamp.size[1]}")
+            return rotated_stamp
+        except Exception as e:
+            logging.error(f"Błąd podczas obracania stempla znaku wodnego: {e}")
+            # Użyj nieobróconego stempla jako fallback
+            return stamp_image
+
+
+    def _get_watermark_paste_locations(
+        self, width: int, height: int, rotated_width: int, rotated_height: int,
+        predefined_paste_positions: Optional[List[Tuple[int, int]]] = None
+    ) -> List[Tuple[int, int]]:
+        """Zwraca pozycje wklejenia stempla zgodnie z aktualnym stylem znaku wodnego."""
+        wm_mode = self._watermark_style # Styl '1', '3', '5', '8' (kopia zmiennej Tk - wołane także z wątków)
+        num_watermarks = 1
+        is_grid_based = False
+        if wm_mode.isdigit() and int(wm_mode) in [3, 5, 8]:
+             num_watermarks = int(wm_mode)
+             is_grid_based = True
+        elif wm_mode != "1":
+             logging.warning(f"Nieznany styl znaku wodnego '{wm_mode}', używam stylu '1'.")
+
+        if is_grid_based:
+            if predefined_paste_positions:
+                # Użyj pozycji przekazanych (dla spójności w wideo/GIF)
+                logging.debug(f"Używam predefiniowanych {len(predefined_paste_positions)} pozycji dla siatki.")
+                return predefined_paste_positions
+            # Oblicz pozycje dla siatki (pierwsza klatka lub pojedynczy obraz)
+            if self._video_gif_random_seed is None:
+                 self._video_gif_random_seed = int(time.time() * 1000) % 100000 # Inicjalizuj ziarno
+                 logging.debug(f"Zainicjalizowano ziarno losowości dla siatki WM: {self._video_gif_random_seed}")
+            random_generator = random.Random(self._video_gif_random_seed) # Użyj ziarna
+            paste_locations = self._calculate_grid_paste_positions_seeded(
+                width, height, num_watermarks, rotated_width, rotated_height, random_generator
+            )
+            # Zapisz obliczone pozycje dla przyszłych klatek (jeśli to wideo/GIF)
+            self._fixed_watermark_paste_positions = paste_locations
+            return paste_locations
+
+        # Pojedynczy znak wodny - wycentrowany
+        paste_x = max(0, (width - rotated_width) // 2)
+        paste_y = max(0, (height - rotated_height) // 2)
+        logging.debug(f"Obliczono pozycję dla pojedynczego WM: {(paste_x, paste_y)}")
+        return [(paste_x, paste_y)]
+
     def _add_watermark_pil(self, image: Image.Image, text: str, predefined_paste_positions: Optional[List[Tuple[int, int]]] = None) -> Image.Image:
         """Dodaje znak wodny do obrazu PIL."""
         if not PIL_AVAILABLE:
@@ -1317,161 +4130,23 @@ class TimechainWidget:
                 image = image.convert('RGBA')
 
             width, height = image.size
-            wm_mode = self._watermark_mode_var.get() # Pobierz styl '1', '3', '5', '8'
-            num_watermarks = 1
-            is_grid_based = False
-            if wm_mode.isdigit() and int(wm_mode) in [3, 5, 8]:
-                 num_watermarks = int(wm_mode)
-                 is_grid_based = True
-            elif wm_mode != "1":
-                 logging.warning(f"Nieznany styl znaku wodnego '{wm_mode}', używam stylu '1'.")
-                 wm_mode = "1"
-
-
-            # --- Przygotowanie stempla znaku wodnego ---
-            font_path = self._get_main_font_path()
-            try:
-                font = ImageFont.truetype(font_path, WATERMARK_FONT_SIZE) if font_path else ImageFont.load_default()
-                if not font_path:
-                     logging.warning("Używam domyślnej czcionki PIL dla znaku wodnego.")
-            except IOError:
-                logging.error(f"Nie można załadować czcionki {font_path}. Używam domyślnej.")
-                font = ImageFont.load_default()
-
-            # Zmierz rozmiar tekstu, aby utworzyć stempel odpowiedniej wielkości
-            # Użyj textbbox dla dokładniejszego pomiaru, jeśli dostępny (nowsze Pillow)
-            temp_img_for_measurement = Image.new("RGBA", (1, 1)) # Minimalny obrazek
-            temp_draw = ImageDraw.Draw(temp_img_for_measurement)
-            try:
-                # textbbox zwraca (left, top, right, bottom)
-                bbox = temp_draw.textbbox((0, 0), text, font=font, spacing=4, align="left") # align może pomóc
-                # Rzeczywista szerokość i wysokość
-                measured_text_width = bbox[2] - bbox[0]
-                measured_text_height = bbox[3] - bbox[1]
-                # Pozycja rysowania tekstu na stemplu, aby uwzględnić bbox[0], bbox[1]
-                text_draw_x = -bbox[0]
-                text_draw_y = -bbox[1]
-            except AttributeError:
-                # Starsza wersja Pillow - użyj multiline_textsize (mniej dokładne)
-                size = temp_draw.multiline_textsize(text, font=font, spacing=4)
-                bbox = (0, 0, size[0], size[1])
-                measured_text_width = size[0]
-                measured_text_height = size[1]
-                text_draw_x = 0
-                text_draw_y = 0
-                logging.debug("Używam multiline_textsize do pomiaru tekstu znaku wodnego (starsze Pillow?).")
-
-
-            del temp_draw
-            del temp_img_for_measurement
-
-            if measured_text_width <= 0 or measured_text_height <= 0:
-                 logging.error("Obliczony rozmiar tekstu znaku wodnego jest nieprawidłowy.")
-                 return image # Zwróć oryginalny obraz
-
-
-            # Dodaj margines do stempla
-            margin = 10
-            stamp_width = max(1, measured_text_width + 2 * margin)
-            stamp_height = max(1, measured_text_height + 2 * margin)
-
-            # Pozycja tekstu na stemplu (z uwzględnieniem marginesu i bbox)
-            final_text_x = margin + text_draw_x
-            final_text_y = margin + text_draw_y
-
-            # Utwórz obraz stempla (przezroczysty)
-            stamp_image = Image.new("RGBA", (stamp_width, stamp_height), (0, 0, 0, 0))
-            draw_stamp = ImageDraw.Draw(stamp_image)
-
-            # Oblicz przezroczystość
-            alpha = int(255 * (WATERMARK_OPACITY / 100.0))
-            alpha = max(0, min(255, alpha)) # Upewnij się, że jest w zakresie 0-255
-
-            # Pobierz kolory RGB (upewnij się, że są krotkami)
-            try:
-                wm_shadow_color_rgb = ImageColor.getrgb(self._current_shadow_color)
-            except ValueError:
-                logging.warning(f"Nieprawidłowy kolor cienia '{self._current_shadow_color}', używam czarnego.")
-                wm_shadow_color_rgb = (0, 0, 0)
-            try:
-                wm_text_color_rgb = ImageColor.getrgb(self._current_text_color)
-            except ValueError:
-                logging.warning(f"Nieprawidłowy kolor tekstu '{self._current_text_color}', używam białego.")
-                wm_text_color_rgb = (255, 255, 255)
-
-
-            # Narysuj cień (jeśli włączony)
-            if self._show_shadow_var.get():
-                 shadow_offset_wm = 2 # Małe przesunięcie dla cienia na znaku wodnym
-                 draw_stamp.text(
-                     (final_text_x + shadow_offset_wm, final_text_y + shadow_offset_wm),
-                     text,
-                     font=font,
-                     fill=(*wm_shadow_color_rgb, alpha), # Kolor cienia z przezroczystością
-                     spacing=4,
-                     align="left"
-                 )
-
-            # Narysuj główny tekst
-            draw_stamp.text(
-                (final_text_x, final_text_y),
-                text,
-                font=font,
-                fill=(*wm_text_color_rgb, alpha), # Kolor tekstu z przezroczystością
-                spacing=4,
-                align="left"
-            )
-
-            # --- Obrót stempla ---
-            rotated_stamp = stamp_image
-            rotated_width, rotated_height = stamp_image.size
-            if WATERMARK_ANGLE != 0:
-                try:
-                    # Wybierz metodę resampling (nowsze Pillow używa Image.Resampling)
-                    resample_method = Image.Resampling.BICUBIC if hasattr(Image, 'Resampling') else Image.BICUBIC
-
-                    # Obróć stempel, expand=True dostosowuje rozmiar obrazu
-                    rotated_stamp = stamp_image.rotate(WATERMARK_ANGLE, resample=resample_method, expand=True)
-                    rotated_width, rotated_height = rotated_stamp.size
-                    logging.debug(f"Obrócono stempel o {WATERMARK_ANGLE} stopni. Nowy rozmiar: {rotated_width}x{rotated_height}")
-                except Exception as e:
-                    logging.error(f"Błąd podczas obracania stempla znaku wodnego: {e}")
-                    # Użyj nieobróconego stempla jako fallback
-                    rotated_stamp = stamp_image
-                    rotated_width, rotated_height = stamp_image.size
 
+            # --- Przygotowanie stempla znaku wodnego (z cache) ---
+            rotated_stamp = self._get_watermark_stamp(text)
+            if rotated_stamp is None:
+                return image # Zwróć oryginalny obraz
+            rotated_width, rotated_height = rotated_stamp.size
 
             # --- Obliczanie pozycji wklejenia ---
-            paste_locations = []
-            if is_grid_based:
-                if predefined_paste_positions:
-                    # Użyj pozycji przekazanych (dla spójności w wideo/GIF)
-                    paste_locations = predefined_paste_positions
-                    logging.debug(f"Używam predefiniowanych {len(paste_locations)} pozycji dla siatki.")
-                else:
-                    # Oblicz pozycje dla siatki (pierwsza klatka lub pojedynczy obraz)
-                    if self._video_gif_random_seed is None:
-                         self._video_gif_random_seed = int(time.time() * 1000) % 100000 # Inicjalizuj ziarno
-                         logging.debug(f"Zainicjalizowano ziarno losowości dla siatki WM: {self._video_gif_random_seed}")
-                    random_generator = random.Random(self._video_gif_random_seed) # Użyj ziarna
-                    paste_locations = self._calculate_grid_paste_positions_seeded(
-                        width, height, num_watermarks, rotated_width, rotated_height, random_generator
-                    )
-                    # Zapisz obliczone pozycje dla przyszłych klatek (jeśli to wideo/GIF)
-                    self._fixed_watermark_paste_positions = paste_locations
-            else:
-                # Pojedynczy znak wodny - wycentrowany
-                paste_x = max(0, (width - rotated_width) // 2)
-                paste_y = max(0, (height - rotated_height) // 2)
-                paste_locations = [(paste_x, paste_y)]
-                logging.debug(f"Obliczono pozycję dla pojedynczego WM: {paste_locations[0]}")
-
+            paste_locations = self._get_watermark_paste_locations(
+                width, height, rotated_width, rotated_height, predefined_paste_positions
+            )
 
             # --- Wklejanie stempla(ów) na obraz ---
             if not paste_locations:
                  logging.warning("Brak obliczonych pozycji do wklejenia znaku wodnego.")
             else:
-                 logging.info(f"Wklejanie {len(paste_locations)} znaków wodnych.")
+                 logging.debug(f"Wklejanie {len(paste_locations)} znaków wodnych.")
                  for i, (paste_x, paste_y) in enumerate(paste_locations):
                       # Sprawdzenie, czy pozycja ma sens (czy stempel będzie częściowo widoczny)
                       if paste_x < width and paste_y < height and paste_x + rotated_width > 0 and paste_y + rotated_height > 0:
@@ -1487,8 +4162,120 @@ class TimechainWidget:
              return image # Zwróć oryginalny obraz w razie błędu
 
 
+    def _get_watermark_stamp_arrays(self, text: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Zwraca stempel jako tablice NumPy do mieszania alfa: (BGR * alfa, 255 - alfa).
+
+        Tablice są wyliczane raz na stempel i trzymane w cache obok obrazu PIL.
+        """
+        cache_key = self._watermark_stamp_cache_key(text) # Jeden klucz dla stempla i jego tablic
+        stamp = self._get_watermark_stamp(text, cache_key)
+        if stamp is None:
+            return None
+
+        with self._watermark_stamp_cache_lock:
+            cached_arrays = self._watermark_stamp_array_cache.get(cache_key)
+            if cached_arrays is not None:
+                self._watermark_stamp_array_cache.move_to_end(cache_key)
+                return cached_arrays
+
+        stamp_rgba = np.asarray(stamp.convert('RGBA'), dtype=np.uint16)
+        alpha = stamp_rgba[:, :, 3:4] # Kształt (h, w, 1) - broadcasting po kanałach
+        # Pre-multiplikacja: kolor BGR * alfa (maks. 255*255 mieści się w uint16)
+        premultiplied_bgr = np.ascontiguousarray(stamp_rgba[:, :, 2::-1] * alpha)
+        inverse_alpha = np.ascontiguousarray(255 - alpha)
+        arrays = (premultiplied_bgr, inverse_alpha)
+
+        with self._watermark_stamp_cache_lock:
+            self._watermark_stamp_array_cache[cache_key] = arrays
+            self._watermark_stamp_array_cache.move_to_end(cache_key)
+            while len(self._watermark_stamp_array_cache) > WATERMARK_STAMP_CACHE_SIZE:
+                self._watermark_stamp_array_cache.popitem(last=False)
+        return arrays
+
     def _add_watermark_cv2(self, frame: np.ndarray, text: str, predefined_paste_positions: Optional[List[Tuple[int, int]]]) -> np.ndarray:
-        """Dodaje znak wodny do klatki OpenCV (używając logiki PIL)."""
+        """Dodaje znak wodny do klatki OpenCV (BGR/BGRA) mieszając alfa w NumPy, w miejscu.
+
+        Modyfikowany jest tylko obszar pod stemplem - bez konwersji całej klatki do PIL.
+        """
+        if not NUMPY_AVAILABLE:
+            logging.error("Brak modułu numpy do dodania znaku wodnego do klatki CV2.")
+            return frame # Zwróć oryginalną klatkę
+
+        if not text:
+             logging.warning("Pusty tekst znaku wodnego, pomijam dodawanie.")
+             return frame
+
+        # Nietypowe formaty (skala szarości, inne typy danych) obsługuje wolniejsza ścieżka PIL
+        if frame.ndim != 3 or frame.shape[2] not in (3, 4) or frame.dtype != np.uint8:
+            logging.debug(f"Format klatki shape={frame.shape}, dtype={frame.dtype} - używam ścieżki PIL.")
+            return self._add_watermark_cv2_via_pil(frame, text, predefined_paste_positions)
+
+        overlay = self._prepare_watermark_overlay(text, frame.shape[1], frame.shape[0], predefined_paste_positions)
+        return self._blend_watermark_overlay(frame, overlay) if overlay is not None else frame
+
+    def _prepare_watermark_overlay(
+        self, text: str, width: int, height: int,
+        predefined_paste_positions: Optional[List[Tuple[int, int]]] = None
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, List[Tuple[int, int]]]]:
+        """Zwraca (BGR * alfa, 255 - alfa, pozycje wklejenia) dla klatek danego rozmiaru albo None.
+
+        Nagrania wołają ją raz, przed startem puli wątków - wątki robocze dostają gotowe,
+        niezmienne dane i nie czytają stanu widgetu.
+        """
+        try:
+            stamp_arrays = self._get_watermark_stamp_arrays(text)
+            if stamp_arrays is None:
+                return None
+            premultiplied_bgr, inverse_alpha = stamp_arrays
+            stamp_height, stamp_width = inverse_alpha.shape[:2]
+            paste_locations = self._get_watermark_paste_locations(
+                width, height, stamp_width, stamp_height, predefined_paste_positions
+            )
+            if not paste_locations:
+                 logging.warning("Brak obliczonych pozycji do wklejenia znaku wodnego.")
+                 return None
+            return premultiplied_bgr, inverse_alpha, list(paste_locations)
+        except Exception as e:
+            logging.error(f"Błąd podczas przygotowania znaku wodnego (NumPy): {e}", exc_info=True)
+            return None
+
+    @staticmethod
+    def _blend_watermark_overlay(frame: np.ndarray, overlay: Tuple[np.ndarray, np.ndarray, List[Tuple[int, int]]]) -> np.ndarray:
+        """Miesza przygotowany stempel z klatką uint8 BGR/BGRA w miejscu (bezpieczne dla wielu wątków)."""
+        if frame.ndim != 3 or frame.shape[2] not in (3, 4) or frame.dtype != np.uint8:
+            logging.warning(f"Nieobsługiwany format klatki shape={frame.shape}, dtype={frame.dtype} - pomijam znak wodny.")
+            return frame
+        premultiplied_bgr, inverse_alpha, paste_locations = overlay
+        stamp_height, stamp_width = inverse_alpha.shape[:2]
+        height, width = frame.shape[:2]
+        try:
+            for i, (paste_x, paste_y) in enumerate(paste_locations):
+                # Przycięcie stempla do granic klatki
+                x1, y1 = max(0, paste_x), max(0, paste_y)
+                x2, y2 = min(width, paste_x + stamp_width), min(height, paste_y + stamp_height)
+                if x1 >= x2 or y1 >= y2:
+                    logging.warning(f"Pominięto wklejanie znaku wodnego {i+1} w pozycji {paste_x},{paste_y} (poza widocznym obszarem).")
+                    continue
+                sx1, sy1 = x1 - paste_x, y1 - paste_y
+                sx2, sy2 = sx1 + (x2 - x1), sy1 + (y2 - y1)
+
+                roi = frame[y1:y2, x1:x2, :3] # Widok na fragment klatki (bez kopii)
+                # out = (tło * (255 - a) + kolor * a) / 255, z zaokrągleniem
+                blended = roi.astype(np.uint16)
+                blended *= inverse_alpha[sy1:sy2, sx1:sx2]
+                blended += premultiplied_bgr[sy1:sy2, sx1:sx2]
+                blended += 127
+                blended //= 255
+                roi[...] = blended
+
+            return frame
+
+        except Exception as e:
+            logging.error(f"Błąd podczas dodawania znaku wodnego (NumPy): {e}", exc_info=True)
+            return frame # Zwróć oryginalną klatkę w razie błędu
+
+    def _add_watermark_cv2_via_pil(self, frame: np.ndarray, text: str, predefined_paste_positions: Optional[List[Tuple[int, int]]]) -> np.ndarray:
+        """Dodaje znak wodny do klatki OpenCV (używając logiki PIL). Wolniejszy fallback dla nietypowych formatów klatek."""
         if not CV2_AVAILABLE or not NUMPY_AVAILABLE or not PIL_AVAILABLE:
             logging.error("Brak wymaganych modułów (cv2, numpy, PIL) do dodania znaku wodnego do klatki CV2.")
             return frame # Zwróć oryginalną klatkę
@@ -1781,6 +4568,9 @@ class TimechainWidget:
         original_visibility_state = False # Czy widget był widoczny przed ukryciem?
 
         try:
+            # Obszar ustalany przed ukryciem widgetu (None = cały ekran)
+            capture_region = self._get_capture_region()
+
             # Sprawdź, czy widget jest widoczny i czy trzeba go ukryć
             widget_was_visible = False
             if self.master.winfo_exists():
@@ -1792,35 +4582,11 @@ class TimechainWidget:
                 self.master.after(0, self._hide_widget_for_capture)
                 time.sleep(0.2) # Daj systemowi chwilę na ukrycie okna
 
-            # Wykonaj zrzut ekranu
-            screenshot_image = None
-            primary_capture_method = "pyautogui" if PYAUTOGUI_AVAILABLE else "ImageGrab" if IMAGEGRAB_AVAILABLE else "none"
-
-            if primary_capture_method == "pyautogui":
-                 try:
-                     screenshot_image = pyautogui.screenshot()
-                 except Exception as e_pg:
-                     logging.error(f"Błąd pyautogui.screenshot: {e_pg}. Próba z ImageGrab.")
-                     if IMAGEGRAB_AVAILABLE:
-                         try: screenshot_image = ImageGrab.grab()
-                         except Exception as e_ig: logging.error(f"Błąd ImageGrab.grab: {e_ig}")
-                     else: logging.error("ImageGrab niedostępny.")
-
-            elif primary_capture_method == "ImageGrab":
-                 try:
-                     screenshot_image = ImageGrab.grab()
-                 except Exception as e_ig:
-                     logging.error(f"Błąd ImageGrab.grab: {e_ig}. Próba z pyautogui.")
-                     if PYAUTOGUI_AVAILABLE:
-                          try: screenshot_image = pyautogui.screenshot()
-                          except Exception as e_pg: logging.error(f"Błąd pyautogui.screenshot: {e_pg}")
-                     else: logging.error("Pyautogui niedostępny.")
-            else:
-                 raise RuntimeError("Brak dostępnej metody przechwytywania ekranu (pyautogui/ImageGrab).")
-
+            # Wykonaj zrzut ekranu (backend wybrany przy starcie, z fallbackami)
+            screenshot_image = self._screen_grabber.grab_image(region=capture_region)
 
             if screenshot_image is None:
-                raise RuntimeError("Nie udało się wykonać zrzutu ekranu (obie metody zawiodły lub zwróciły None).")
+                raise RuntimeError("Nie udało się wykonać zrzutu ekranu (backend zwrócił None).")
             logging.debug(f"Zrzut ekranu wykonany (rozmiar: {screenshot_image.size}).")
 
             # Dodaj znak wodny, jeśli tryb to 'watermark'
@@ -1840,8 +4606,13 @@ class TimechainWidget:
             metadata.add_text("BlockHeight", self._block_height_str or "N/A")
             metadata.add_text("BlockHashFull", self._full_block_hash_str or "N/A")
             metadata.add_text("BlockHashShort", self._block_hash_short_str or "N/A")
+            # Wysokość/hash z ostatniego znanego stanu, jeszcze niepotwierdzone przez sieć
+            stale_fields = sorted(tuple(self._stale_fields))
+            metadata.add_text("DataStale", f"true ({', '.join(stale_fields)})" if stale_fields else "false")
             metadata.add_text("BeatTime", self._beat_time_str or "N/A")
             metadata.add_text("CaptureMode", capture_mode)
+            if capture_region:
+                metadata.add_text("CaptureRegion", "x={},y={},w={},h={}".format(*capture_region))
             if capture_mode == SCREENSHOT_MODE_WATERMARK:
                 metadata.add_text("WatermarkStyle", self._watermark_mode_var.get())
                 metadata.add_text("WatermarkOpacity", str(WATERMARK_OPACITY))
@@ -1891,6 +4662,64 @@ class TimechainWidget:
             logging.debug("Zakończono wątek przechwytywania PNG.")
 
 
+    def _prepare_fixed_watermark_positions(self, width: int, height: int, watermark_text: str) -> None:
+        """Dla stylów siatki losuje (z zapisanym ziarnem) pozycje stempli wspólne dla wszystkich klatek nagrania."""
+        self._fixed_watermark_paste_positions = None
+        self._video_gif_random_seed = None
+        style = self._watermark_style
+        if not (style.isdigit() and int(style) in [3, 5, 8]) or width <= 0 or height <= 0:
+            return # Styl wycentrowany lub nieznany rozmiar - pozycje liczone w locie
+        try:
+            # Wymiary stempla bierzemy z cache - ten sam stempel będzie wklejany w każdej klatce
+            stamp_wm = self._get_watermark_stamp(watermark_text)
+            if stamp_wm is None:
+                raise RuntimeError("Nie udało się wyrenderować stempla znaku wodnego.")
+            rotated_w, rotated_h = stamp_wm.size
+
+            # Zainicjuj ziarno i generator losowości
+            self._video_gif_random_seed = int(time.time() * 1000) % 100000
+            random_gen = random.Random(self._video_gif_random_seed)
+            # Oblicz i zapisz pozycje
+            self._fixed_watermark_paste_positions = self._calculate_grid_paste_positions_seeded(
+                width, height, int(style), rotated_w, rotated_h, random_gen
+            )
+            logging.info(f"Obliczono {len(self._fixed_watermark_paste_positions)} stałych pozycji dla siatki wideo/GIF.")
+        except Exception as e_calc:
+            logging.error(f"Błąd podczas obliczania pozycji siatki WM: {e_calc}. Znak wodny może być wycentrowany.")
+            self._fixed_watermark_paste_positions = None # Fallback do centrowania
+
+    def _open_video_writer(self, file_path: str, capture_mode: str, fps: float, width: int, height: int) -> Tuple[Any, str]:
+        """Otwiera cv2.VideoWriter z kodekiem VIDEO_FOURCC (fallback: XVID/AVI). Zwraca (writer, ścieżka pliku)."""
+        # Sprawdź poprawność FourCC
+        if not isinstance(VIDEO_FOURCC, str) or len(VIDEO_FOURCC) != 4:
+             logging.error(f"Nieprawidłowy kod FourCC: '{VIDEO_FOURCC}'. Używam 'mp4v'.")
+             fourcc_code = "mp4v"
+        else:
+             fourcc_code = VIDEO_FOURCC
+
+        fourcc = cv2.VideoWriter_fourcc(*fourcc_code)
+        logging.debug(f"Inicjalizacja VideoWriter: {file_path}, FourCC: {fourcc_code}, FPS: {fps}, Rozmiar: {width}x{height}")
+        video_writer = cv2.VideoWriter(file_path, fourcc, fps, (width, height))
+
+        if not video_writer.isOpened():
+            # To częsty problem, jeśli brakuje odpowiednich kodeków w systemie
+            error_msg = f"Nie można otworzyć VideoWriter dla pliku: {file_path}. Sprawdź kodek ({fourcc_code}) i uprawnienia do zapisu."
+            logging.error(error_msg)
+            # Spróbuj z innym kodekiem jako fallback? Np. 'XVID' dla AVI
+            if fourcc_code != 'XVID':
+                logging.warning("Próba fallbacku na kodek XVID (wymaga rozszerzenia .avi)")
+                file_path = self._get_capture_filename("avi", capture_mode) # Nowa nazwa pliku
+                fourcc = cv2.VideoWriter_fourcc(*'XVID')
+                video_writer = cv2.VideoWriter(file_path, fourcc, fps, (width, height))
+                if not video_writer.isOpened():
+                     error_msg += "\nFallback na XVID również zawiódł."
+                     raise IOError(error_msg)
+                else:
+                     logging.info("Fallback na XVID udany. Zapisuję jako AVI.")
+            else:
+                 raise IOError(error_msg) # Jeśli 'XVID' już był próbowany
+        return video_writer, file_path
+
     def _capture_video(self) -> None:
         """Nagrywa wideo ekranu (MP4/AVI) przez określony czas z opcjonalnym znakiem wodnym."""
         # Sprawdzenia wstępne
@@ -1933,53 +4762,21 @@ class TimechainWidget:
         try:
             # Pobierz rozmiar ekranu (użyj preferowanej metody)
             screen_size = None
-            if PYAUTOGUI_AVAILABLE:
-                 try: screen_size = pyautogui.size()
-                 except Exception as e: logging.warning(f"Pyautogui.size() error: {e}")
-            if screen_size is None and IMAGEGRAB_AVAILABLE:
-                 try:
-                      temp_im = ImageGrab.grab()
-                      if temp_im: screen_size = temp_im.size
-                 except Exception as e: logging.warning(f"ImageGrab.grab() for size error: {e}")
+            try: screen_size = self._screen_grabber.size()
+            except Exception as e: logging.warning(f"Błąd pobierania rozmiaru ekranu ({self._screen_grabber.name}): {e}")
 
             if screen_size is None or not all(s > 0 for s in screen_size):
                  raise RuntimeError("Nie można określić rozmiaru ekranu.")
 
-            width, height = screen_size
-            logging.debug(f"Rozmiar ekranu dla wideo: {width}x{height}")
-
-            # Inicjalizuj VideoWriter
-            # Sprawdź poprawność FourCC
-            if not isinstance(VIDEO_FOURCC, str) or len(VIDEO_FOURCC) != 4:
-                 logging.error(f"Nieprawidłowy kod FourCC: '{VIDEO_FOURCC}'. Używam 'mp4v'.")
-                 fourcc_code = "mp4v"
-            else:
-                 fourcc_code = VIDEO_FOURCC
+            # Nagrywaj tylko wybrany obszar - koszt przechwytywania i kodowania zależy od jego rozmiaru
+            capture_region = self._get_capture_region()
+            width, height = capture_region[2:] if capture_region else screen_size
+            logging.debug(f"Rozmiar klatek wideo: {width}x{height} (obszar: {capture_region or 'cały ekran'})")
 
-            fourcc = cv2.VideoWriter_fourcc(*fourcc_code)
+            # Inicjalizuj VideoWriter (z fallbackiem na XVID/AVI)
             # Ustaw FPS (klatki na sekundę) - 20.0 to rozsądna wartość
             fps = 20.0
-            logging.debug(f"Inicjalizacja VideoWriter: {file_path}, FourCC: {fourcc_code}, FPS: {fps}, Rozmiar: {width}x{height}")
-            video_writer = cv2.VideoWriter(file_path, fourcc, fps, (width, height))
-
-            if not video_writer.isOpened():
-                # To częsty problem, jeśli brakuje odpowiednich kodeków w systemie
-                error_msg = f"Nie można otworzyć VideoWriter dla pliku: {file_path}. Sprawdź kodek ({fourcc_code}) i uprawnienia do zapisu."
-                logging.error(error_msg)
-                # Spróbuj z innym kodekiem jako fallback? Np. 'XVID' dla AVI
-                if fourcc_code != 'XVID':
-                    logging.warning("Próba fallbacku na kodek XVID (wymaga rozszerzenia .avi)")
-                    file_extension = "avi"
-                    file_path = self._get_capture_filename(file_extension, capture_mode) # Nowa nazwa pliku
-                    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-                    video_writer = cv2.VideoWriter(file_path, fourcc, fps, (width, height))
-                    if not video_writer.isOpened():
-                         error_msg += "\nFallback na XVID również zawiódł."
-                         raise IOError(error_msg)
-                    else:
-                         logging.info("Fallback na XVID udany. Zapisuję jako AVI.")
-                else:
-                     raise IOError(error_msg) # Jeśli 'XVID' już był próbowany
+            video_writer, file_path = self._open_video_writer(file_path, capture_mode, fps, width, height)
 
 
             # Przygotuj tekst znaku wodnego (jeśli potrzebny)
@@ -1988,37 +4785,7 @@ class TimechainWidget:
                 watermark_text = self._create_watermark_text()
                 logging.debug("Znak wodny włączony dla wideo.")
                 # Jeśli siatka, oblicz stałe pozycje dla spójności
-                if self._watermark_mode_var.get().isdigit() and int(self._watermark_mode_var.get()) in [3, 5, 8]:
-                     num_wm = int(self._watermark_mode_var.get())
-                     # Potrzebujemy przybliżonych wymiarów stempla, aby obliczyć pozycje
-                     # Stworzymy tymczasowy stempel tylko do pomiaru
-                     try:
-                         font_path_wm = self._get_main_font_path()
-                         font_wm = ImageFont.truetype(font_path_wm, WATERMARK_FONT_SIZE) if font_path_wm else ImageFont.load_default()
-                         temp_img_wm = Image.new("RGBA", (1,1))
-                         temp_draw_wm = ImageDraw.Draw(temp_img_wm)
-                         bbox_wm = temp_draw_wm.textbbox((0,0), watermark_text, font=font_wm, spacing=4)
-                         stamp_w_approx = bbox_wm[2] - bbox_wm[0] + 20 # Szerokość + marginesy
-                         stamp_h_approx = bbox_wm[3] - bbox_wm[1] + 20 # Wysokość + marginesy
-                         # Utwórz tymczasowy obrócony stempel tylko dla rozmiaru
-                         temp_stamp_img = Image.new("RGBA", (max(1,stamp_w_approx), max(1,stamp_h_approx)), (0,0,0,0))
-                         resample_m = Image.Resampling.BICUBIC if hasattr(Image, 'Resampling') else Image.BICUBIC
-                         rotated_temp_stamp = temp_stamp_img.rotate(WATERMARK_ANGLE, resample=resample_m, expand=True)
-                         rotated_w, rotated_h = rotated_temp_stamp.size
-
-                         # Zainicjuj ziarno i generator losowości
-                         self._video_gif_random_seed = int(time.time() * 1000) % 100000
-                         random_gen = random.Random(self._video_gif_random_seed)
-                         # Oblicz i zapisz pozycje
-                         self._fixed_watermark_paste_positions = self._calculate_grid_paste_positions_seeded(
-                             width, height, num_wm, rotated_w, rotated_h, random_gen
-                         )
-                         logging.info(f"Obliczono {len(self._fixed_watermark_paste_positions)} stałych pozycji dla siatki wideo/GIF.")
-                         del temp_img_wm, temp_draw_wm, temp_stamp_img, rotated_temp_stamp # Zwolnij pamięć
-
-                     except Exception as e_calc:
-                          logging.error(f"Błąd podczas obliczania pozycji siatki WM: {e_calc}. Znak wodny może być wycentrowany.")
-                          self._fixed_watermark_paste_positions = None # Fallback do centrowania
+                self._prepare_fixed_watermark_positions(width, height, watermark_text)
 
 
             # Ukryj widget, jeśli trzeba
@@ -2031,74 +4798,26 @@ class TimechainWidget:
                 self.master.after(0, self._hide_widget_for_capture)
                 time.sleep(0.2) # Czas na ukrycie
 
-            # Pętla nagrywania
-            start_time = time.monotonic() # Użyj monotonicznego zegara
-            #frame_count = 0 # Przeniesiono inicjalizację wyżej
-            last_frame_time = start_time
-            min_frame_interval = 1.0 / fps # Minimalny czas między klatkami
-
-            logging.info("Rozpoczęto pętlę nagrywania klatek wideo...")
-            while time.monotonic() - start_time < duration:
-                 # Sprawdź, czy nie anulowano lub nie zatrzymano z zewnątrz
-                 if self._cancel_update or self._key_listener_stop_event.is_set():
-                     logging.info("Nagrywanie wideo przerwane przez użytkownika lub zamknięcie.")
-                     break
-
-                 current_time = time.monotonic()
-                 # Przechwytuj klatkę tylko jeśli minął minimalny interwał
-                 if current_time >= last_frame_time + min_frame_interval:
-                     # Przechwyć klatkę
-                     img = None
-                     capture_method = "pyautogui" if PYAUTOGUI_AVAILABLE else "ImageGrab" if IMAGEGRAB_AVAILABLE else "none"
-                     try:
-                         if capture_method == "pyautogui":
-                              img = pyautogui.screenshot()
-                         elif capture_method == "ImageGrab":
-                              img = ImageGrab.grab()
-                         else: # Powinno być obsłużone wcześniej, ale na wszelki wypadek
-                              break # Zakończ pętlę, jeśli nie ma jak przechwytywać
-                     except Exception as e_capture:
-                          logging.warning(f"Błąd przechwytywania klatki wideo ({capture_method}): {e_capture}")
-                          # Pomiń tę klatkę, spróbuj następną
-                          time.sleep(0.01) # Krótka pauza
-                          continue
-
-                     if img is None:
-                         logging.warning("Nie udało się przechwycić klatki wideo (zwrócono None).")
-                         time.sleep(0.01)
-                         continue
-
-                     # Konwertuj obraz PIL do formatu OpenCV (BGR)
-                     try:
-                          frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                     except Exception as e_conv:
-                          logging.error(f"Błąd konwersji klatki PIL->CV2: {e_conv}")
-                          continue # Pomiń tę klatkę
-
-                     # Dodaj znak wodny (jeśli włączony)
-                     if watermark_text:
-                          try:
-                              # Przekaż obliczone pozycje, jeśli są dostępne
-                              frame = self._add_watermark_cv2(frame, watermark_text, self._fixed_watermark_paste_positions)
-                          except Exception as e_wm:
-                               logging.error(f"Błąd dodawania znaku wodnego do klatki wideo: {e_wm}")
-                               # Kontynuuj bez znaku wodnego dla tej klatki? Lub przerwij? Kontynuujmy.
-
-                     # Zapisz klatkę do pliku wideo
-                     try:
-                          video_writer.write(frame)
-                          frame_count += 1
-                     except Exception as e_write:
-                          logging.error(f"Błąd zapisu klatki wideo: {e_write}")
-                          # Jeśli zapis zawodzi, prawdopodobnie nie ma sensu kontynuować
-                          break
-
-
-                     last_frame_time = current_time # Zaktualizuj czas ostatniej zapisanej klatki
-                 else:
-                      # Czekaj krótko, aby nie zużywać 100% CPU
-                      time.sleep(0.005) # 5ms
-
+            # Potok nagrywania: przechwytywanie -> znak wodny (pula wątków) -> zapis w kolejności
+            process_frame = None
+            if watermark_text:
+                # Stempel i pozycje zamrożone przed startem puli - wątki robocze tylko mieszają piksele
+                overlay = self._prepare_watermark_overlay(watermark_text, width, height, self._fixed_watermark_paste_positions)
+                if overlay is not None:
+                    process_frame = lambda f: self._blend_watermark_overlay(f, overlay)
+            pipeline = VideoRecordingPipeline(
+                grab_frame=lambda: self._screen_grabber.grab_bgr(capture_region),
+                write_frame=video_writer.write,
+                fps=fps,
+                duration=duration,
+                process_frame=process_frame,
+                should_stop=lambda: self._cancel_update or self._key_listener_stop_event.is_set()
+            )
+            logging.info(f"Rozpoczęto potok nagrywania klatek wideo ({VIDEO_PIPELINE_WORKERS} wątków znaku wodnego)...")
+            pipeline_stats = pipeline.run()
+            frame_count = pipeline_stats['written']
+            if pipeline_stats['dropped'] or pipeline_stats['late']:
+                logging.warning(f"Potok wideo nie nadążał: odrzucono {pipeline_stats['dropped']}, spóźnionych {pipeline_stats['late']} klatek.")
 
             logging.info(f"Zakończono pętlę nagrywania. Przechwycono {frame_count} klatek.")
 
@@ -2218,7 +4937,8 @@ class TimechainWidget:
         file_path = self._get_capture_filename("gif", capture_mode)
         duration = self._gif_duration_seconds
         frame_interval = max(0.02, GIF_FRAME_DURATION_MS / 1000.0) # Sekundy, min 20ms (50 FPS max)
-        frames: List[Image.Image] = [] # Lista do przechowywania klatek (obrazów PIL)
+        gif_writer: Optional[StreamingGifWriter] = None # Strumieniowy zapis klatek na dysk
+        frame_count = 0
         original_visibility_state = False
         # Resetuj/Inicjalizuj stan znaku wodnego
         self._fixed_watermark_paste_positions = None
@@ -2228,14 +4948,8 @@ class TimechainWidget:
         try:
             # Pobierz rozmiar ekranu (potrzebny do obliczenia pozycji WM)
             screen_size = None
-            if PYAUTOGUI_AVAILABLE:
-                 try: screen_size = pyautogui.size()
-                 except Exception as e: logging.warning(f"Pyautogui.size() error: {e}")
-            if screen_size is None and IMAGEGRAB_AVAILABLE:
-                 try:
-                      temp_im = ImageGrab.grab()
-                      if temp_im: screen_size = temp_im.size
-                 except Exception as e: logging.warning(f"ImageGrab.grab() for size error: {e}")
+            try: screen_size = self._screen_grabber.size()
+            except Exception as e: logging.warning(f"Błąd pobierania rozmiaru ekranu ({self._screen_grabber.name}): {e}")
 
             if screen_size is None or not all(s > 0 for s in screen_size):
                  logging.warning("Nie można określić rozmiaru ekranu dla GIF WM. Pozycje siatki mogą być niedokładne.")
@@ -2244,38 +4958,19 @@ class TimechainWidget:
                  width, height = screen_size
                  logging.debug(f"Rozmiar ekranu dla GIF: {width}x{height}")
 
+            # Nagrywaj tylko wybrany obszar (pozycje znaku wodnego liczone względem niego)
+            capture_region = self._get_capture_region()
+            if capture_region:
+                 width, height = capture_region[2:]
+                 logging.debug(f"Obszar przechwytywania GIF: {capture_region}")
+
 
             # Przygotuj tekst znaku wodnego i oblicz stałe pozycje (jeśli siatka)
             watermark_text = None
             if capture_mode == SCREENSHOT_MODE_WATERMARK:
                 watermark_text = self._create_watermark_text()
                 logging.debug("Znak wodny włączony dla GIF.")
-                if self._watermark_mode_var.get().isdigit() and int(self._watermark_mode_var.get()) in [3, 5, 8] and width > 0 and height > 0:
-                     num_wm = int(self._watermark_mode_var.get())
-                     try:
-                         # Podobnie jak w wideo, oblicz przybliżone wymiary i pozycje
-                         font_path_wm = self._get_main_font_path()
-                         font_wm = ImageFont.truetype(font_path_wm, WATERMARK_FONT_SIZE) if font_path_wm else ImageFont.load_default()
-                         temp_img_wm = Image.new("RGBA", (1,1))
-                         temp_draw_wm = ImageDraw.Draw(temp_img_wm)
-                         bbox_wm = temp_draw_wm.textbbox((0,0), watermark_text, font=font_wm, spacing=4)
-                         stamp_w_approx = bbox_wm[2] - bbox_wm[0] + 20
-                         stamp_h_approx = bbox_wm[3] - bbox_wm[1] + 20
-                         temp_stamp_img = Image.new("RGBA", (max(1,stamp_w_approx), max(1,stamp_h_approx)), (0,0,0,0))
-                         resample_m = Image.Resampling.BICUBIC if hasattr(Image, 'Resampling') else Image.BICUBIC
-                         rotated_temp_stamp = temp_stamp_img.rotate(WATERMARK_ANGLE, resample=resample_m, expand=True)
-                         rotated_w, rotated_h = rotated_temp_stamp.size
-
-                         self._video_gif_random_seed = int(time.time() * 1000) % 100000
-                         random_gen = random.Random(self._video_gif_random_seed)
-                         self._fixed_watermark_paste_positions = self._calculate_grid_paste_positions_seeded(
-                             width, height, num_wm, rotated_w, rotated_h, random_gen
-                         )
-                         logging.info(f"Obliczono {len(self._fixed_watermark_paste_positions)} stałych pozycji dla siatki GIF.")
-                         del temp_img_wm, temp_draw_wm, temp_stamp_img, rotated_temp_stamp
-                     except Exception as e_calc:
-                          logging.error(f"Błąd podczas obliczania pozycji siatki WM dla GIF: {e_calc}. Znak wodny może być wycentrowany.")
-                          self._fixed_watermark_paste_positions = None
+                self._prepare_fixed_watermark_positions(width, height, watermark_text)
 
 
             # Ukryj widget, jeśli trzeba
@@ -2288,6 +4983,9 @@ class TimechainWidget:
                 self.master.after(0, self._hide_widget_for_capture)
                 time.sleep(0.2) # Czas na ukrycie
 
+            # Klatki są kodowane i zapisywane na bieżąco - pamięć nie rośnie z czasem nagrania
+            gif_writer = StreamingGifWriter(file_path, loop=0)
+
             # Pętla przechwytywania klatek
             start_time = time.monotonic()
             last_capture_time = start_time - frame_interval # Aby przechwycić pierwszą klatkę od razu
@@ -2302,16 +5000,10 @@ class TimechainWidget:
                  if current_time >= last_capture_time + frame_interval:
                      # Przechwyć klatkę (jako obraz PIL)
                      img = None
-                     capture_method = "pyautogui" if PYAUTOGUI_AVAILABLE else "ImageGrab" if IMAGEGRAB_AVAILABLE else "none"
                      try:
-                         if capture_method == "pyautogui":
-                              img = pyautogui.screenshot()
-                         elif capture_method == "ImageGrab":
-                              img = ImageGrab.grab()
-                         else:
-                              break # Zakończ pętlę
+                         img = self._screen_grabber.grab_image(region=capture_region)
                      except Exception as e_capture:
-                          logging.warning(f"Błąd przechwytywania klatki GIF ({capture_method}): {e_capture}")
+                          logging.warning(f"Błąd przechwytywania klatki GIF ({self._screen_grabber.name}): {e_capture}")
                           time.sleep(0.01)
                           continue # Pomiń tę klatkę
 
@@ -2330,65 +5022,32 @@ class TimechainWidget:
                                logging.error(f"Błąd dodawania znaku wodnego do klatki GIF: {e_wm}")
                                # Dodaj oryginalną klatkę bez WM
 
-                     # Dodaj przetworzoną klatkę do listy
-                     # Konwersja do RGB może zmniejszyć rozmiar pliku GIF, ale traci przezroczystość (jeśli była)
-                     # Dla GIF lepiej użyć .quantize() dla optymalizacji palety, ale to bardziej złożone.
-                     # Na razie zostawmy w oryginalnym formacie lub konwertujmy do RGB. Spróbujmy RGB.
+                     # Przekaż klatkę do kodera (konwersja do RGB tworzy niezależną kopię)
                      try:
-                          # Użycie copy() może zapobiec problemom z modyfikacją tego samego obiektu
-                          frames.append(frame_to_append.copy().convert('RGB'))
+                          gif_writer.add_frame(frame_to_append.convert('RGB'), GIF_FRAME_DURATION_MS)
+                          frame_count += 1
+                     except IOError:
+                          raise # Koder zawiódł - dalsze nagrywanie nie ma sensu
                      except Exception as e_conv:
-                          logging.error(f"Błąd konwersji/kopiowania klatki GIF: {e_conv}. Pomijam klatkę.")
+                          logging.error(f"Błąd konwersji klatki GIF: {e_conv}. Pomijam klatkę.")
 
 
                      last_capture_time = current_time
                  else:
                       time.sleep(0.005) # Czekaj krótko
 
-            logging.info(f"Zakończono pętlę przechwytywania GIF. Zebrano {len(frames)} klatek.")
+            logging.info(f"Zakończono pętlę przechwytywania GIF. Zebrano {frame_count} klatek.")
 
-            # Zapisz GIF, jeśli zebrano jakieś klatki
-            if not frames:
+            # Dokończ kodowanie i opublikuj plik GIF
+            logging.debug(f"Finalizowanie pliku GIF: {file_path}")
+            frames_written = gif_writer.close()
+            if not frames_written:
                 if not self._cancel_update: # Tylko jeśli nie anulowano celowo
                      raise RuntimeError("Nie zebrano żadnych klatek do utworzenia pliku GIF.")
                 else:
                      logging.info("Anulowano przed zebraniem klatek GIF.")
                      # Nie pokazuj błędu, jeśli anulowano
             else:
-                logging.debug(f"Zapisywanie {len(frames)} klatek do pliku GIF: {file_path}")
-                # Pierwsza klatka inicjuje plik, reszta jest dołączana
-                # save_all=True - zapisz wszystkie klatki
-                # append_images=frames[1:] - lista pozostałych klatek
-                # duration=GIF_FRAME_DURATION_MS - czas wyświetlania każdej klatki w ms
-                # loop=0 - zapętlaj w nieskończoność
-                # optimize=True - może pomóc zmniejszyć rozmiar pliku
-                try:
-                     frames[0].save(
-                         file_path,
-                         save_all=True,
-                         append_images=frames[1:],
-                         duration=GIF_FRAME_DURATION_MS,
-                         loop=0,
-                         optimize=True # Włącz optymalizację
-                     )
-                except Exception as e_save:
-                     logging.error(f"Błąd podczas zapisu pliku GIF (optymalizacja włączona): {e_save}")
-                     # Spróbuj zapisać bez optymalizacji jako fallback
-                     try:
-                          logging.warning("Próba zapisu GIF bez optymalizacji...")
-                          frames[0].save(
-                              file_path,
-                              save_all=True,
-                              append_images=frames[1:],
-                              duration=GIF_FRAME_DURATION_MS,
-                              loop=0,
-                              optimize=False
-                          )
-                     except Exception as e_save_no_opt:
-                          logging.critical(f"Błąd podczas zapisu pliku GIF (nawet bez optymalizacji): {e_save_no_opt}", exc_info=True)
-                          raise IOError(f"Nie można zapisać pliku GIF: {e_save_no_opt}") from e_save_no_opt
-
-
                 # Sprawdź, czy plik został poprawnie zapisany
                 if not os.path.exists(file_path):
                      raise IOError(f"Plik GIF nie został utworzony po zapisie: {file_path}")
@@ -2396,7 +5055,7 @@ class TimechainWidget:
                      os.remove(file_path)
                      raise IOError(f"Zapisany plik GIF jest pusty: {file_path}")
 
-                logging.info(f"GIF zapisano pomyślnie: {file_path} (klatki: {len(frames)}, rozmiar: {os.path.getsize(file_path)} bajtów)")
+                logging.info(f"GIF zapisano pomyślnie: {file_path} (klatki: {frames_written}, scalone: {gif_writer.frames_merged}, rozmiar: {os.path.getsize(file_path)} bajtów)")
                 msg_pl = f"Nagrywanie GIF zakończone.\nZapisano: {file_path}"
                 msg_en = f"GIF recording finished.\nSaved: {file_path}"
                 self.master.after(0, lambda: messagebox.showinfo(
@@ -2426,8 +5085,9 @@ class TimechainWidget:
             if original_visibility_state:
                 self.master.after(50, self._safely_restore_widget_visibility)
 
-            # Wyczyść listę klatek, aby zwolnić pamięć
-            frames.clear()
+            # Przerwij koder, jeśli nie został zamknięty (błąd) - usuwa niedokończony plik
+            if gif_writer is not None:
+                gif_writer.abort()
 
              # Sprawdź czy plik istnieje i nie jest pusty (jeśli nie było wyjątku wcześniej)
             if 'e' not in locals() and os.path.exists(file_path): # Jeśli nie było wyjątku w try
@@ -2445,6 +5105,214 @@ class TimechainWidget:
             self._video_gif_random_seed = None
             logging.debug("Zakończono wątek przechwytywania GIF.")
 
+    # --- Natychmiastowa Powtórka (bufor pierścieniowy) ---
+
+    def _start_replay_recorder(self) -> None:
+        """Uruchamia wątek, który trzyma w pamięci ostatnie REPLAY_BUFFER_SECONDS sekund ekranu."""
+        if self._replay_thread and self._replay_thread.is_alive() and not self._replay_stop_event.is_set():
+            return
+        if not CV2_AVAILABLE or not NUMPY_AVAILABLE:
+            logging.error("Bufor powtórki niedostępny: brak modułów opencv-python lub numpy.")
+            self._replay_enabled_var.set(False)
+            self.master.after(0, lambda: messagebox.showerror(
+                 'Brak Modułów' if self.lang == 'pl' else 'Modules Missing',
+                 'Bufor powtórki wymaga zainstalowania opencv-python i numpy.' if self.lang == 'pl' else 'The replay buffer requires opencv-python and numpy to be installed.',
+                 parent=self.master
+             ))
+            return
+
+        # Nowe zdarzenie stop - poprzedni wątek (jeśli jeszcze się kończy) ma swoje własne
+        self._replay_stop_event = threading.Event()
+        self._replay_buffer = ReplayRingBuffer()
+        self._replay_thread = threading.Thread(target=self._replay_recorder_loop,
+                                               args=(self._replay_buffer, self._replay_stop_event),
+                                               name="ReplayRecorder", daemon=True)
+        self._replay_thread.start()
+        logging.info(f"Uruchomiono bufor powtórki ({REPLAY_BUFFER_SECONDS}s, {REPLAY_FPS} FPS, "
+                     f"budżet {REPLAY_MAX_BUFFER_BYTES // (1024 * 1024)} MB).")
+
+    def _stop_replay_recorder(self) -> None:
+        """Zatrzymuje wątek bufora powtórki i zwalnia zgromadzone klatki."""
+        self._replay_stop_event.set()
+        self._replay_buffer = None # Wątek trzyma własną referencję do czasu zakończenia
+        logging.info("Zatrzymano bufor powtórki.")
+
+    def _toggle_replay_buffer(self) -> None:
+        """Włącza/wyłącza bufor powtórki (opcja menu kontekstowego)."""
+        if self._replay_enabled_var.get():
+            self._start_replay_recorder()
+        else:
+            self._stop_replay_recorder()
+
+    def _start_replay_save_thread(self) -> None:
+        """Uruchamia zapis powtórki w wątku roboczym (jak skróty klawiszowe)."""
+        threading.Thread(target=self._save_replay, name="CaptureWorker-Replay", daemon=True).start()
+
+    def _replay_recorder_loop(self, replay_buffer: ReplayRingBuffer, stop_event: threading.Event) -> None:
+        """Pętla wątku bufora powtórki: przechwytuje klatki w stałym rytmie REPLAY_FPS."""
+        frame_interval = 1.0 / max(0.1, REPLAY_FPS)
+        next_frame_time = time.monotonic()
+        grab_errors = 0
+        frame = None # Klatka BGR wielokrotnego użytku - append() od razu ją kompresuje
+        logging.debug("Wątek bufora powtórki uruchomiony.")
+        while not stop_event.is_set() and not self._cancel_update:
+            try:
+                # Obszar wyznaczany co klatkę (okolica widgetu podąża za oknem); zmiana rozmiaru czyści bufor
+                frame = self._screen_grabber.grab_bgr(self._get_capture_region(), out=frame)
+                if frame is None or not replay_buffer.append(frame):
+                    raise RuntimeError("backend nie zwrócił klatki lub kodowanie JPEG zawiodło")
+                grab_errors = 0
+            except Exception as e:
+                grab_errors += 1
+                if grab_errors == 1 or grab_errors % 50 == 0:
+                    logging.warning(f"Błąd przechwytywania klatki bufora powtórki ({self._screen_grabber.name}, {grab_errors}x): {e}")
+
+            # Stały rytm bez dryfu; jeśli nie nadążamy - pomijamy zaległe sloty zamiast nadrabiać
+            next_frame_time += frame_interval
+            now = time.monotonic()
+            if next_frame_time < now:
+                next_frame_time = now
+            stop_event.wait(next_frame_time - now)
+
+        replay_buffer.clear()
+        logging.debug(f"Wątek bufora powtórki zakończony (usunięto {replay_buffer.evicted} najstarszych klatek podczas pracy).")
+
+    def _iter_replay_frames(self, frames: List[Tuple[float, bytes]], watermark_text: Optional[str]):
+        """Dekoduje klatki z bufora powtórki i (opcjonalnie) nakłada znak wodny. Zwraca pary (czas, klatka BGR)."""
+        for timestamp, data in frames:
+            frame = ReplayRingBuffer.decode(data)
+            if frame is None:
+                logging.warning("Nie udało się zdekodować klatki z bufora powtórki. Pomijam.")
+                continue
+            if watermark_text:
+                try:
+                    frame = self._add_watermark_cv2(frame, watermark_text, self._fixed_watermark_paste_positions)
+                except Exception as e_wm:
+                    logging.error(f"Błąd dodawania znaku wodnego do klatki powtórki: {e_wm}")
+            yield timestamp, frame
+
+    def _save_replay(self) -> None:
+        """Zapisuje zawartość bufora powtórki (ostatnie N sekund) jako wideo lub GIF.
+
+        Bufor nagrywa w tle bez ukrywania widgetu, więc w trybie znaku wodnego
+        widget może być widoczny na klatkach powtórki.
+        """
+        if self._cancel_update:
+             logging.info("Zapis powtórki anulowany (widget zamykany).")
+             return
+        replay_buffer = self._replay_buffer
+        if replay_buffer is None:
+            logging.warning("Zapis powtórki odrzucony: bufor powtórki jest wyłączony.")
+            self.master.after(0, lambda: messagebox.showwarning(
+                'Powtórka Wyłączona' if self.lang == 'pl' else 'Replay Disabled',
+                'Włącz bufor w menu: Natychmiastowa Powtórka.' if self.lang == 'pl' else 'Enable the buffer in the menu: Instant Replay.',
+                parent=self.master
+            ))
+            return
+        if self._active_capture_thread and self._active_capture_thread.is_alive():
+            logging.warning("Zapis powtórki odrzucony: inny wątek przechwytywania jest aktywny.")
+            self.master.after(0, lambda: messagebox.showwarning(
+                'Przechwytywanie Aktywne' if self.lang == 'pl' else 'Capture Active',
+                'Inny proces przechwytywania jest już w toku.' if self.lang == 'pl' else 'Another capture process is already running.',
+                parent=self.master
+            ))
+            return
+
+        self._active_capture_thread = threading.current_thread()
+        # Migawka bufora - nagrywanie w tle trwa dalej
+        frames, frame_size = replay_buffer.snapshot()
+        capture_mode = self._screenshot_mode_var.get()
+        output_gif = REPLAY_OUTPUT_FORMAT == "gif"
+        self._fixed_watermark_paste_positions = None
+        self._video_gif_random_seed = None
+        file_path = None
+        frames_written = 0
+
+        try:
+            if not frames or frame_size is None:
+                raise RuntimeError("Bufor powtórki jest pusty." if self.lang == 'pl' else "The replay buffer is empty.")
+            width, height = frame_size
+            logging.info(f"Zapisywanie powtórki: {len(frames)} klatek, {frames[-1][0] - frames[0][0]:.1f}s, "
+                         f"{width}x{height}, format: {'GIF' if output_gif else 'wideo'}.")
+
+            watermark_text = None
+            if capture_mode == SCREENSHOT_MODE_WATERMARK:
+                watermark_text = self._create_watermark_text()
+                self._prepare_fixed_watermark_positions(width, height, watermark_text)
+            replay_frames = self._iter_replay_frames(frames, watermark_text)
+
+            if output_gif:
+                file_path = self._get_capture_filename("gif", capture_mode)
+                gif_writer = StreamingGifWriter(file_path, loop=0)
+                try:
+                    previous = None
+                    for timestamp, frame in replay_frames:
+                        # Czas trwania klatki = odstęp do następnej (zachowuje tempo mimo pominiętych slotów)
+                        if previous is not None:
+                            gif_writer.add_frame(previous[1], max(20, int(round((timestamp - previous[0]) * 1000))))
+                        previous = (timestamp, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+                    if previous is not None:
+                        gif_writer.add_frame(previous[1], int(round(1000.0 / REPLAY_FPS)))
+                    frames_written = gif_writer.close()
+                finally:
+                    gif_writer.abort() # Nic nie robi po udanym close()
+            else:
+                file_extension = "mp4" if "mp4" in VIDEO_FOURCC.lower() else "avi" if "av" in VIDEO_FOURCC.lower() else "mkv"
+                file_path = self._get_capture_filename(file_extension, capture_mode)
+                video_writer, file_path = self._open_video_writer(file_path, capture_mode, REPLAY_FPS, width, height)
+                try:
+                    start_ts = None
+                    last_frame = None
+                    next_slot = 0
+                    for timestamp, frame in replay_frames:
+                        if start_ts is None:
+                            start_ts = timestamp
+                        slot = int(round((timestamp - start_ts) * REPLAY_FPS))
+                        # Luki w osi czasu wypełnij powtórzeniem poprzedniej klatki
+                        while last_frame is not None and next_slot < slot:
+                            video_writer.write(last_frame)
+                            frames_written += 1
+                            next_slot += 1
+                        video_writer.write(frame)
+                        frames_written += 1
+                        next_slot += 1
+                        last_frame = frame
+                finally:
+                    video_writer.release()
+
+            if not frames_written:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise RuntimeError("Nie udało się zapisać żadnej klatki powtórki.")
+            if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+                raise IOError(f"Plik powtórki nie został poprawnie zapisany: {file_path}")
+
+            logging.info(f"Powtórkę zapisano pomyślnie: {file_path} (klatki: {frames_written}, rozmiar: {os.path.getsize(file_path)} bajtów)")
+            msg_pl = f"Zapisano powtórkę (ostatnie {REPLAY_BUFFER_SECONDS}s):\n{file_path}"
+            msg_en = f"Replay saved (last {REPLAY_BUFFER_SECONDS}s):\n{file_path}"
+            self.master.after(0, lambda: messagebox.showinfo(
+                'Zapisano' if self.lang == 'pl' else 'Saved',
+                msg_pl if self.lang == 'pl' else msg_en,
+                parent=self.master
+            ))
+
+        except Exception as e:
+            logging.error(f"Błąd podczas zapisu powtórki: {e}", exc_info=True)
+            error_msg_pl = f"Wystąpił błąd podczas zapisu powtórki:\n{e}"
+            error_msg_en = f"An error occurred while saving the replay:\n{e}"
+            if not self._cancel_update:
+                self.master.after(0, lambda: messagebox.showerror(
+                    'Błąd Powtórki' if self.lang == 'pl' else 'Replay Error',
+                    error_msg_pl if self.lang == 'pl' else error_msg_en,
+                    parent=self.master
+                ))
+        finally:
+            # Zresetuj flagę aktywnego wątku i stan WM
+            self._active_capture_thread = None
+            self._fixed_watermark_paste_positions = None
+            self._video_gif_random_seed = None
+            logging.debug("Zakończono wątek zapisu powtórki.")
+
     # --- Obsługa Globalnych Skrótów Klawiszowych (pynput) ---
 
     def _on_global_key_press(self, key: Any) -> None:
@@ -2456,7 +5324,8 @@ class TimechainWidget:
         actions = {
             keyboard.Key.print_screen: (self._capture_screenshot, "Screenshot"),
             keyboard.Key.f9: (self._capture_video, "Video"),
-            keyboard.Key.f10: (self._capture_gif, "GIF")
+            keyboard.Key.f10: (self._capture_gif, "GIF"),
+            keyboard.Key.f8: (self._save_replay, "Replay")
         }
 
         # Normalizuj klucz (niektóre systemy mogą zwracać różne obiekty dla tego samego klawisza)
@@ -2609,14 +5478,20 @@ if __name__ == "__main__":
     else:
         logging.info(f"Uruchomiono w trybie nieinteraktywnym, używam domyślnych ustawień (lang='{lang}', prompt='{prompt}').")
 
+    startup_timer = StartupTimer(_STARTUP_STARTED)
+    startup_timer.mark("imports", _STARTUP_IMPORTS_DONE)
+    if is_interactive:
+        startup_timer.mark("interactive_setup") # Czas oczekiwania na odpowiedzi użytkownika
+
     # Inicjalizacja Tkinter
     root = tk.Tk()
     root.withdraw() # Ukryj główne okno root, używamy tylko widgetu
+    startup_timer.mark("tk_init")
 
     # Utwórz instancję widgetu
     app = None
     try:
-         app = TimechainWidget(root, prompt, lang)
+         app = TimechainWidget(root, prompt, lang, startup_timer=startup_timer)
 
          # Uruchom główną pętlę Tkinter
          logging.info("Uruchamianie głównej pętli Tkinter.")
@@ -2675,6 +5550,47 @@ if __name__ == "__main__":
              if app._active_capture_thread.is_alive():
                   logging.warning("Aktywny wątek przechwytywania nie zakończył się w oczekiwanym czasie.")
 
+        # Poczekaj na zakończenie wątku bufora powtórki (używa tego samego backendu przechwytywania)
+        if app and app._replay_thread and app._replay_thread.is_alive():
+             app._replay_stop_event.set()
+             app._replay_thread.join(timeout=1.0)
+             if app._replay_thread.is_alive():
+                  logging.warning("Wątek bufora powtórki nie zakończył się w oczekiwanym czasie.")
+
+        # Zapisz oczekujące wpisy cache API na dysk
+        if app:
+             try:
+                  app._api_cache.flush()
+                  logging.info(f"Statystyki cache API: {app._api_cache.stats}")
+                  logging.info(f"Dostawcy API: {app._providers.stats()}")
+             except Exception as e_cache_flush:
+                  logging.error(f"Błąd podczas zapisu cache API: {e_cache_flush}")
+
+        # Zamknij indeks bloków (zapisuje zmapowane strony na dysk)
+        if app and app._header_index is not None:
+             try:
+                  app._header_index.close()
+             except Exception as e_index_close:
+                  logging.error(f"Błąd podczas zamykania indeksu bloków: {e_index_close}")
+
+        # Zamknij połączenia HTTP z puli
+        if app:
+             try:
+                  app._providers.close()
+                  app._http_client.close()
+                  if app._node_rpc is not None:
+                       app._node_rpc.close()
+             except Exception as e_http_close:
+                  logging.error(f"Błąd podczas zamykania klienta HTTP: {e_http_close}")
+
+        # Zwolnij zasoby backendu przechwytywania (np. segmenty pamięci współdzielonej X11)
+        if app and not (app._active_capture_thread and app._active_capture_thread.is_alive()) \
+                and not (app._replay_thread and app._replay_thread.is_alive()):
+             try:
+                  app._screen_grabber.close()
+             except Exception as e_grab_close:
+                  logging.error(f"Błąd podczas zamykania backendu przechwytywania: {e_grab_close}")
+
 
         # Upewnij się, że okno root jest zniszczone (jeśli _safe_destroy nie zadziałało)
         try: